@@ -0,0 +1,251 @@
+"""
+Admission control: per-class concurrency limits with bounded queues.
+
+Every request is put in a class by its route template and method:
+
+    write   POST / PUT / PATCH / DELETE
+    heavy   reads that load or scan a lot: full listings, search, export,
+            the change feed and the analytics aggregations (HEAVY_ROUTES)
+    light   every other read
+
+Each class runs at most `limit` requests at once; the next `queue` requests
+wait in FIFO order and anything beyond that is refused immediately with 503
+and a Retry-After estimated from the class's recent service time.  A request
+that waits longer than ADMISSION_QUEUE_TIMEOUT is refused the same way.
+Writes come first: a free heavy slot isn't handed out while writes are
+waiting, so a burst of dashboard refreshes can't starve task updates of the
+database.  Light reads are cheap and have slots of their own, so they never
+wait for writes.
+
+ADMISSION_LIMITS overrides the defaults, e.g. `heavy=4/16,write=32/512`
+(limit/queue per class).  Health checks, /metrics, the event stream and the
+debug endpoints are never queued.
+
+The limits are per worker process.  Queue waits, rejections, running and queued
+requests are exported on /metrics.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Dict, NamedTuple, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+import metrics
+
+WRITE, LIGHT, HEAVY = "write", "light", "heavy"
+# Admission order when several classes have requests waiting
+PRIORITY = (WRITE, LIGHT, HEAVY)
+# The classes whose waiting requests hold a class back even when it has free slots
+YIELDS_TO = {HEAVY: (WRITE,)}
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+HEAVY_ROUTES = {
+    "/clients/", "/clients/all", "/comments/search", "/export", "/changes",
+    "/analytics/summary", "/analytics/clients", "/analytics/trends",
+}
+EXEMPT_ROUTES = {
+    "/health", "/health/db", "/metrics", "/events", "/events/stats",
+    "/debug/sql-profiles", "/debug/sql-profiles/{profile_id}", metrics.UNMATCHED,
+}
+
+QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+# Assumed service time before a class has finished any request
+INITIAL_SERVICE_SECONDS = 0.1
+SMOOTHING = 0.1
+
+QUEUE_WAIT = Histogram(
+    "admission_queue_wait_seconds", "Time requests waited for admission", ("class",), registry=metrics.registry,
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REJECTED = Counter(
+    "admission_rejected_total", "Requests refused with 503", ("class", "reason"), registry=metrics.registry,
+)
+RUNNING = Gauge(
+    "admission_running", "Admitted requests in progress", ("class",), registry=metrics.registry,
+    multiprocess_mode="livesum",
+)
+QUEUED = Gauge(
+    "admission_queued", "Requests waiting for admission", ("class",), registry=metrics.registry,
+    multiprocess_mode="livesum",
+)
+
+
+class Limit(NamedTuple):
+    limit: int
+    queue: int
+
+
+DEFAULT_LIMITS = {
+    WRITE: Limit(32, 512),
+    LIGHT: Limit(64, 256),
+    HEAVY: Limit(4, 32),
+}
+
+
+def parse_limits(value: str) -> Dict[str, Limit]:
+    """`heavy=4/16,write=32/512` on top of DEFAULT_LIMITS"""
+    limits = dict(DEFAULT_LIMITS)
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        name, _, spec = item.partition("=")
+        limit, _, queue = spec.partition("/")
+        name = name.strip()
+        if name not in limits:
+            raise ValueError(f"Unknown admission class {name!r}")
+        limits[name] = Limit(max(1, int(limit)), max(0, int(queue or limits[name].queue)))
+    return limits
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RouteClass:
+    """Running and waiting requests of one class"""
+
+    def __init__(self, name: str, limit: Limit):
+        self.name = name
+        self.limit = limit.limit
+        self.queue = limit.queue
+        self.running = 0
+        self.waiters: deque = deque()
+        self.service_seconds = INITIAL_SERVICE_SECONDS
+
+    def retry_after(self) -> int:
+        """Seconds until the requests ahead would have drained at the current pace"""
+        backlog = self.running + len(self.waiters)
+        return max(1, math.ceil(backlog * self.service_seconds / self.limit))
+
+    def observe(self, seconds: float) -> None:
+        self.service_seconds += SMOOTHING * (seconds - self.service_seconds)
+
+
+class Controller:
+    """Hands out slots per class, higher-priority waiters first"""
+
+    def __init__(self, limits: Dict[str, Limit], queue_timeout: float = QUEUE_TIMEOUT):
+        self.classes = {name: RouteClass(name, limits[name]) for name in PRIORITY}
+        self.queue_timeout = queue_timeout
+
+    def _blocked_by_priority(self, route_class: RouteClass) -> bool:
+        return any(self.classes[name].waiters for name in YIELDS_TO.get(route_class.name, ()))
+
+    def _admit(self, route_class: RouteClass) -> None:
+        route_class.running += 1
+        RUNNING.labels(route_class.name).inc()
+
+    async def acquire(self, name: str) -> float:
+        """Wait for a slot; return the time waited.  Raises Rejected."""
+        route_class = self.classes[name]
+        if (route_class.running < route_class.limit and not route_class.waiters
+                and not self._blocked_by_priority(route_class)):
+            self._admit(route_class)
+            return 0.0
+        if len(route_class.waiters) >= route_class.queue:
+            raise Rejected("queue_full", route_class.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        route_class.waiters.append(waiter)
+        QUEUED.labels(name).inc()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            # Unless it was handed a slot just as the wait expired
+            if not waiter.done():
+                self._leave_queue(route_class, waiter)
+                raise Rejected("timeout", route_class.retry_after())
+        except BaseException:
+            # Cancelled (the client went away) while waiting or just after being admitted
+            if waiter.done():
+                self.release(name, 0.0)
+            else:
+                self._leave_queue(route_class, waiter)
+            raise
+        return time.perf_counter() - started
+
+    def _leave_queue(self, route_class: RouteClass, waiter: asyncio.Future) -> None:
+        waiter.cancel()
+        route_class.waiters.remove(waiter)
+        QUEUED.labels(route_class.name).dec()
+        # Classes yielding to this one may have been waiting on it
+        self._wake()
+
+    def release(self, name: str, seconds: float) -> None:
+        route_class = self.classes[name]
+        route_class.running -= 1
+        RUNNING.labels(name).dec()
+        if seconds:
+            route_class.observe(seconds)
+        self._wake()
+
+    def _wake(self) -> None:
+        for name in PRIORITY:
+            route_class = self.classes[name]
+            if self._blocked_by_priority(route_class):
+                continue
+            while route_class.waiters and route_class.running < route_class.limit:
+                waiter = route_class.waiters.popleft()
+                QUEUED.labels(name).dec()
+                self._admit(route_class)
+                waiter.set_result(None)
+
+
+def classify(scope) -> Optional[str]:
+    """The admission class of a request, or None for requests that are never queued"""
+    if scope["method"] == "OPTIONS":
+        return None
+    route = metrics.route_template(scope)
+    if route in EXEMPT_ROUTES:
+        return None
+    if scope["method"] in WRITE_METHODS:
+        return WRITE
+    return HEAVY if route in HEAVY_ROUTES else LIGHT
+
+
+class AdmissionMiddleware:
+    """Queue or refuse requests per class before they reach the application"""
+
+    def __init__(self, app, limits: Optional[str] = None):
+        self.app = app
+        self.controller = Controller(parse_limits(limits if limits is not None else os.getenv("ADMISSION_LIMITS", "")))
+
+    async def __call__(self, scope, receive, send):
+        name = classify(scope) if scope["type"] == "http" else None
+        if name is None:
+            return await self.app(scope, receive, send)
+
+        try:
+            waited = await self.controller.acquire(name)
+        except Rejected as e:
+            REJECTED.labels(name, e.reason).inc()
+            return await self._refuse(send, e)
+        QUEUE_WAIT.labels(name).observe(waited)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(name, time.perf_counter() - started)
+
+    @staticmethod
+    async def _refuse(send, rejected: Rejected) -> None:
+        body = b'{"detail":"Server busy, retry later"}'
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(rejected.retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
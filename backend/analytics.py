@@ -0,0 +1,217 @@
+"""
+Analytics endpoints.
+
+All counts are computed with GROUP BY over the tasks table so the dashboard
+only receives a few aggregated series instead of the full client list.
+Results are cached until the next committed write to tasks or clients.
+Lead times and SLA hit rates come from the statistics leadtime.py keeps up to
+date on every task write, so they cost a few rows whatever the history.  An
+"analytics" job (see jobs.py) recomputes the summary of a window in the
+background and caches it, so the next dashboard load doesn't wait for it.
+"""
+
+from datetime import date, timedelta
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import cache
+from database import AsyncSessionLocal, get_async_db
+import jobs
+import leadtime
+from models import Client, LeadTimeStat, Task, TaskPriority, TaskStatus
+from tasks import day_range
+import schemas
+
+router = APIRouter(prefix="/analytics", tags=["analytics"])
+
+STATUS_ORDER = [status.value for status in TaskStatus]
+PRIORITY_ORDER = [priority.value for priority in TaskPriority]
+
+_completed = case((Task.status == TaskStatus.COMPLETED.value, 1), else_=0)
+
+
+def _date_window(start_date: Optional[date], end_date: Optional[date]) -> list:
+    """Filters on Task.date for an inclusive [start_date, end_date] window"""
+    return day_range(Task.date, start_date, end_date)
+
+
+def _ordered_series(counts: dict, order: List[str]) -> schemas.CountSeries:
+    labels = order + sorted(label for label in counts if label not in order)
+    return schemas.CountSeries(labels=labels, data=[counts.get(label, 0) for label in labels])
+
+
+async def _cached(key, compute, tables=("tasks", "clients")):
+    result = cache.get(key)
+    if result is None:
+        version = cache.version
+        result = await compute()
+        cache.set(key, result, tables=tables, version=version)
+    return result
+
+
+async def count_by_status(db: AsyncSession, start_date=None, end_date=None) -> schemas.CountSeries:
+    rows = await db.execute(
+        select(Task.status, func.count(Task.id))
+        .where(*_date_window(start_date, end_date))
+        .group_by(Task.status)
+    )
+    return _ordered_series(dict(rows.all()), STATUS_ORDER)
+
+
+async def count_by_priority(db: AsyncSession, start_date=None, end_date=None) -> schemas.CountSeries:
+    rows = await db.execute(
+        select(Task.priority, func.count(Task.id))
+        .where(*_date_window(start_date, end_date))
+        .group_by(Task.priority)
+    )
+    return _ordered_series(dict(rows.all()), PRIORITY_ORDER)
+
+
+async def completion_by_client(db: AsyncSession, start_date=None, end_date=None) -> List[schemas.ClientCompletion]:
+    # The window goes into the join condition so clients without tasks in
+    # range are still listed with a 0% completion rate.
+    rows = await db.execute(
+        select(
+            Client.id,
+            Client.name,
+            func.count(Task.id),
+            func.coalesce(func.sum(_completed), 0),
+        )
+        .outerjoin(Task, and_(Task.client_id == Client.id, *_date_window(start_date, end_date)))
+        .group_by(Client.id, Client.name)
+        .order_by(Client.name)
+    )
+    return [
+        schemas.ClientCompletion(
+            client_id=client_id,
+            client_name=name,
+            total_tasks=total,
+            completed_tasks=completed,
+            completion_rate=(completed / total) * 100 if total else 0.0,
+        )
+        for client_id, name, total, completed in rows
+    ]
+
+
+async def task_trends(db: AsyncSession, start_date=None, end_date=None) -> schemas.TaskTrends:
+    rows = await db.execute(
+        select(Task.date, func.count(Task.id), func.sum(_completed))
+        .where(*_date_window(start_date, end_date))
+        .group_by(Task.date)
+    )
+    by_day = {day.isoformat(): (created, completed) for day, created, completed in rows}
+
+    # Fill the requested range with zeros so the chart has a continuous axis
+    if start_date and end_date:
+        current = start_date
+        while current <= end_date:
+            by_day.setdefault(current.isoformat(), (0, 0))
+            current += timedelta(days=1)
+
+    labels = sorted(by_day)
+    return schemas.TaskTrends(
+        labels=labels,
+        created=[by_day[label][0] for label in labels],
+        completed=[by_day[label][1] for label in labels],
+    )
+
+
+async def summary(db: AsyncSession, start_date=None, end_date=None) -> schemas.AnalyticsSummary:
+    by_status = await count_by_status(db, start_date, end_date)
+    completed = dict(zip(by_status.labels, by_status.data)).get(TaskStatus.COMPLETED.value, 0)
+    return schemas.AnalyticsSummary(
+        total_tasks=sum(by_status.data),
+        completed_tasks=completed,
+        tasks_by_status=by_status,
+        tasks_by_priority=await count_by_priority(db, start_date, end_date),
+        completion_rate_by_client=await completion_by_client(db, start_date, end_date),
+        task_trends=await task_trends(db, start_date, end_date),
+    )
+
+
+async def lead_time_stats(db: AsyncSession, by: str, key: Optional[str] = None) -> schemas.LeadTimeStats:
+    query = select(LeadTimeStat).where(LeadTimeStat.dimension == by)
+    if key is not None:
+        query = query.where(LeadTimeStat.key == key)
+    groups = []
+    for stat in await db.scalars(query.order_by(LeadTimeStat.key)):
+        median, p90, p99 = (leadtime.Sketch.loads(stat.sketch).quantile(q) for q in leadtime.QUANTILES)
+        outcomes = stat.sla_met + stat.sla_missed
+        groups.append(schemas.LeadTimeGroup(
+            key=stat.key,
+            completed_tasks=stat.completed,
+            median_seconds=median,
+            p90_seconds=p90,
+            p99_seconds=p99,
+            sla_met=stat.sla_met,
+            sla_missed=stat.sla_missed,
+            sla_hit_rate=(stat.sla_met / outcomes) * 100 if outcomes else None,
+        ))
+    if by == "priority":
+        rank = {priority: index for index, priority in enumerate(PRIORITY_ORDER)}
+        groups.sort(key=lambda group: rank.get(group.key, len(rank)))
+    return schemas.LeadTimeStats(by=by, groups=groups)
+
+
+class RecomputeParams(BaseModel):
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+
+
+@jobs.job_type("analytics", concurrency=1, params=RecomputeParams)
+async def recompute_summary(run: jobs.Run) -> dict:
+    """Job handler: compute the summary of a window and cache it for GET /analytics/summary"""
+    params = RecomputeParams.model_validate(run.params)
+    version = cache.version
+    async with AsyncSessionLocal() as db:
+        result = await summary(db, params.start_date, params.end_date)
+    cache.set(("summary", params.start_date, params.end_date), result, tables=("tasks", "clients"), version=version)
+    return {"total_tasks": result.total_tasks, "completed_tasks": result.completed_tasks}
+
+
+# ======================================================================
+# ENDPOINTS
+# ======================================================================
+
+@router.get("/summary", response_model=schemas.AnalyticsSummary)
+async def get_summary(start_date: Optional[date] = None, end_date: Optional[date] = None, db: AsyncSession = Depends(get_async_db)):
+    """All dashboard series in one response"""
+    return await _cached(("summary", start_date, end_date), lambda: summary(db, start_date, end_date))
+
+@router.get("/status", response_model=schemas.CountSeries)
+async def get_status_counts(start_date: Optional[date] = None, end_date: Optional[date] = None, db: AsyncSession = Depends(get_async_db)):
+    """Task counts per status"""
+    return await _cached(("status", start_date, end_date), lambda: count_by_status(db, start_date, end_date))
+
+@router.get("/priority", response_model=schemas.CountSeries)
+async def get_priority_counts(start_date: Optional[date] = None, end_date: Optional[date] = None, db: AsyncSession = Depends(get_async_db)):
+    """Task counts per priority"""
+    return await _cached(("priority", start_date, end_date), lambda: count_by_priority(db, start_date, end_date))
+
+@router.get("/clients", response_model=List[schemas.ClientCompletion])
+async def get_client_completion(start_date: Optional[date] = None, end_date: Optional[date] = None, db: AsyncSession = Depends(get_async_db)):
+    """Completion rate per client"""
+    return await _cached(("clients", start_date, end_date), lambda: completion_by_client(db, start_date, end_date))
+
+@router.get("/trends", response_model=schemas.TaskTrends)
+async def get_task_trends(start_date: Optional[date] = None, end_date: Optional[date] = None, db: AsyncSession = Depends(get_async_db)):
+    """Created vs completed tasks per day"""
+    return await _cached(("trends", start_date, end_date), lambda: task_trends(db, start_date, end_date))
+
+@router.get("/lead-time", response_model=schemas.LeadTimeStats)
+async def get_lead_time(
+    by: Literal["all", "client", "priority", "month"] = "all",
+    key: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Lead-time median/p90/p99 and SLA hit rate of completed tasks, overall or per client, priority or month.
+
+    `key` picks one group, e.g. `by=month&key=2024-05`.
+    """
+    return await _cached(
+        ("lead-time", by, key), lambda: lead_time_stats(db, by, key), tables=(LeadTimeStat.__tablename__,),
+    )
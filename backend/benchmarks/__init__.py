@@ -0,0 +1,9 @@
+"""
+Performance benchmarks; each module runs as a script (see the README).
+
+    dataset.py            seeded synthetic clients, tasks and comments, bulk-loaded
+    endpoints.py          every route in-process, JSON results, baseline comparison
+    concurrency.py        throughput of one route on a running server
+    event_subscribers.py  /events fan-out to thousands of idle streams
+    serialization.py      client listing: pydantic vs the orjson fast path
+"""
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Concurrency benchmark for a running API server.
+
+Fires a fixed number of GET requests at each concurrency level and reports
+throughput and latency percentiles, so you can check that throughput grows
+with parallel clients instead of flattening at one request at a time.
+
+    uvicorn main:app --port 8000
+    python benchmarks/concurrency.py --url http://localhost:8000 --path "/clients/?limit=50"
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def run_level(client: httpx.AsyncClient, path: str, concurrency: int, total: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/clients/?limit=50")
+    parser.add_argument("--levels", default="1,2,4,8,16,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=500, help="requests per level")
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=max(int(level) for level in args.levels.split(",")))
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        await client.get(args.path)  # warm up
+
+        print(f"{'clients':>8} {'req/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'errors':>8}")
+        for level in args.levels.split(","):
+            result = await run_level(client, args.path, int(level), args.requests)
+            print(
+                f"{result['concurrency']:>8} {result['throughput']:>10.1f} "
+                f"{result['p50_ms']:>10.2f} {result['p95_ms']:>10.2f} {result['errors']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
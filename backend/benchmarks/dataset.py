@@ -0,0 +1,148 @@
+"""
+Deterministic synthetic dataset for the benchmarks.
+
+The same (clients, tasks, comments, seed, today) always produces the same
+rows.  Rows are generated lazily and bulk-inserted in chunks, so seeding a
+large database needs little memory and the benchmark's peak RSS reflects the
+API rather than the generator.
+
+Distributions, roughly what a busy deployment looks like:
+
+    client size   skewed: a few clients own most of the tasks
+    task date     uniform over the year before `today`
+    status        55% completed, 20% pending, 15% in progress, 10% awaiting client
+    priority      30% low, 50% medium, 20% high
+    SLA date      80% of tasks, 1-30 days after the task date, so open tasks
+                  fall in every SLA bucket
+    completion    0-20 days after the task date (exponential), capped at today
+    comments      spread over the tasks, log-normal length (median ~80 chars)
+"""
+
+import random
+from datetime import date, datetime, time, timedelta, timezone
+from itertools import islice
+from typing import Iterator, NamedTuple, Optional
+
+STATUSES = ("completed", "pending", "in progress", "awaiting client")
+STATUS_WEIGHTS = (55, 20, 15, 10)
+PRIORITIES = ("low", "medium", "high")
+PRIORITY_WEIGHTS = (30, 50, 20)
+ORIGINS = ("web", "email", "phone", "referral", "partner")
+AUTHORS = ("User", "Ana", "Bruno", "Carla", "Diego", "Support")
+SLA_SHARE = 0.8
+
+WORDS = (
+    "client asked about the invoice deadline follow up call scheduled review "
+    "contract draft sent waiting approval from legal team update the report "
+    "meeting moved to next week priority changed after feedback delivered "
+    "files uploaded check the numbers again before closing this ticket"
+).split()
+
+CHUNK_SIZE = 5000
+
+
+def _utc(day: date, seconds: int) -> datetime:
+    return datetime.combine(day, time.min, tzinfo=timezone.utc) + timedelta(seconds=seconds)
+
+
+class Dataset(NamedTuple):
+    clients: int
+    tasks: int
+    comments: int
+    seed: int = 0
+    today: Optional[date] = None
+
+    @property
+    def reference_date(self) -> date:
+        return self.today or datetime.now(timezone.utc).date()
+
+    def _rng(self, table: str) -> random.Random:
+        return random.Random(f"{self.seed}:{table}")
+
+    @staticmethod
+    def client_id(n: int) -> str:
+        return f"C{n:06}"
+
+    @staticmethod
+    def comment_id(n: int) -> str:
+        return f"K{n:07}"
+
+    def client_rows(self) -> Iterator[dict]:
+        rng = self._rng("clients")
+        for n in range(self.clients):
+            yield {
+                "id": self.client_id(n),
+                "name": f"Client {n}",
+                "company": f"{rng.choice(('Acme', 'Globex', 'Initech', 'Umbrella', 'Stark'))} {n}",
+                "origin": rng.choice(ORIGINS),
+                "revision": 1,
+            }
+
+    def task_rows(self) -> Iterator[dict]:
+        rng = self._rng("tasks")
+        today = self.reference_date
+        for task_id in range(1, self.tasks + 1):
+            day = today - timedelta(days=rng.randrange(365))
+            status = rng.choices(STATUSES, STATUS_WEIGHTS)[0]
+            created = _utc(day, rng.randrange(8 * 3600, 18 * 3600))
+            row = {
+                "id": task_id,
+                "client_id": self.client_id(int(self.clients * rng.random() ** 3)),
+                "date": day,
+                "description": " ".join(rng.choices(WORDS, k=rng.randint(3, 12))).capitalize(),
+                "status": status,
+                "priority": rng.choices(PRIORITIES, PRIORITY_WEIGHTS)[0],
+                "sla_date": day + timedelta(days=rng.randint(1, 30)) if rng.random() < SLA_SHARE else None,
+                "completion_date": None,
+                "creation_timestamp": created,
+                "completion_timestamp": None,
+                "revision": 1,
+            }
+            if status == "completed":
+                done = min(created + timedelta(days=rng.expovariate(1 / 5)), _utc(today, 0))
+                row["completion_date"] = max(done.date(), day)
+                row["completion_timestamp"] = max(done, created)
+            yield row
+
+    def comment_rows(self) -> Iterator[dict]:
+        rng = self._rng("comments")
+        today = self.reference_date
+        for n in range(self.comments):
+            length = min(2000, max(5, int(rng.lognormvariate(4.4, 0.8))))
+            text = ""
+            while len(text) < length:
+                text += rng.choice(WORDS) + " "
+            yield {
+                "id": self.comment_id(n),
+                "task_id": rng.randint(1, self.tasks),
+                "text": text[:length].strip() or "ok",
+                "timestamp": _utc(today - timedelta(days=rng.randrange(365)), rng.randrange(86400)),
+                "author": rng.choice(AUTHORS),
+                "revision": 1,
+            }
+
+
+def load(bind, dataset: Dataset, chunk_size: int = CHUNK_SIZE) -> None:
+    """Bulk-insert the dataset into an empty, fully migrated database"""
+    from sqlalchemy import insert
+    from sqlalchemy.orm import Session
+
+    import leadtime
+    import search
+    from models import Client, Comment, SyncState, Task
+
+    with bind.begin() as conn:
+        for table, rows in (
+            (Client.__table__, dataset.client_rows()),
+            (Task.__table__, dataset.task_rows()),
+            (Comment.__table__, dataset.comment_rows()),
+        ):
+            while chunk := list(islice(rows, chunk_size)):
+                conn.execute(insert(table), chunk)
+        conn.execute(insert(SyncState.__table__).values(id=1, revision=1))
+    # Creates the FTS index after the insert: one rebuild instead of a trigger per row
+    search.init_search_index(bind)
+    # The lead-time stats the API would have kept up to date while the tasks were completed
+    with Session(bind) as session:
+        leadtime.rebuild(session, chunk_size)
+        session.commit()
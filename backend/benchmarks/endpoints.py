@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Endpoint benchmark: every API route, in-process, on a synthetic dataset.
+
+Seeds a scratch SQLite database (or an empty --database) with the dataset
+from benchmarks/dataset.py, then drives each scenario below through the ASGI
+app with --concurrency parallel clients and reports, per scenario, latency
+percentiles, throughput and the process's peak RSS as JSON.  With --baseline
+it compares against a saved result and exits with 1 when a scenario got
+slower (p95), lost throughput or the process grew by more than --tolerance.
+
+    python benchmarks/endpoints.py --output baseline.json
+    python benchmarks/endpoints.py --baseline baseline.json
+
+Read scenarios run first, then writes, then deletes of the rows the writes
+created, so the seeded dataset is the same for every read.  GET /events is
+left out (its stream never ends); benchmarks/event_subscribers.py covers it.
+Run in-process, client and server share the CPU: compare results from the
+same machine only.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, NamedTuple, Optional
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.dataset import PRIORITIES, STATUSES, WORDS, Dataset  # noqa: E402
+
+SLA_BUCKETS = ("overdue", "due_today", "due_this_week", "on_track")
+BATCH_OPERATIONS = 20
+
+
+class Scenario(NamedTuple):
+    name: str
+    method: str
+    request: Callable  # (rng, state) -> (path, httpx keyword arguments)
+    share: float = 1.0  # of --requests
+    record: Optional[Callable] = None  # (state, response), to remember what was created
+
+
+class State:
+    """What the scenarios need to know about the data: the dataset and the rows created so far"""
+
+    def __init__(self, dataset: Dataset):
+        self.dataset = dataset
+        self.clients = []
+        self.tasks = []
+        self.comments = []
+        self.jobs = []
+        self.created = 0
+
+    def client_id(self, rng) -> str:
+        return self.dataset.client_id(rng.randrange(self.dataset.clients))
+
+    def task_id(self, rng) -> int:
+        return rng.randint(1, self.dataset.tasks)
+
+    def new_client_id(self) -> str:
+        self.created += 1
+        return f"B{self.created:06}"
+
+    def window(self, rng) -> dict:
+        """Half the time a random date range, otherwise everything"""
+        if rng.random() < 0.5:
+            return {}
+        end = self.dataset.reference_date - timedelta(days=rng.randrange(365))
+        return {"start_date": (end - timedelta(days=rng.randint(7, 90))).isoformat(), "end_date": end.isoformat()}
+
+
+def _get(path: str, **params):
+    return path, {"params": params} if params else {}
+
+
+def _new_task(rng, state: State) -> dict:
+    day = state.dataset.reference_date - timedelta(days=rng.randrange(30))
+    return {
+        "client_id": state.client_id(rng),
+        "date": day.isoformat(),
+        "description": " ".join(rng.choices(WORDS, k=6)),
+        "status": rng.choice(STATUSES[1:]),
+        "priority": rng.choice(PRIORITIES),
+        "sla_date": (day + timedelta(days=rng.randint(1, 30))).isoformat(),
+    }
+
+
+def _import_file(rng, state: State):
+    lines = [
+        json.dumps({"id": state.new_client_id(), "name": "Imported", "company": "Import Co", "origin": "import",
+                    "tasks": [_new_task(rng, state) for _ in range(5)]})
+        for _ in range(10)
+    ]
+    return "/import/", {"files": {"file": ("clients.ndjson", "\n".join(lines).encode())}}
+
+
+def _new_comment(rng, state: State):
+    task_id = state.task_id(rng)
+    return f"/tasks/{task_id}/comments/", {
+        "json": {"task_id": task_id, "text": " ".join(rng.choices(WORDS, k=15)), "author": "Benchmark"}
+    }
+
+
+def _pop(pool: list, fallback):
+    return pool.pop() if pool else fallback
+
+
+SCENARIOS = [
+    # Reads
+    Scenario("health", "GET", lambda rng, s: _get("/health")),
+    Scenario("health_db", "GET", lambda rng, s: _get("/health/db")),
+    Scenario("clients_page", "GET", lambda rng, s: _get("/clients/", limit=50, cursor=s.client_id(rng))),
+    Scenario("clients_all", "GET", lambda rng, s: _get("/clients/all"), share=0.05),
+    Scenario("client_detail", "GET", lambda rng, s: _get(f"/clients/{s.client_id(rng)}")),
+    Scenario("tasks_filtered", "GET", lambda rng, s: _get(
+        "/tasks/", status=rng.choice(STATUSES), priority=rng.choice(PRIORITIES),
+        sort=rng.choice(("date", "sla_date", "creation_timestamp")), limit=100,
+    )),
+    Scenario("tasks_by_client", "GET", lambda rng, s: _get("/tasks/", client_id=s.client_id(rng), limit=100)),
+    Scenario("task_comments", "GET", lambda rng, s: _get(f"/tasks/{s.task_id(rng)}/comments/")),
+    Scenario("comment_search", "GET", lambda rng, s: _get("/comments/search", q=rng.choice(WORDS), limit=50)),
+    Scenario("sla_summary", "GET", lambda rng, s: _get("/sla/summary")),
+    Scenario("sla_tasks", "GET", lambda rng, s: _get("/sla/tasks", bucket=rng.choice(SLA_BUCKETS), limit=100)),
+    Scenario("analytics_summary", "GET", lambda rng, s: _get("/analytics/summary", **s.window(rng))),
+    Scenario("analytics_status", "GET", lambda rng, s: _get("/analytics/status", **s.window(rng))),
+    Scenario("analytics_priority", "GET", lambda rng, s: _get("/analytics/priority", **s.window(rng))),
+    Scenario("analytics_clients", "GET", lambda rng, s: _get("/analytics/clients", **s.window(rng))),
+    Scenario("analytics_trends", "GET", lambda rng, s: _get("/analytics/trends", **s.window(rng))),
+    Scenario("analytics_lead_time", "GET", lambda rng, s: _get(
+        "/analytics/lead-time", by=rng.choice(("all", "client", "priority", "month")),
+    )),
+    Scenario("changes", "GET", lambda rng, s: _get("/changes", since=0, limit=1000)),
+    Scenario("events_stats", "GET", lambda rng, s: _get("/events/stats")),
+    Scenario("export", "GET", lambda rng, s: _get("/export"), share=0.02),
+    # Writes
+    Scenario(
+        "create_client", "POST",
+        lambda rng, s: ("/clients/", {"json": {"id": s.new_client_id(), "name": "New", "company": "New Co",
+                                               "origin": "web"}}),
+        record=lambda s, response: s.clients.append(response.json()["id"]),
+    ),
+    Scenario(
+        "create_client_only", "POST",
+        lambda rng, s: ("/clients-only/", {"json": {"id": s.new_client_id(), "name": "New", "company": "New Co",
+                                                    "origin": "web"}}),
+        record=lambda s, response: s.clients.append(response.json()["id"]),
+    ),
+    Scenario("update_client", "PUT", lambda rng, s: (f"/clients/{s.client_id(rng)}", {"json": {"origin": "email"}})),
+    Scenario(
+        "create_task", "POST", lambda rng, s: ("/tasks/", {"json": _new_task(rng, s)}),
+        record=lambda s, response: s.tasks.append(response.json()["id"]),
+    ),
+    Scenario("update_task", "PUT", lambda rng, s: (
+        f"/tasks/{s.task_id(rng)}", {"json": {"status": rng.choice(STATUSES), "priority": rng.choice(PRIORITIES)}}
+    )),
+    Scenario("task_batch", "POST", lambda rng, s: ("/tasks/batch", {"json": {"operations": [
+        {"op": "update", "id": s.task_id(rng), "changes": {"priority": rng.choice(PRIORITIES)}}
+        for _ in range(BATCH_OPERATIONS)
+    ]}}), share=0.25),
+    Scenario(
+        "create_comment", "POST", _new_comment,
+        record=lambda s, response: s.comments.append(response.json()["id"]),
+    ),
+    Scenario(
+        "import_upload", "POST", _import_file, share=0.05,
+        record=lambda s, response: s.jobs.append(response.json()["id"]),
+    ),
+    Scenario("import_status", "GET", lambda rng, s: _get(f"/import/{rng.choice(s.jobs or ['missing'])}"), share=0.25),
+    Scenario("import_data", "POST", lambda rng, s: ("/import-data/", {}), share=0.02),
+    # Deletes, of the rows created above
+    Scenario("delete_comment", "DELETE", lambda rng, s: (f"/comments/{_pop(s.comments, 'missing')}", {})),
+    Scenario("delete_task", "DELETE", lambda rng, s: (f"/tasks/{_pop(s.tasks, 0)}", {})),
+    Scenario("delete_client", "DELETE", lambda rng, s: (f"/clients/{_pop(s.clients, 'missing')}", {})),
+]
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, state: State, seed: int,
+                       requests: int, concurrency: int) -> dict:
+    rng = random.Random(f"{seed}:{scenario.name}")
+    total = max(1, round(requests * scenario.share))
+    remaining = total
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            path, kwargs = scenario.request(rng, state)
+            started = time.perf_counter()
+            response = await client.request(scenario.method, path, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+            elif scenario.record:
+                scenario.record(state, response)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def run(app, dataset: Dataset, requests: int = 200, concurrency: int = 8,
+              only: Optional[set] = None, progress=None) -> dict:
+    """Drive the scenarios through `app`, already seeded with `dataset`; returns the results document"""
+    state = State(dataset)
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            await client.get("/health")  # warm up
+            for scenario in SCENARIOS:
+                if only and scenario.name not in only:
+                    continue
+                results[scenario.name] = await run_scenario(
+                    client, scenario, state, dataset.seed, requests, concurrency
+                )
+                if progress:
+                    progress(scenario.name, results[scenario.name])
+
+    return {
+        "meta": {
+            "dataset": {**dataset._asdict(), "today": dataset.reference_date.isoformat()},
+            "requests": requests,
+            "concurrency": concurrency,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+        },
+        "scenarios": results,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.2, min_delta_ms: float = 1.0) -> list:
+    """Regressions of `results` against `baseline`, as messages.
+
+    A scenario regresses when its p95 grows by more than `tolerance` (and
+    `min_delta_ms`, so sub-millisecond jitter doesn't count) or its throughput
+    drops by more than `tolerance`; the process when its peak RSS grows by
+    more than `tolerance`.
+    """
+    regressions = []
+    for name, base in baseline.get("scenarios", {}).items():
+        current = results["scenarios"].get(name)
+        if current is None:
+            continue
+        if (current["p95_ms"] > base["p95_ms"] * (1 + tolerance)
+                and current["p95_ms"] - base["p95_ms"] > min_delta_ms):
+            regressions.append(f"{name}: p95 {base['p95_ms']:.2f} -> {current['p95_ms']:.2f} ms")
+        if current["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {base['throughput_rps']:.1f} -> {current['throughput_rps']:.1f} req/s"
+            )
+        if current["errors"] > base["errors"]:
+            regressions.append(f"{name}: errors {base['errors']} -> {current['errors']}")
+    if "peak_rss_mb" in baseline and results["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"peak RSS {baseline['peak_rss_mb']:.1f} -> {results['peak_rss_mb']:.1f} MB")
+    return regressions
+
+
+def _print_row(name: str, result: dict) -> None:
+    print(
+        f"{name:<20} {result['requests']:>6} {result['errors']:>6} {result['p50_ms']:>9.2f} "
+        f"{result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['throughput_rps']:>9.1f} "
+        f"{result['peak_rss_mb']:>8.1f}",
+        file=sys.stderr,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--tasks", type=int, default=20000)
+    parser.add_argument("--comments", type=int, default=40000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--today", help="reference date of the dataset (default: today); fix it for baselines")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario (scaled by its share)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--scenarios", help="comma-separated scenario names (default: all)")
+    parser.add_argument("--database", help="empty database URL to seed (default: a scratch SQLite file)")
+    parser.add_argument("--output", help="write the JSON results here (default: stdout)")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    scratch = None
+    if args.database:
+        os.environ["DATABASE_URL"] = args.database
+    else:
+        scratch = tempfile.TemporaryDirectory()
+        os.environ["DATABASE_URL"] = f"sqlite:///{scratch.name}/benchmark.db"
+
+    import migrations
+    from benchmarks.dataset import load
+    from database import engine
+    from main import app
+
+    if not migrations.is_new(engine):
+        sys.exit("The benchmark seeds its own data: point --database at an empty database")
+
+    dataset = Dataset(
+        args.clients, args.tasks, args.comments, args.seed,
+        datetime.strptime(args.today, "%Y-%m-%d").date() if args.today else None,
+    )
+    started = time.perf_counter()
+    migrations.create_schema(engine)
+    load(engine, dataset)
+    print(f"Seeded {dataset.clients} clients, {dataset.tasks} tasks, {dataset.comments} comments "
+          f"in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    print(f"{'scenario':<20} {'reqs':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'req/s':>9} {'RSS MB':>8}", file=sys.stderr)
+    only = set(args.scenarios.split(",")) if args.scenarios else None
+    results = asyncio.run(run(app, dataset, args.requests, args.concurrency, only, progress=_print_row))
+
+    document = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(document + "\n")
+    else:
+        print(document)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        if baseline.get("meta", {}).get("dataset") != results["meta"]["dataset"]:
+            print("Warning: the baseline was measured on a different dataset", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of {args.baseline}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Load test for GET /events with thousands of idle subscribers.
+
+Opens --subscribers event streams against a running server, leaves them idle,
+then makes --writes task updates one after another and measures how long each
+event takes to reach every subscriber (from the start of the write request).
+Reports fan-out latency percentiles, lost events and resyncs, and the
+broker's /events/stats; pass --pid to include the server's resident memory.
+
+    uvicorn main:app --port 8000
+    python benchmarks/event_subscribers.py --subscribers 5000 --pid $(pgrep -f "uvicorn main:app")
+
+Every stream is one TCP connection, so raise `ulimit -n` on both ends first.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Optional
+
+import httpx
+
+
+def rss_mb(pid: Optional[int]) -> Optional[float]:
+    if not pid:
+        return None
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+async def subscriber(client: httpx.AsyncClient, connected: asyncio.Event, received: dict, counts: dict):
+    async with client.stream("GET", "/events", params={"topics": "task"}) as response:
+        async for line in response.aiter_lines():
+            if line.startswith("retry:"):
+                counts["connected"] += 1
+                if counts["connected"] == counts["target"]:
+                    connected.set()
+            elif line.startswith("data: "):
+                event = json.loads(line[len("data: "):])
+                if event["type"] == "resync":
+                    counts["resyncs"] += 1
+                else:
+                    received.setdefault(event["revision"], []).append(time.perf_counter())
+
+
+def percentile(values: list, fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--subscribers", type=int, default=2000)
+    parser.add_argument("--writes", type=int, default=20)
+    parser.add_argument("--idle", type=float, default=5, help="seconds to stay idle before writing")
+    parser.add_argument("--pid", type=int, help="server process id, to report its memory")
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=args.subscribers, max_keepalive_connections=0)
+    timeout = httpx.Timeout(60, read=None)
+    received: dict = {}
+    counts = {"connected": 0, "resyncs": 0, "target": args.subscribers}
+    connected = asyncio.Event()
+
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout) as streams, \
+            httpx.AsyncClient(base_url=args.url, timeout=60) as api:
+        rss_before = rss_mb(args.pid)
+        started = time.perf_counter()
+        readers = [
+            asyncio.create_task(subscriber(streams, connected, received, counts))
+            for _ in range(args.subscribers)
+        ]
+        await connected.wait()
+        print(f"{args.subscribers} subscribers connected in {time.perf_counter() - started:.1f}s")
+
+        await asyncio.sleep(args.idle)
+        stats = (await api.get("/events/stats")).json()
+        rss_idle = rss_mb(args.pid)
+
+        client_id = f"bench-{int(time.time())}"
+        await api.post("/clients/", json={"id": client_id, "name": "Bench", "company": "Bench", "origin": "bench"})
+        task = (await api.post("/tasks/", json={
+            "client_id": client_id, "date": "2024-01-01", "description": "bench",
+            "status": "pending", "priority": "low",
+        })).json()
+
+        sent = {}
+        for n in range(args.writes):
+            write_started = time.perf_counter()
+            await api.put(f"/tasks/{task['id']}", json={"description": f"bench {n}"})
+            sent[n] = write_started
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(1)
+
+        # Writes run one at a time, so the last revisions seen are theirs, in order
+        latencies = []
+        revisions = sorted(received)[-args.writes:]
+        for n, revision in enumerate(revisions):
+            latencies += [(arrived - sent[n]) * 1000 for arrived in received[revision]]
+        expected = args.writes * args.subscribers
+
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        await api.delete(f"/clients/{client_id}")
+
+    latencies.sort()
+    print(json.dumps({
+        "subscribers": args.subscribers,
+        "events_expected": expected,
+        "events_received": len(latencies),
+        "resyncs": counts["resyncs"],
+        "fanout_ms": {
+            "p50": round(percentile(latencies, 0.50), 2),
+            "p95": round(percentile(latencies, 0.95), 2),
+            "p99": round(percentile(latencies, 0.99), 2),
+            "max": round(latencies[-1], 2),
+        } if latencies else None,
+        "server_rss_mb": {"before": rss_before, "idle": rss_idle, "per_subscriber_kb":
+                          round((rss_idle - rss_before) * 1024 / args.subscribers, 1)
+                          if rss_before and rss_idle else None},
+        "broker": stats,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Compare the two ways of serializing the client listing.
+
+    pydantic   select(Client) with selectinload, then validate and dump
+               through schemas.Client (what response_model does)
+    fast       plain rows from serialization.load_client_documents, dumped
+               with orjson
+
+Seeds a scratch SQLite database with the given numbers of tasks (10 per
+client, a comment on every other task), checks that both paths produce the
+same bytes and reports the best of --repeat runs for loading and encoding.
+
+    python benchmarks/serialization.py --tasks 10000,100000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+_scratch = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{_scratch.name}/bench.db"
+
+from sqlalchemy import delete, insert  # noqa: E402
+
+import serialization  # noqa: E402
+from database import AsyncSessionLocal, engine  # noqa: E402
+from main import select_clients_with_tasks  # noqa: E402
+from models import Base, Client, Comment, Task  # noqa: E402
+
+TASKS_PER_CLIENT = 10
+
+
+def seed(tasks: int) -> None:
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for model in (Comment, Task, Client):
+            conn.execute(delete(model.__table__))
+        clients = tasks // TASKS_PER_CLIENT
+        conn.execute(insert(Client.__table__), [
+            {"id": f"C{c:07}", "name": f"Client {c}", "company": f"Company {c}", "origin": "web"}
+            for c in range(clients)
+        ])
+        conn.execute(insert(Task.__table__), [
+            {
+                "id": t, "client_id": f"C{t % clients:07}", "date": "2024-05-01",
+                "description": f"Task {t} for a client", "status": "pending", "priority": "medium",
+                "sla_date": "2024-06-01" if t % 3 else None,
+                "creation_timestamp": "2024-05-01T09:00:00+00:00",
+            }
+            for t in range(1, tasks + 1)
+        ])
+        conn.execute(insert(Comment.__table__), [
+            {"id": f"c{t}", "task_id": t, "text": "Looks good to me", "timestamp": "2024-05-02T10:00:00"}
+            for t in range(1, tasks + 1, 2)
+        ])
+
+
+async def pydantic_path() -> tuple:
+    async with AsyncSessionLocal() as db:
+        started = time.perf_counter()
+        clients = (await db.execute(select_clients_with_tasks())).scalars().all()
+        loaded = time.perf_counter()
+        body = serialization.dumps_validated(clients)
+        return body, loaded - started, time.perf_counter() - loaded
+
+
+async def fast_path() -> tuple:
+    async with AsyncSessionLocal() as db:
+        started = time.perf_counter()
+        clients = await serialization.load_client_documents(db, serialization.select_client_rows())
+        loaded = time.perf_counter()
+        body = serialization.dumps(clients)
+        return body, loaded - started, time.perf_counter() - loaded
+
+
+async def measure(path, repeat: int) -> tuple:
+    runs = [await path() for _ in range(repeat)]
+    best = min(runs, key=lambda run: run[1] + run[2])
+    return best[0], best[1] * 1000, best[2] * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", default="10000,100000", help="comma-separated task counts")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'tasks':>8} {'path':>9} {'load ms':>10} {'encode ms':>10} {'total ms':>10} {'MB':>7}")
+    for tasks in (int(count) for count in args.tasks.split(",")):
+        seed(tasks)
+        reference, *slow = await measure(pydantic_path, args.repeat)
+        body, *fast = await measure(fast_path, args.repeat)
+        if body != reference:
+            sys.exit(f"outputs differ at {tasks} tasks")
+        for name, (load, encode) in (("pydantic", slow), ("fast", fast)):
+            print(f"{tasks:>8} {name:>9} {load:>10.1f} {encode:>10.1f} {load + encode:>10.1f} "
+                  f"{len(body) / 1e6:>7.1f}")
+        print(f"{tasks:>8} {'speedup':>9} {slow[0] / fast[0]:>10.1f}x {slow[1] / fast[1]:>9.1f}x "
+              f"{sum(slow) / sum(fast):>9.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,168 @@
+"""
+In-process cache for expensive read endpoints.
+
+Entries are tagged with the tables they were computed from and are dropped as
+soon as a transaction that wrote to one of those tables commits.  Writes are
+detected through SQLAlchemy session events, so endpoints only have to commit
+as usual for the cache to stay consistent.
+
+Every such commit also bumps a dataset version, which listing endpoints turn
+into an ETag: a client revalidating with If-None-Match gets a 304 without any
+database work, and a changed dataset is serialized once per version.
+
+Commits made by other processes aren't seen by these events.  Worker
+processes that don't write (see writer.py) call `observe_revision` with the
+database's sync revision instead: the cache is cleared whenever it moved, and
+ETags become the revision, which every worker agrees on.
+"""
+
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_WRITTEN_TABLES_KEY = "written_tables"
+
+
+class QueryCache:
+    """LRU cache whose entries are invalidated per table."""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.version = 0
+        # The last sync revision seen, when another process does the writing
+        self.revision: Optional[int] = None
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, tables: Iterable[str], version: Optional[int] = None) -> None:
+        """Store an entry; pass the `version` read before computing it to skip storing a result a write raced with"""
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._entries[key] = (value, frozenset(tables))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *tables: str) -> None:
+        """Drop every entry that depends on one of the given tables."""
+        written = set(tables)
+        with self._lock:
+            self.version += 1
+            stale = [key for key, (_, deps) in self._entries.items() if deps & written]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def observe_revision(self, revision: int) -> None:
+        """Drop everything if the database moved past the revision last seen"""
+        with self._lock:
+            if revision != self.revision:
+                self.revision = revision
+                self.version += 1
+                self._entries.clear()
+
+
+cache = QueryCache()
+
+
+def _mark_written(session: Session, *tables: str) -> None:
+    session.info.setdefault(_WRITTEN_TABLES_KEY, set()).update(tables)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flushed_rows(session, flush_context):
+    # new/dirty/deleted still hold the pre-flush state at this point
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(obj, "__tablename__", None)
+        if table:
+            _mark_written(session, table)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_statements(orm_execute_state):
+    # Set-based UPDATE/DELETE/INSERT statements bypass the unit of work
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        table = getattr(orm_execute_state.statement.table, "name", None)
+        if table:
+            _mark_written(orm_execute_state.session, table)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    if session.in_nested_transaction():
+        return  # a savepoint was released; nothing is committed yet
+    tables = session.info.pop(_WRITTEN_TABLES_KEY, None)
+    if tables:
+        cache.invalidate(*tables)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop(_WRITTEN_TABLES_KEY, None)
+
+
+# ======================================================================
+# CONDITIONAL RESPONSES
+# ======================================================================
+
+# Versions count from zero in every process, so tags carry an instance id
+# to never match a tag handed out by an earlier run or another worker
+_INSTANCE = uuid.uuid4().hex[:8]
+
+
+def current_etag() -> str:
+    if cache.revision is not None:
+        return f'"r{cache.revision}"'
+    return f'"{_INSTANCE}-{cache.version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = {tag.strip() for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+async def versioned_json(
+    request: Request,
+    key: Hashable,
+    build: Callable[[], Awaitable[Tuple[bytes, Dict[str, str]]]],
+    tables: Iterable[str] = ("clients", "tasks", "comments"),
+) -> Response:
+    """JSON response whose body is built at most once per dataset version.
+
+    `build` returns the serialized body and any extra headers.  The version is
+    read before building, so a write racing with it only ever makes the
+    cached entry unreachable, never stale.
+    """
+    etag = current_etag()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    entry = cache.get((key, etag))
+    if entry is None:
+        entry = await build()
+        cache.set((key, etag), entry, tables=tables)
+    body, extra_headers = entry
+    return Response(content=body, media_type="application/json", headers={**headers, **extra_headers})
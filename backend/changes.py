@@ -0,0 +1,206 @@
+"""
+Revision tracking and the delta-sync feed.
+
+Every transaction that writes to clients, tasks or comments takes the next
+revision from the single `sync_state` row and stamps it, with `updated_at`,
+on every row it inserts or updates; rows it deletes leave a tombstone with
+that revision.  Bumping the counter row locks it until commit, so revisions
+become visible in increasing order and a reader never sees revision N+1
+without N.
+
+Stamping hooks into SQLAlchemy session events, so it covers unit-of-work
+flushes as well as bulk and Core INSERT/UPDATE/DELETE statements executed
+through a session: endpoints and the importer only commit as usual.
+
+GET /changes?since=<revision> returns what changed after a revision a client
+has already applied; apply `deleted` before the upserts.
+"""
+
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import String, cast, event, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database import get_async_db
+from models import Client, Comment, SyncState, Task, Tombstone
+import schemas
+
+router = APIRouter(prefix="/changes", tags=["changes"])
+
+TRACKED = (Client, Task, Comment)
+TRACKED_TABLES = {model.__tablename__: model.__table__ for model in TRACKED}
+
+_REVISION_KEY = "revision"
+_sync_state = SyncState.__table__
+_tombstones = Tombstone.__table__
+
+
+def _transaction_revision(session: Session) -> tuple:
+    """(revision, timestamp) of the session's transaction, allocated on first use"""
+    stamp = session.info.get(_REVISION_KEY)
+    if stamp is None:
+        revision = session.execute(
+            update(_sync_state)
+            .where(_sync_state.c.id == 1)
+            .values(revision=_sync_state.c.revision + 1)
+            .returning(_sync_state.c.revision)
+        ).scalar()
+        if revision is None:
+            revision = 1
+            session.execute(insert(_sync_state).values(id=1, revision=revision))
+        stamp = (revision, datetime.now(timezone.utc).isoformat())
+        session.info[_REVISION_KEY] = stamp
+    return stamp
+
+
+def allocate_revision(session: Session) -> int:
+    """Take the transaction's revision now instead of at its first write.
+
+    Group commits (writes.py) do this before their savepoints, so a write
+    rolled back to its savepoint can't take the revision bump with it.
+    """
+    return _transaction_revision(session)[0]
+
+
+def pending_revision(session: Session) -> Optional[int]:
+    """Revision the session's open transaction writes with, if it has written yet"""
+    stamp = session.info.get(_REVISION_KEY)
+    return stamp[0] if stamp else None
+
+
+def _tombstone_rows(table_name: str, ids, revision: int, now: str) -> list:
+    return [
+        {"table_name": table_name, "row_id": str(row_id), "revision": revision, "deleted_at": now}
+        for row_id in ids
+    ]
+
+
+@event.listens_for(Session, "before_flush")
+def _stamp_flushed_rows(session, flush_context, instances):
+    changed = [
+        obj for obj in session.new if isinstance(obj, TRACKED)
+    ] + [
+        obj for obj in session.dirty
+        if isinstance(obj, TRACKED) and session.is_modified(obj, include_collections=False)
+    ]
+    deleted = [obj for obj in session.deleted if isinstance(obj, TRACKED)]
+    if not changed and not deleted:
+        return
+
+    revision, now = _transaction_revision(session)
+    for obj in changed:
+        obj.revision = revision
+        obj.updated_at = now
+    for obj in deleted:
+        session.add(Tombstone(**_tombstone_rows(obj.__tablename__, [obj.id], revision, now)[0]))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _stamp_bulk_statements(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = TRACKED_TABLES.get(getattr(orm_execute_state.statement.table, "name", None))
+    if table is None:
+        return
+
+    session = orm_execute_state.session
+    revision, now = _transaction_revision(session)
+    statement = orm_execute_state.statement
+
+    if orm_execute_state.is_delete:
+        # One INSERT ... SELECT of the rows about to go
+        rows = select(
+            literal(table.name), cast(table.c.id, String), literal(revision), literal(now),
+        )
+        if statement.whereclause is not None:
+            rows = rows.where(statement.whereclause)
+        session.execute(insert(_tombstones).from_select(
+            ["table_name", "row_id", "revision", "deleted_at"], rows,
+        ))
+        return
+
+    stamp = {"revision": revision, "updated_at": now}
+    parameters = orm_execute_state.parameters
+    if isinstance(parameters, list):
+        # executemany (including ORM bulk INSERT / UPDATE by primary key)
+        orm_execute_state.parameters = [{**params, **stamp} for params in parameters]
+    elif parameters:
+        orm_execute_state.parameters = {**parameters, **stamp}
+    else:
+        orm_execute_state.statement = statement.values(**stamp)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _end_revision(session):
+    if session.in_nested_transaction():
+        return  # a savepoint ended; the transaction and its revision go on
+    session.info.pop(_REVISION_KEY, None)
+
+
+# ======================================================================
+# FEED
+# ======================================================================
+
+async def current_revision(db: AsyncSession) -> int:
+    return await db.scalar(select(_sync_state.c.revision).where(_sync_state.c.id == 1)) or 0
+
+
+async def changes_since(db: AsyncSession, since: int, limit: int) -> schemas.Changes:
+    """Rows changed after `since`, in whole revisions of roughly `limit` rows"""
+    current = await current_revision(db)
+
+    # The limit-th smallest revision after `since` across all tables bounds
+    # the page; a revision is never split, so a page may run over the limit
+    revisions = []
+    for table in (*TRACKED_TABLES.values(), _tombstones):
+        revisions += (await db.scalars(
+            select(table.c.revision)
+            .where(table.c.revision > since, table.c.revision <= current)
+            .order_by(table.c.revision)
+            .limit(limit)
+        )).all()
+    upto = current
+    if len(revisions) > limit:
+        upto = sorted(revisions)[limit - 1]
+
+    def changed(table):
+        return (
+            select(table)
+            .where(table.c.revision > since, table.c.revision <= upto)
+            .order_by(table.c.revision, table.c.id)
+        )
+
+    rows = {}
+    for name, table in TRACKED_TABLES.items():
+        rows[name] = (await db.execute(changed(table))).mappings().all()
+    tombstones = (await db.execute(changed(_tombstones))).mappings().all()
+
+    return schemas.Changes(
+        revision=upto,
+        has_more=upto < current,
+        clients=rows["clients"],
+        tasks=rows["tasks"],
+        comments=rows["comments"],
+        deleted=[
+            schemas.Deletion(table=row["table_name"], id=row["row_id"], revision=row["revision"])
+            for row in tombstones
+        ],
+    )
+
+
+@router.get("", response_model=schemas.Changes)
+async def get_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=10000),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Clients, tasks and comments changed or deleted after revision `since`.
+
+    Store the returned `revision` and pass it as `since` next time; keep
+    going while `has_more` is true.  Apply `deleted` before the upserts.
+    """
+    return await changes_since(db, since, limit)
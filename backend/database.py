@@ -1,14 +1,114 @@
-from sqlalchemy import create_engine
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./task_manager.db"
+load_dotenv()
+
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./task_manager.db")
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+# Connection pool sizing (per engine, per process)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Applied to every new SQLite connection.  WAL lets readers run alongside a
+# writer, synchronous=NORMAL is durable under WAL except on power loss, and
+# busy_timeout makes writers wait for the lock instead of failing right away.
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # negative = KiB, i.e. 64 MB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": "MEMORY",
+}
+
+
+def to_async_url(url: str) -> str:
+    """Swap the driver of a sync database URL for its asyncio counterpart"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend!r}")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def engine_options(url: str) -> dict:
+    """Keyword arguments for create_engine / create_async_engine for this URL"""
+    parsed = make_url(url)
+    pool_options = {
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+    }
+
+    if parsed.get_backend_name() == "sqlite":
+        options = {}
+        if parsed.get_driver_name() == "pysqlite":
+            options["connect_args"] = {"check_same_thread": False}
+        # In-memory databases use a single shared connection and no pool sizing
+        if parsed.database and parsed.database != ":memory:":
+            options.update(pool_options)
+        return options
+
+    return {**pool_options, "pool_pre_ping": True}
+
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+def configure_engine(engine: Engine) -> Engine:
+    """Install connect-time hooks on a (sync or async-wrapped) engine"""
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", apply_sqlite_pragmas)
+    return engine
+
+
+def pool_stats(engine: Engine) -> dict:
+    """Current occupancy of an engine's connection pool"""
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if callable(method):
+            stats[name] = method()
+    return stats
+
+
+# Synchronous engine, used for DDL at startup and by the migration scripts
+engine = configure_engine(
+    create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Asyncio engine used by the API so queries don't block the event loop.
+# Objects stay loaded after commit because responses are serialized after
+# the endpoint returns, when lazy loading is no longer possible.
+ASYNC_DATABASE_URL = to_async_url(SQLALCHEMY_DATABASE_URL)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+configure_engine(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
 Base = declarative_base()
 
 def get_db():
@@ -16,4 +116,8 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,59 @@
+"""
+Parsing of task dates and timestamps.
+
+Calendar dates (a task's date, SLA date and completion date) are `date`s.
+Instants (creation and completion timestamps, comment timestamps) are
+timezone-aware `datetime`s in UTC.  Both are accepted as ISO 8601 strings:
+a date may carry a time part, which is dropped, and a timestamp without an
+offset is taken to be UTC.  Anything else raises ValueError.
+
+The column types in models.py and the field types in schemas.py both parse
+through here, so the API, the importer and the migration agree on what a
+valid value is.
+"""
+
+from datetime import date, datetime, time, timezone
+from typing import Optional
+
+
+def parse_date(value) -> Optional[date]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        text = value.strip()
+        try:
+            if len(text) > 10:
+                return datetime.fromisoformat(text).date()
+            return date.fromisoformat(text)
+        except ValueError:
+            pass
+    raise ValueError(f"Invalid date {value!r}, expected YYYY-MM-DD")
+
+
+def parse_timestamp(value) -> Optional[datetime]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.strip())
+        except ValueError:
+            raise ValueError(f"Invalid timestamp {value!r}, expected ISO 8601")
+    elif isinstance(value, date) and not isinstance(value, datetime):
+        value = datetime.combine(value, time.min)
+    elif not isinstance(value, datetime):
+        raise ValueError(f"Invalid timestamp {value!r}, expected ISO 8601")
+
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def to_json(value):
+    """`default=` for json.dumps: dates and timestamps as ISO 8601"""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,378 @@
+"""
+Server-sent event stream of client, task, comment and SLA changes.
+
+GET /events is a text/event-stream.  Every event names the revision of the
+transaction it came from (see changes.py) as its SSE id, so a client can
+always catch up with GET /changes?since=<revision>:
+
+    client.created / client.updated / client.deleted
+    task.created / task.updated / task.deleted
+    comment.created / comment.updated / comment.deleted
+    sla.changed   an open task moved between SLA buckets (sla.py), because it
+                  was written or because the date rolled over at UTC midnight
+    sync          rows were written by bulk statements (task batches, imports);
+                  data lists the tables, pull /changes for the rows
+    resync        events were dropped for this subscriber; pull /changes
+
+Events are collected from session events while a transaction flushes (and
+from the rows that writes.py writes with RETURNING) and are published once it
+commits; a rollback discards them.  Nothing is collected
+while nobody is subscribed.
+
+The broker is in-process.  Each subscriber gets a bounded queue: a connection
+that stops reading (or reads slower than writes happen) has its backlog
+replaced by a single `resync` instead of growing without limit or holding up
+writers and other subscribers.  Events are encoded once per publish, not per
+subscriber, and idle connections cost one queue and a keep-alive comment every
+HEARTBEAT_SECONDS.  A reconnecting EventSource sends Last-Event-ID; if
+revisions were committed since, the stream starts with `resync`.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, time, timedelta, timezone
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Header, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+import changes
+import schemas
+import sla
+from database import AsyncSessionLocal
+from dates import to_json
+from models import Client, Comment, Task
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))
+HEARTBEAT_SECONDS = 15
+RETRY_MS = 3000
+
+_NAMES = {Client: "client", Task: "task", Comment: "comment"}
+_SCHEMAS = {Client: schemas.ClientChange, Task: schemas.TaskChange, Comment: schemas.CommentChange}
+_PARENT_KEYS = {Task: "client_id", Comment: "task_id"}
+
+# Columns an update must have read first to tell whether the row changed SLA bucket
+PREVIOUS_COLUMNS = {Task: ("sla_date", "status")}
+# Execution option of single-row statements with RETURNING whose rows are
+# reported through collect_returned() rather than as a `sync` event
+ROW_EVENTS = "row_events"
+
+_PENDING_KEY = "pending_events"
+_BULK_KEY = "bulk_event_tables"
+
+
+def format_event(event: dict) -> str:
+    """One event in text/event-stream framing"""
+    lines = []
+    if event.get("revision") is not None:
+        lines.append(f"id: {event['revision']}")
+    lines.append(f"event: {event['type']}")
+    lines.append("data: " + json.dumps(event, separators=(",", ":"), default=to_json))
+    return "\n".join(lines) + "\n\n"
+
+
+RESYNC = format_event({"type": "resync"})
+
+
+class Subscriber:
+    """One connection's bounded queue of encoded events"""
+
+    def __init__(self, topics: Optional[frozenset], maxsize: int):
+        self.topics = topics
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def wants(self, event_type: str) -> bool:
+        if self.topics is None or event_type in ("sync", "resync"):
+            return True
+        return event_type.split(".", 1)[0] in self.topics
+
+    def offer(self, encoded: str) -> None:
+        try:
+            self.queue.put_nowait(encoded)
+        except asyncio.QueueFull:
+            # Too far behind: swap the backlog for a resync rather than buffer
+            # without bound or make the publisher wait for this connection
+            self.dropped += self.queue.qsize() + 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+class Broker:
+    """In-process fan-out of committed events to subscribers"""
+
+    def __init__(self, queue_size: int = QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers: set = set()
+        self.published = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Deliver on `loop`, the event loop serving the subscribers"""
+        self._loop = loop
+
+    def subscribe(self, topics: Optional[List[str]] = None) -> Subscriber:
+        self._loop = asyncio.get_running_loop()
+        subscriber = Subscriber(frozenset(topics) if topics else None, self.queue_size)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+    def publish(self, events: List[dict]) -> None:
+        """Queue events for every interested subscriber; safe to call from any thread.
+
+        Delivery runs as a separate callback on the event loop, so a commit
+        never waits for the fan-out.
+        """
+        loop = self._loop
+        if not events or not self.subscribers or loop is None:
+            return
+        encoded = [(event["type"], format_event(event)) for event in events]
+        try:
+            loop.call_soon_threadsafe(self._deliver, encoded)
+        except RuntimeError:
+            pass  # the loop has shut down
+
+    def _deliver(self, encoded: list) -> None:
+        self.published += len(encoded)
+        for subscriber in tuple(self.subscribers):
+            for event_type, text in encoded:
+                if subscriber.wants(event_type):
+                    subscriber.offer(text)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self.subscribers),
+            "published": self.published,
+            "dropped": sum(subscriber.dropped for subscriber in self.subscribers),
+            "queue_size": self.queue_size,
+        }
+
+
+broker = Broker()
+
+
+# ======================================================================
+# COLLECTING EVENTS
+# ======================================================================
+
+def sla_event(task, before: Optional[str], after: Optional[str], revision: Optional[int]) -> dict:
+    return {
+        "type": "sla.changed",
+        "revision": revision,
+        "data": {
+            "task_id": task.id,
+            "client_id": task.client_id,
+            "sla_date": task.sla_date,
+            "from": before,
+            "to": after,
+        },
+    }
+
+
+def _row_event(obj, action: str, revision: Optional[int]) -> dict:
+    model = type(obj)
+    if action == "deleted":
+        data = {"id": obj.id}
+        if model in _PARENT_KEYS:
+            data[_PARENT_KEYS[model]] = inspect(obj).dict.get(_PARENT_KEYS[model])
+    else:
+        data = _SCHEMAS[model].model_validate(obj).model_dump(mode="json")
+    return {"type": f"{_NAMES[model]}.{action}", "revision": revision, "data": data}
+
+
+def _previous(state, key: str):
+    history = state.attrs[key].history
+    return history.deleted[0] if history.deleted else state.attrs[key].value
+
+
+def _queue_row_events(pending: list, obj, action: str, revision: Optional[int], previous: Optional[dict],
+                      today) -> None:
+    pending.append(_row_event(obj, action, revision))
+    if isinstance(obj, Task) and action != "deleted":
+        before = sla.bucket_of(previous["sla_date"], previous["status"], today) if previous else None
+        after = sla.bucket_of(obj.sla_date, obj.status, today)
+        if before != after:
+            pending.append(sla_event(obj, before, after, revision))
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed_rows(session, flush_context):
+    # New/dirty/deleted and attribute history still describe what was flushed
+    if not broker.subscribers:
+        return
+    revision = changes.pending_revision(session)
+    today = datetime.now(timezone.utc).date()
+    pending = session.info.setdefault(_PENDING_KEY, [])
+
+    modified = [
+        obj for obj in session.dirty
+        if isinstance(obj, changes.TRACKED) and session.is_modified(obj, include_collections=False)
+    ]
+    for action, objects in (("created", session.new), ("updated", modified), ("deleted", session.deleted)):
+        for obj in objects:
+            if not isinstance(obj, changes.TRACKED):
+                continue
+            previous = None
+            if action == "updated":
+                state = inspect(obj)
+                previous = {key: _previous(state, key) for key in PREVIOUS_COLUMNS.get(type(obj), ())}
+            _queue_row_events(pending, obj, action, revision, previous, today)
+
+
+def previous_columns(model) -> tuple:
+    """Columns whose values before an UPDATE ... RETURNING collect_returned needs, if anyone is listening"""
+    return PREVIOUS_COLUMNS.get(model, ()) if broker.subscribers else ()
+
+
+def collect_returned(session: Session, obj, action: str, previous: Optional[dict] = None) -> None:
+    """Queue the events of a row written by a statement run with the ROW_EVENTS option.
+
+    `previous` holds the previous_columns() of an updated row, read before the update.
+    """
+    if not broker.subscribers:
+        return
+    _queue_row_events(
+        session.info.setdefault(_PENDING_KEY, []), obj, action, changes.pending_revision(session), previous,
+        datetime.now(timezone.utc).date(),
+    )
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_statements(orm_execute_state):
+    if not broker.subscribers:
+        return
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    if orm_execute_state.execution_options.get(ROW_EVENTS):
+        return  # the caller reports the rows itself
+    table = getattr(orm_execute_state.statement.table, "name", None)
+    if table not in changes.TRACKED_TABLES:
+        return
+
+    session = orm_execute_state.session
+    # changes.py has allocated the revision by now; it forgets it on commit
+    revision, tables = session.info.setdefault(_BULK_KEY, (changes.pending_revision(session), set()))
+    tables.add(table)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session):
+    if session.in_nested_transaction():
+        return  # a savepoint was released; nothing is committed yet
+    events = session.info.pop(_PENDING_KEY, [])
+    bulk = session.info.pop(_BULK_KEY, None)
+    if bulk:
+        revision, tables = bulk
+        events.append({"type": "sync", "revision": revision, "data": {"tables": sorted(tables)}})
+    broker.publish(events)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_BULK_KEY, None)
+
+
+async def publish_day_transitions(today) -> int:
+    """Publish sla.changed for open tasks whose bucket moved when the date became `today`"""
+    async with AsyncSessionLocal() as db:
+        revision = await changes.current_revision(db)
+        transitions = await sla.day_transitions(db, today)
+    broker.publish([sla_event(task, before, after, revision) for task, before, after in transitions])
+    return len(transitions)
+
+
+async def sla_clock() -> None:
+    """Publish the SLA transitions caused by the date changing, every UTC midnight"""
+    while True:
+        now = datetime.now(timezone.utc)
+        midnight = datetime.combine(now.date() + timedelta(days=1), time.min, timezone.utc)
+        await asyncio.sleep((midnight - now).total_seconds())
+        if not broker.subscribers:
+            continue
+        try:
+            await publish_day_transitions(midnight.date())
+        except Exception:
+            logger.exception("Publishing SLA transitions for %s failed", midnight.date())
+
+
+@asynccontextmanager
+async def lifespan(app):
+    broker.bind(asyncio.get_running_loop())
+    clock = asyncio.create_task(sla_clock())
+    try:
+        yield
+    finally:
+        clock.cancel()
+
+
+# ======================================================================
+# ENDPOINTS
+# ======================================================================
+
+async def event_stream(subscriber: Subscriber, resync: bool = False, heartbeat: float = HEARTBEAT_SECONDS):
+    """text/event-stream chunks for a subscriber, until the client goes away"""
+    try:
+        yield f"retry: {RETRY_MS}\n\n" + (RESYNC if resync else "")
+        while True:
+            try:
+                first = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            # Send whatever has piled up in one write
+            chunk = [first]
+            while not subscriber.queue.empty():
+                chunk.append(subscriber.queue.get_nowait())
+            yield "".join(chunk)
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+@router.get("")
+async def stream_events(
+    topics: Optional[List[Literal["client", "task", "comment", "sla"]]] = Query(None),
+    last_event_id: Optional[str] = Header(None),
+):
+    """Stream change events as server-sent events.
+
+    Pass `topics` to receive only some event families; `sync` and `resync`
+    are always sent.  On `resync`, catch up with GET /changes.
+    """
+    # Subscribe before looking at the revision, so nothing falls in between
+    subscriber = broker.subscribe(topics)
+    resync = False
+    if last_event_id and last_event_id.isdigit():
+        try:
+            async with AsyncSessionLocal() as db:
+                resync = await changes.current_revision(db) > int(last_event_id)
+        except Exception:
+            broker.unsubscribe(subscriber)
+            raise
+
+    return StreamingResponse(
+        event_stream(subscriber, resync),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/stats")
+async def event_stats():
+    """Subscriber count, events published and events dropped for slow subscribers"""
+    return broker.stats()
@@ -0,0 +1,263 @@
+"""
+Snapshot export (and restore) of the whole dataset.
+
+Clients are streamed in primary-key order through a server-side cursor
+(yield_per); each page of clients pulls its tasks and their comments with IN
+queries on the same connection.  Everything is read inside one read-only
+transaction, so the dump is a consistent snapshot: on SQLite in WAL mode that
+transaction doesn't block writers, and on PostgreSQL it runs at REPEATABLE
+READ.  Memory use is bounded by one page of clients.
+
+Formats:
+
+    ndjson  one client per line, with nested tasks and comments (the import format)
+    csv     one row per client, task and comment (see importer.CSV_COLUMNS)
+
+Both can be gzip-compressed, and both are read back by importer.py.  The
+"export" job type (jobs.py) writes the same dump to a file in the background
+for `GET /jobs/{id}/download`; from the command line:
+
+    python exporter.py dump -o backup.ndjson.gz
+    python exporter.py restore backup.ndjson.gz
+"""
+
+import csv
+import io
+import json
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from typing import Iterator, Literal
+
+from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.engine import Connection, Engine
+
+from database import engine
+from dates import to_json
+import jobs
+from importer import (
+    CSV_CLIENT_FIELDS,
+    CSV_COLUMNS,
+    CSV_COMMENT_FIELDS,
+    CSV_TASK_FIELDS,
+    ID_CHUNK_SIZE,
+)
+from models import Client, Comment, Task
+
+router = APIRouter(prefix="/export", tags=["export"])
+
+PAGE_SIZE = 100
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+_clients = Client.__table__
+_tasks = Task.__table__
+_comments = Comment.__table__
+
+
+@contextmanager
+def snapshot(bind: Engine) -> Iterator[Connection]:
+    """A connection whose reads all see the database as of the first query"""
+    with bind.connect() as conn:
+        if conn.dialect.name == "sqlite":
+            # pysqlite only opens transactions for writes; an explicit one
+            # pins a WAL read snapshot until it ends
+            conn.exec_driver_sql("BEGIN")
+        elif conn.dialect.name == "postgresql":
+            conn = conn.execution_options(isolation_level="REPEATABLE READ")
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+
+
+def iter_clients(conn: Connection, page_size: int = PAGE_SIZE) -> Iterator[dict]:
+    """Yield every client with its tasks and their comments, as plain dicts"""
+    clients = conn.execute(
+        select(_clients).order_by(_clients.c.id).execution_options(yield_per=page_size)
+    )
+    for page in clients.partitions():
+        client_ids = [client.id for client in page]
+
+        tasks_by_client = defaultdict(list)
+        for chunk in _chunks(client_ids):
+            tasks = conn.execute(select(_tasks).where(_tasks.c.client_id.in_(chunk)).order_by(_tasks.c.id))
+            # zip over plain rows: Row._asdict() dominates the runtime of a large dump
+            keys = tuple(tasks.keys())
+            for row in tasks:
+                task = dict(zip(keys, row))
+                task["comments"] = []
+                tasks_by_client[task["client_id"]].append(task)
+
+        tasks_by_id = {task["id"]: task for tasks in tasks_by_client.values() for task in tasks}
+        for chunk in _chunks(list(tasks_by_id)):
+            comments = conn.execute(
+                select(_comments)
+                .where(_comments.c.task_id.in_(chunk))
+                .order_by(_comments.c.timestamp, _comments.c.id)
+            )
+            keys = tuple(comments.keys())
+            for row in comments:
+                comment = dict(zip(keys, row))
+                tasks_by_id[comment["task_id"]]["comments"].append(comment)
+
+        for client in page:
+            yield {**client._mapping, "tasks": tasks_by_client.pop(client.id, [])}
+
+
+def _chunks(items: list, size: int = ID_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def ndjson_lines(clients: Iterator[dict], batch: int = PAGE_SIZE) -> Iterator[str]:
+    lines = []
+    for client in clients:
+        lines.append(json.dumps(client, ensure_ascii=False, default=to_json))
+        if len(lines) >= batch:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def _csv_value(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def csv_lines(clients: Iterator[dict], batch: int = PAGE_SIZE) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS, lineterminator="\n")
+    writer.writeheader()
+    for count, client in enumerate(clients, start=1):
+        writer.writerow({"type": "client", **{field: client[field] for field in CSV_CLIENT_FIELDS}})
+        for task in client["tasks"]:
+            writer.writerow({
+                "type": "task",
+                "client_id": client["id"],
+                **{field: _csv_value(task[field]) for field in CSV_TASK_FIELDS},
+            })
+            for comment in task["comments"]:
+                writer.writerow({
+                    "type": "comment",
+                    "task_id": task["id"],
+                    **{field: _csv_value(comment[field]) for field in CSV_COMMENT_FIELDS},
+                })
+        if count % batch == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def gzipped(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(format: str = "ndjson", compress: bool = False, bind: Engine = engine) -> Iterator[bytes]:
+    """Encoded dump of the dataset, read from a single snapshot"""
+    lines = ndjson_lines if format == "ndjson" else csv_lines
+    with snapshot(bind) as conn:
+        chunks = (text.encode("utf-8") for text in lines(iter_clients(conn)))
+        yield from gzipped(chunks) if compress else chunks
+
+
+def dump_filename(format: str, compress: bool) -> str:
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return f"tasker-{stamp}.{format}" + (".gz" if compress else "")
+
+
+class ExportParams(BaseModel):
+    format: Literal["ndjson", "csv"] = "ndjson"
+    gzip: bool = False
+
+
+@jobs.job_type("export", concurrency=2, params=ExportParams)
+def run_export(run: jobs.Run) -> dict:
+    """Job handler: write the dump to the job's artifact file"""
+    format, compress = run.params["format"], run.params["gzip"]
+    path = jobs.artifact_path(run.job.id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    written = 0
+    try:
+        with open(path, "wb") as out:
+            for chunk in export_chunks(format, compress):
+                out.write(chunk)
+                written += len(chunk)
+                run.checkpoint(bytes_written=written)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return {
+        "filename": dump_filename(format, compress),
+        "media_type": "application/gzip" if compress else MEDIA_TYPES[format],
+        "bytes": written,
+        "download": f"/jobs/{run.job.id}/download",
+    }
+
+
+# ======================================================================
+# ENDPOINTS
+# ======================================================================
+
+@router.get("")
+def export_data(format: Literal["ndjson", "csv"] = "ndjson", gzip: bool = False):
+    """Stream every client, task and comment from one consistent snapshot"""
+    # A sync generator: Starlette iterates it in the threadpool
+    return StreamingResponse(
+        export_chunks(format, gzip),
+        media_type="application/gzip" if gzip else MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{dump_filename(format, gzip)}"'},
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import sys
+
+    parser = argparse.ArgumentParser(description="Dump or restore the whole dataset")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    dump = commands.add_parser("dump", help="Write a snapshot of the database")
+    dump.add_argument("-o", "--output", help="File to write (default: stdout)")
+    dump.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    dump.add_argument("--gzip", action="store_true", help="Compress (implied by a .gz output name)")
+
+    restore = commands.add_parser("restore", help="Load a dump written by `dump`")
+    restore.add_argument("path")
+    restore.add_argument("--mode", choices=("skip", "upsert", "replace"), default="replace")
+    restore.add_argument("--chunk-size", type=int, default=5000)
+
+    args = parser.parse_args()
+
+    if args.command == "dump":
+        compress = args.gzip or bool(args.output and args.output.endswith(".gz"))
+        out = open(args.output, "wb") if args.output else sys.stdout.buffer
+        try:
+            for chunk in export_chunks(args.format, compress):
+                out.write(chunk)
+        finally:
+            if args.output:
+                out.close()
+    else:
+        import importer
+        import migrations
+
+        migrations.prepare(engine)
+
+        job = importer.import_file(
+            args.path, importer.new_job(args.mode, args.chunk_size, os.path.getsize(args.path))
+        )
+        print(json.dumps(job.model_dump(), indent=2))
+        if job.status != "completed":
+            sys.exit(1)
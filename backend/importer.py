@@ -0,0 +1,554 @@
+"""
+Streaming bulk import of clients with their tasks and comments.
+
+Input is a JSON array of client objects (the format of data.json), NDJSON
+with one client object per line, or the CSV layout written by exporter.py,
+optionally gzip-compressed; the format is detected from the content.  Records
+are parsed one at a time, so memory stays bounded by the chunk size rather
+than the size of the file.
+
+Records are written in chunks, each in its own transaction: existing ids are
+looked up with one IN query per chunk and rows are inserted/updated through
+executemany.  What happens to clients that already exist depends on the mode:
+
+    skip     leave the client untouched and ignore its tasks (the default)
+    upsert   update the client; tasks and comments carrying an id that
+             already exists are updated, everything else is added
+    replace  update the client and swap all of its tasks for the ones in
+             the file
+
+Uploads run as "import" jobs (see jobs.py) whose progress is exposed at
+/import/{job_id}.  Cancelling one stops it after the chunk being written;
+earlier chunks stay committed.
+"""
+
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import uuid
+from datetime import datetime, timezone
+from typing import IO, Callable, Iterator, List, Literal, Optional
+
+from fastapi import APIRouter, File, HTTPException, Query, UploadFile
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from dates import parse_date, parse_timestamp
+import changes  # noqa: F401  (stamps revisions on imported rows)
+import jobs
+import leadtime
+from models import Client, Comment, Task
+import schemas
+
+router = APIRouter(prefix="/import", tags=["import"])
+
+MODES = ("skip", "upsert", "replace")
+DEFAULT_CHUNK_SIZE = 5000
+
+# Keep IN lists well below SQLite's bound-parameter limit
+ID_CHUNK_SIZE = 500
+
+READ_SIZE = 1 << 16
+# Characters one record (or line) may span: input without a boundary fails
+# the import past it instead of being buffered whole
+MAX_RECORD_SIZE = 64 << 20
+MAX_ERRORS = 100
+
+CLIENT_FIELDS = ("name", "company", "origin")
+TASK_FIELDS = ("date", "description", "status", "priority")
+
+# CSV dumps hold one row per client, task and comment, each task following its
+# client and each comment its task
+CSV_COLUMNS = (
+    "type", "id", "client_id", "task_id", "name", "company", "origin",
+    "date", "description", "status", "priority", "sla_date", "completion_date",
+    "creation_timestamp", "completion_timestamp", "text", "author", "timestamp",
+)
+CSV_CLIENT_FIELDS = ("id", "name", "company", "origin")
+CSV_TASK_FIELDS = (
+    "id", "date", "description", "status", "priority", "sla_date", "completion_date",
+    "creation_timestamp", "completion_timestamp",
+)
+CSV_COMMENT_FIELDS = ("id", "text", "author", "timestamp")
+# CSV has no null, so empty cells in these columns read back as None
+CSV_NULLABLE = {"id", "sla_date", "completion_date", "creation_timestamp", "completion_timestamp", "author"}
+
+
+# ======================================================================
+# PARSING
+# ======================================================================
+
+def iter_records(fp: IO[str]) -> Iterator[object]:
+    """Yield the client records of a JSON array, NDJSON or CSV text stream"""
+    head = fp.read(1)
+    while head and head.isspace():
+        head = fp.read(1)
+    if head == "[":
+        return _iter_json_array(fp)
+    lines = _lines(fp)
+    if head in ("{", ""):
+        return _iter_ndjson(lines, head)
+    return _iter_csv(lines, head + next(lines, ""))
+
+
+def _lines(fp: IO[str]) -> Iterator[str]:
+    while True:
+        line = fp.readline(MAX_RECORD_SIZE)
+        if not line:
+            return
+        if len(line) == MAX_RECORD_SIZE and not line.endswith(("\n", "\r")):
+            raise ValueError(f"Line longer than {MAX_RECORD_SIZE} characters")
+        yield line
+
+
+def _iter_csv(lines: Iterator[str], header: str) -> Iterator[dict]:
+    columns = next(csv.reader([header]))
+    if "type" not in columns:
+        raise ValueError("Unrecognized input: expected a JSON array, NDJSON or CSV with a 'type' column")
+
+    client = task = None
+    for line_number, row in enumerate(csv.DictReader(lines, fieldnames=columns), start=2):
+        for column in CSV_NULLABLE.intersection(row):
+            if row[column] == "":
+                row[column] = None
+
+        kind = row["type"]
+        if kind == "client":
+            if client is not None:
+                yield client
+            client = {field: row.get(field) for field in CSV_CLIENT_FIELDS}
+            client["tasks"] = []
+            task = None
+        elif kind == "task":
+            if client is None:
+                raise ValueError(f"Task on line {line_number} does not follow a client")
+            task = {field: row.get(field) for field in CSV_TASK_FIELDS}
+            task["comments"] = []
+            client["tasks"].append(task)
+        elif kind == "comment":
+            if task is None:
+                raise ValueError(f"Comment on line {line_number} does not follow a task")
+            task["comments"].append({field: row.get(field) for field in CSV_COMMENT_FIELDS})
+        else:
+            raise ValueError(f"Unknown row type {kind!r} on line {line_number}")
+
+    if client is not None:
+        yield client
+
+
+def _iter_ndjson(lines: Iterator[str], head: str) -> Iterator[object]:
+    line = head + next(lines, "")
+    line_number = 1
+    while line:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON on line {line_number}: {e.msg}")
+        line = next(lines, "")
+        line_number += 1
+
+
+def _iter_json_array(fp: IO[str]) -> Iterator[object]:
+    """Yield the elements of a JSON array whose opening bracket was consumed"""
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+    expect_value = None  # None: first element or "]", True: element, False: "," or "]"
+
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            buffer, pos, eof = _refill(fp, buffer, pos)
+            continue
+
+        char = buffer[pos]
+        if char == "]" and not expect_value:
+            return
+        if expect_value is False:
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' in JSON array, got {char!r}")
+            pos += 1
+            expect_value = True
+            continue
+
+        try:
+            value, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            # Most likely the element continues past the end of the buffer
+            if eof:
+                raise ValueError(f"Invalid JSON: {e.msg}")
+            buffer, pos, eof = _refill(fp, buffer, pos)
+            continue
+        expect_value = False
+        yield value
+
+
+def _refill(fp: IO[str], buffer: str, pos: int):
+    if len(buffer) - pos >= MAX_RECORD_SIZE:
+        raise ValueError(f"Invalid JSON: array element longer than {MAX_RECORD_SIZE} characters")
+    # Read at least as much as is buffered so re-parsing a large element
+    # stays linear in its size
+    chunk = fp.read(min(max(READ_SIZE, len(buffer) - pos), MAX_RECORD_SIZE))
+    return buffer[pos:] + chunk, 0, not chunk
+
+
+# ======================================================================
+# VALIDATION
+# ======================================================================
+
+def _parse_client(record) -> tuple:
+    """Validate a client record, returning its row and (row, record) pairs for its tasks"""
+    if not isinstance(record, dict):
+        raise ValueError("Record is not an object")
+    missing = [field for field in ("id",) + CLIENT_FIELDS if not record.get(field)]
+    if missing:
+        raise ValueError(f"Client is missing {', '.join(missing)}")
+    client_id = str(record["id"])
+    tasks = record.get("tasks") or []
+    if not isinstance(tasks, list):
+        raise ValueError("Client tasks must be a list")
+    client = {"id": client_id, "name": record["name"], "company": record["company"], "origin": record["origin"]}
+    return client, [(_task_row(task, client_id), task) for task in tasks]
+
+
+def _task_row(task, client_id: str) -> dict:
+    if not isinstance(task, dict):
+        raise ValueError("Task is not an object")
+    # Built field by field: this runs once per imported task
+    get = task.get
+    row = {
+        "date": parse_date(get("date")),
+        "description": get("description"),
+        "status": get("status"),
+        "priority": get("priority"),
+        "client_id": client_id,
+        "sla_date": parse_date(get("sla_date")),
+        "completion_date": parse_date(get("completion_date")),
+        "creation_timestamp": parse_timestamp(get("creation_timestamp")),
+        "completion_timestamp": parse_timestamp(get("completion_timestamp")),
+    }
+    if row["date"] is None or row["description"] is None or row["status"] is None or row["priority"] is None:
+        missing = [field for field in TASK_FIELDS if row[field] is None]
+        raise ValueError(f"Task is missing {', '.join(missing)}")
+    if get("id") is not None:
+        row["id"] = int(task["id"])
+    if "comments" in task:
+        _check_comments(task["comments"])
+    return row
+
+
+def _check_comments(comments) -> None:
+    if comments is None:
+        return
+    if not isinstance(comments, list):
+        raise ValueError("Task comments must be a list")
+    for comment in comments:
+        if not isinstance(comment, dict) or comment.get("text") is None:
+            raise ValueError("Comment is missing text")
+        comment["timestamp"] = parse_timestamp(comment.get("timestamp"))
+
+
+def _comment_rows(task: dict, task_id: int, now: datetime) -> List[dict]:
+    return [
+        {
+            "id": str(comment.get("id") or uuid.uuid4().hex[:8]),
+            "task_id": task_id,
+            "text": comment["text"],
+            "timestamp": comment.get("timestamp") or now,
+            "author": comment.get("author") or "User",
+        }
+        for comment in task.get("comments") or ()
+    ]
+
+
+# ======================================================================
+# WRITING
+# ======================================================================
+
+def _chunks(items: list, size: int = ID_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _existing_ids(session: Session, column, ids: list) -> set:
+    existing = set()
+    for chunk in _chunks(ids):
+        existing.update(session.scalars(select(column).where(column.in_(chunk))))
+    return existing
+
+
+class Importer:
+    """Writes client records to the database chunk by chunk, updating a job.
+
+    Inserts go through the Core tables, a plain executemany: ORM bulk inserts
+    spend more time per row in Python than SQLite needs to store it.
+    """
+
+    def __init__(self, session: Session, job: schemas.ImportJob, checkpoint: Optional[Callable[[], None]] = None):
+        self.session = session
+        self.job = job
+        self.overwrite = job.mode != "skip"
+        self.checkpoint = checkpoint
+        # (before, after) states of the chunk's tasks, for the lead-time stats
+        self._changed: list = []
+
+    def run(self, records: Iterator[object]) -> None:
+        batch, batch_ids, pending_tasks = [], set(), 0
+        for record in records:
+            self.job.records_read += 1
+            try:
+                client, tasks = _parse_client(record)
+            except (ValueError, TypeError) as e:
+                self._record_error(f"Record {self.job.records_read}: {e}")
+                continue
+
+            # A client repeated within a chunk must see the earlier copy written
+            if client["id"] in batch_ids:
+                self.flush(batch)
+                batch, batch_ids, pending_tasks = [], set(), 0
+
+            batch.append((client, tasks))
+            batch_ids.add(client["id"])
+            pending_tasks += len(tasks)
+            if pending_tasks >= self.job.chunk_size or len(batch) >= ID_CHUNK_SIZE:
+                self.flush(batch)
+                batch, batch_ids, pending_tasks = [], set(), 0
+
+        if batch:
+            self.flush(batch)
+
+    def flush(self, batch: list) -> None:
+        """Write one chunk of (client row, task rows) pairs in its own transaction"""
+        session, job = self.session, self.job
+        try:
+            existing = _existing_ids(session, Client.id, [client["id"] for client, _ in batch])
+            if not self.overwrite:
+                job.clients_skipped += sum(1 for client, _ in batch if client["id"] in existing)
+                batch = [(client, tasks) for client, tasks in batch if client["id"] not in existing]
+
+            new_clients = [client for client, _ in batch if client["id"] not in existing]
+            old_clients = [client for client, _ in batch if client["id"] in existing]
+            if new_clients:
+                session.execute(insert(Client.__table__), new_clients)
+            if old_clients:
+                session.execute(update(Client), old_clients)
+                if job.mode == "replace":
+                    self._delete_tasks([client["id"] for client in old_clients])
+
+            self._write_tasks(batch)
+            leadtime.record_changes(session, self._changed)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            self._changed = []
+
+        job.clients_inserted += len(new_clients)
+        job.clients_updated += len(old_clients)
+        if self.checkpoint is not None:
+            self.checkpoint()
+
+    def _delete_tasks(self, client_ids: list) -> None:
+        for chunk in _chunks(client_ids):
+            completed = self.session.execute(
+                select(*leadtime.COLUMNS).where(Task.client_id.in_(chunk), Task.status == leadtime.COMPLETED)
+            )
+            self._changed += [(task, None) for task in completed]
+            task_ids = select(Task.id).where(Task.client_id.in_(chunk)).scalar_subquery()
+            self.session.execute(delete(Comment).where(Comment.task_id.in_(task_ids)))
+            self.session.execute(delete(Task).where(Task.client_id.in_(chunk)))
+
+    def _write_tasks(self, batch: list) -> None:
+        session, job = self.session, self.job
+        with_id, without_id = [], []
+        for _, tasks in batch:
+            for row, task in tasks:
+                (with_id if "id" in row else without_id).append((row, task))
+
+        existing = _existing_ids(session, Task.id, [row["id"] for row, _ in with_id])
+        new_rows = [(row, task) for row, task in with_id if row["id"] not in existing]
+        old_rows = [(row, task) for row, task in with_id if row["id"] in existing]
+        if not self.overwrite:
+            job.tasks_skipped += len(old_rows)
+            old_rows = []
+        if new_rows:
+            session.execute(insert(Task.__table__), [row for row, _ in new_rows])
+        if old_rows:
+            before = {}
+            for chunk in _chunks([row["id"] for row, _ in old_rows]):
+                before.update((task.id, task) for task in session.execute(
+                    select(Task.id, *leadtime.COLUMNS).where(Task.id.in_(chunk))
+                ))
+            session.execute(update(Task), [row for row, _ in old_rows])
+            self._changed += [(before.get(row["id"]), row) for row, _ in old_rows]
+
+        if any(task.get("comments") for _, task in without_id):
+            # Comments need the generated ids, in input order
+            ids = session.scalars(
+                insert(Task).returning(Task.id, sort_by_parameter_order=True),
+                [row for row, _ in without_id],
+            ).all()
+            for (row, _), task_id in zip(without_id, ids):
+                row["id"] = task_id
+        elif without_id:
+            session.execute(insert(Task.__table__), [row for row, _ in without_id])
+
+        self._changed += [(None, row) for row, _ in (*new_rows, *without_id)]
+        job.tasks_inserted += len(new_rows) + len(without_id)
+        job.tasks_updated += len(old_rows)
+
+        now = datetime.now(timezone.utc)
+        comments = [
+            comment
+            for row, task in (*new_rows, *old_rows, *without_id)
+            if task.get("comments")
+            for comment in _comment_rows(task, row["id"], now)
+        ]
+        if comments:
+            self._write_comments(comments)
+
+    def _write_comments(self, rows: list) -> None:
+        existing = _existing_ids(self.session, Comment.id, [row["id"] for row in rows])
+        new_rows = [row for row in rows if row["id"] not in existing]
+        old_rows = [row for row in rows if row["id"] in existing] if self.overwrite else []
+        if new_rows:
+            self.session.execute(insert(Comment.__table__), new_rows)
+        if old_rows:
+            self.session.execute(update(Comment), old_rows)
+        self.job.comments_imported += len(new_rows) + len(old_rows)
+
+    def _record_error(self, message: str) -> None:
+        self.job.records_failed += 1
+        if len(self.job.errors) < MAX_ERRORS:
+            self.job.errors.append(message)
+
+
+# ======================================================================
+# JOBS
+# ======================================================================
+
+def new_job(mode: str = "skip", chunk_size: int = DEFAULT_CHUNK_SIZE, total_bytes: Optional[int] = None) -> schemas.ImportJob:
+    return schemas.ImportJob(id=uuid.uuid4().hex, mode=mode, chunk_size=chunk_size, total_bytes=total_bytes)
+
+
+def import_file(path: str, job: schemas.ImportJob, checkpoint: Optional[Callable[[], None]] = None) -> schemas.ImportJob:
+    """Run an import job over a file, recording the outcome on the job.
+
+    `checkpoint` is called after every committed chunk; it may raise
+    jobs.Cancelled to stop the import there.
+    """
+    job.status = "running"
+    job.started_at = datetime.now(timezone.utc).isoformat()
+    session = SessionLocal()
+    try:
+        with open(path, "rb") as raw:
+            compressed = raw.read(2) == b"\x1f\x8b"
+            raw.seek(0)
+            stream = gzip.GzipFile(fileobj=raw) if compressed else raw
+            # newline="" keeps line breaks inside quoted CSV fields intact
+            fp = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+            records = iter_records(fp)
+
+            def tracked():
+                for record in records:
+                    job.bytes_read = raw.tell()
+                    yield record
+
+            Importer(session, job, checkpoint).run(tracked())
+        job.bytes_read = job.total_bytes or job.bytes_read
+        job.status = "completed"
+    except jobs.Cancelled:
+        job.status = "cancelled"
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+    finally:
+        session.close()
+        job.finished_at = datetime.now(timezone.utc).isoformat()
+    return job
+
+
+@jobs.job_type("import", concurrency=1, public=False)
+def run_import(run: jobs.Run) -> None:
+    """Job handler: the ImportJob is the job's progress"""
+    job = schemas.ImportJob.model_validate(run.job.progress)
+    try:
+        import_file(run.params["path"], job, lambda: run.checkpoint(**job.model_dump()))
+    finally:
+        if run.params.get("delete"):
+            os.unlink(run.params["path"])
+    run.job.progress.update(job.model_dump())
+    if job.status == "cancelled":
+        raise jobs.Cancelled()
+    if job.status == "failed":
+        raise RuntimeError(job.error)
+
+
+def submit_import(path: str, mode: str = "skip", chunk_size: int = DEFAULT_CHUNK_SIZE, delete: bool = False) -> schemas.ImportJob:
+    """Queue an import of a file on this server; `delete` removes the file afterwards"""
+    job = new_job(mode, chunk_size, total_bytes=os.path.getsize(path))
+    jobs.runner.submit("import", {"path": path, "delete": delete}, progress=job.model_dump(), job_id=job.id)
+    return job
+
+
+def import_status(job: schemas.Job) -> schemas.ImportJob:
+    """An import job as /import/{job_id} reports it"""
+    status = "pending" if job.status == "queued" else job.status
+    return schemas.ImportJob.model_validate({**job.progress, "status": status})
+
+
+# ======================================================================
+# ENDPOINTS
+# ======================================================================
+
+@router.post("/", response_model=schemas.ImportJob, status_code=202)
+async def start_import(
+    file: UploadFile = File(...),
+    mode: Literal["skip", "upsert", "replace"] = "skip",
+    chunk_size: int = Query(DEFAULT_CHUNK_SIZE, ge=1, le=50000),
+):
+    """Upload a JSON, NDJSON or CSV dump of clients (optionally gzipped) and import it in the background.
+
+    Poll `GET /import/{job_id}` for progress.
+    """
+    # Spool to our own file: the upload is closed once the response is sent
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".import") as spool:
+        while chunk := await file.read(1 << 20):
+            spool.write(chunk)
+    return submit_import(spool.name, mode, chunk_size, delete=True)
+
+@router.get("/{job_id}", response_model=schemas.ImportJob)
+async def get_import(job_id: str):
+    """Progress and outcome of an import job"""
+    job = jobs.runner.get(job_id)
+    if job is None or job.type != "import":
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return import_status(job)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import a JSON, NDJSON or CSV dump of clients")
+    parser.add_argument("path")
+    parser.add_argument("--mode", choices=MODES, default="skip")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    from database import engine
+    import migrations
+
+    migrations.prepare(engine)
+
+    started = datetime.now(timezone.utc)
+    job = import_file(args.path, new_job(args.mode, args.chunk_size, os.path.getsize(args.path)))
+    elapsed = (datetime.now(timezone.utc) - started).total_seconds()
+    print(json.dumps(job.model_dump(), indent=2))
+    print(f"Finished in {elapsed:.1f}s")
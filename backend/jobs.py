@@ -0,0 +1,496 @@
+"""
+Background jobs: imports, exports and analytics recomputes run outside the
+request that asked for them.
+
+    POST /jobs                  {"type": "export", "params": {"format": "csv"}} -> 202 with the job
+    GET  /jobs                  recent jobs, newest first
+    GET  /jobs/{id}             status, progress and result
+    POST /jobs/{id}/cancel      stop a queued or running job
+    GET  /jobs/{id}/download    the file an export job wrote
+
+Job types are registered by the modules that implement them, with
+`@job_type(name, concurrency=...)`.  Each type has its own queue and at most
+`concurrency` jobs of that type run at once (JOBS_CONCURRENCY=export=2,...
+overrides it), in dedicated worker threads: a long import never takes a
+thread from the pool that serves sync endpoints, and a burst of exports can't
+starve imports.
+
+A handler receives a `Run`.  It reports progress with `run.checkpoint(...)`,
+which also raises `Cancelled` once the job was cancelled, so cancellation
+takes effect at the handler's next checkpoint.  Coroutine handlers are run on
+the application's event loop (they await the async engine like an endpoint
+would); only the waiting happens in the worker thread.
+
+JOBS_BACKEND selects where jobs and queues live:
+
+    local   (default) this process's memory; jobs are lost on restart
+    redis   REDIS_URL (any Redis-compatible server); every API process
+            sees every job and takes work from the shared queues, so the
+            concurrency limits apply per process.  Requires `redis`.
+"""
+
+import asyncio
+import inspect
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Type
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+from pydantic import BaseModel, ValidationError
+
+import schemas
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+BACKEND = os.getenv("JOBS_BACKEND", "local").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Export files and other job output
+JOBS_DIR = Path(os.getenv("JOBS_DIR", Path(tempfile.gettempdir()) / "task-manager-jobs"))
+
+MAX_JOBS = 100
+JOB_TTL_SECONDS = 24 * 3600
+POLL_SECONDS = 1.0
+# Progress is saved at most this often; cancellation is checked at every checkpoint
+PROGRESS_SECONDS = 0.25
+SHUTDOWN_SECONDS = 10.0
+
+FINISHED = ("completed", "failed", "cancelled")
+
+
+class Cancelled(Exception):
+    """Raised at a checkpoint of a job that was cancelled"""
+
+
+class JobType(NamedTuple):
+    name: str
+    handler: Callable
+    concurrency: int
+    params: Optional[Type[BaseModel]]
+    # False for types only other endpoints may submit (imports take an upload)
+    public: bool
+
+
+_types: Dict[str, JobType] = {}
+
+
+def _concurrency_overrides() -> Dict[str, int]:
+    overrides = {}
+    for item in os.getenv("JOBS_CONCURRENCY", "").split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip():
+            overrides[name.strip()] = int(value)
+    return overrides
+
+
+def job_type(name: str, concurrency: int = 1, params: Optional[Type[BaseModel]] = None, public: bool = True):
+    """Register the decorated function as the handler of a job type"""
+    def register(handler):
+        if name in _types:
+            raise ValueError(f"Job type {name} registered twice")
+        limit = _concurrency_overrides().get(name, concurrency)
+        _types[name] = JobType(name, handler, max(1, limit), params, public)
+        return handler
+    return register
+
+
+def artifact_path(job_id: str) -> Path:
+    """Where a job writes its output file"""
+    return JOBS_DIR / job_id
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+# ======================================================================
+# BACKENDS
+# ======================================================================
+
+class LocalBackend:
+    """Jobs and queues in this process's memory"""
+
+    def __init__(self):
+        self._jobs: "OrderedDict[str, schemas.Job]" = OrderedDict()
+        self._cancelled = set()
+        self._queues: Dict[str, queue.Queue] = defaultdict(queue.Queue)
+        self._lock = threading.Lock()
+
+    def save(self, job: schemas.Job) -> None:
+        with self._lock:
+            self._jobs[job.id] = job.model_copy(deep=True)
+            # Forget the oldest finished jobs; queued and running ones stay
+            excess = len(self._jobs) - MAX_JOBS
+            for old in [old for old in self._jobs.values() if old.status in FINISHED][:max(excess, 0)]:
+                del self._jobs[old.id]
+                self._cancelled.discard(old.id)
+                artifact_path(old.id).unlink(missing_ok=True)
+
+    def get(self, job_id: str) -> Optional[schemas.Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.model_copy(deep=True) if job is not None else None
+
+    def recent(self, limit: int) -> List[schemas.Job]:
+        with self._lock:
+            return [job.model_copy(deep=True) for job in reversed(self._jobs.values())][:limit]
+
+    def transition(self, job_id: str, expected: str, **changes) -> Optional[schemas.Job]:
+        """Apply `changes` if the job is still in status `expected`; return the updated job"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != expected:
+                return None
+            self._jobs[job_id] = job = job.model_copy(update=changes)
+            return job.model_copy(deep=True)
+
+    def push(self, job_type: str, job_id: str) -> None:
+        self._queues[job_type].put(job_id)
+
+    def pop(self, job_type: str, timeout: float) -> Optional[str]:
+        try:
+            return self._queues[job_type].get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def wake(self, job_type: str, workers: int) -> None:
+        """Return idle workers from pop() right away"""
+        for _ in range(workers):
+            self._queues[job_type].put(None)
+
+    def request_cancel(self, job_id: str) -> None:
+        with self._lock:
+            self._cancelled.add(job_id)
+
+    def cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._cancelled
+
+
+class RedisBackend:
+    """Jobs and queues in Redis, shared by every process using the same server"""
+
+    def __init__(self, url: str, prefix: str = "task-manager:jobs"):
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, *parts: str) -> str:
+        return ":".join((self.prefix,) + parts)
+
+    def save(self, job: schemas.Job) -> None:
+        pipe = self.redis.pipeline()
+        pipe.set(self._key("job", job.id), job.model_dump_json(), ex=JOB_TTL_SECONDS)
+        pipe.zadd(self._key("recent"), {job.id: time.time()}, nx=True)
+        pipe.zremrangebyrank(self._key("recent"), 0, -MAX_JOBS - 1)
+        pipe.execute()
+
+    def get(self, job_id: str) -> Optional[schemas.Job]:
+        raw = self.redis.get(self._key("job", job_id))
+        return schemas.Job.model_validate_json(raw) if raw is not None else None
+
+    def recent(self, limit: int) -> List[schemas.Job]:
+        ids = self.redis.zrevrange(self._key("recent"), 0, limit - 1)
+        return [job for job in (self.get(job_id.decode()) for job_id in ids) if job is not None]
+
+    def transition(self, job_id: str, expected: str, **changes) -> Optional[schemas.Job]:
+        key = self._key("job", job_id)
+
+        def update(pipe):
+            raw = pipe.get(key)
+            if raw is None:
+                return None
+            job = schemas.Job.model_validate_json(raw)
+            if job.status != expected:
+                return None
+            job = job.model_copy(update=changes)
+            pipe.multi()
+            pipe.set(key, job.model_dump_json(), ex=JOB_TTL_SECONDS)
+            return job
+
+        return self.redis.transaction(update, key, value_from_callable=True)
+
+    def push(self, job_type: str, job_id: str) -> None:
+        self.redis.rpush(self._key("queue", job_type), job_id)
+
+    def pop(self, job_type: str, timeout: float) -> Optional[str]:
+        item = self.redis.blpop([self._key("queue", job_type)], timeout=max(1, int(timeout)))
+        return item[1].decode() if item else None
+
+    def wake(self, job_type: str, workers: int) -> None:
+        pass  # pop() times out within POLL_SECONDS
+
+    def request_cancel(self, job_id: str) -> None:
+        self.redis.set(self._key("cancel", job_id), 1, ex=JOB_TTL_SECONDS)
+
+    def cancel_requested(self, job_id: str) -> bool:
+        return bool(self.redis.exists(self._key("cancel", job_id)))
+
+
+def _create_backend():
+    if BACKEND == "redis":
+        return RedisBackend(REDIS_URL)
+    if BACKEND != "local":
+        raise RuntimeError(f"Unknown JOBS_BACKEND {BACKEND!r} (expected local or redis)")
+    return LocalBackend()
+
+
+# ======================================================================
+# RUNNER
+# ======================================================================
+
+class Run:
+    """What a handler sees of the job it is running"""
+
+    def __init__(self, runner: "Runner", job: schemas.Job):
+        self._runner = runner
+        self._saved = 0.0
+        self.job = job
+
+    @property
+    def params(self) -> dict:
+        return self.job.params
+
+    @property
+    def cancelled(self) -> bool:
+        return self._runner.backend.cancel_requested(self.job.id)
+
+    def checkpoint(self, **progress) -> None:
+        """Record progress, and stop here if the job was cancelled"""
+        if progress:
+            self.job.progress.update(progress)
+            if time.monotonic() - self._saved >= PROGRESS_SECONDS:
+                self._runner.backend.save(self.job)
+                self._saved = time.monotonic()
+        if self.cancelled:
+            raise Cancelled()
+
+
+class Runner:
+    """Worker threads taking jobs from the backend's queues"""
+
+    def __init__(self):
+        self._backend = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._workers: Dict[str, List[threading.Thread]] = {}
+        # Jobs this runner's workers are executing; the backend may be shared with other processes
+        self._running: Set[str] = set()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._finished = threading.Condition()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = _create_backend()
+        return self._backend
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Run coroutine handlers on this loop"""
+        self._loop = loop
+        self._stopping.clear()
+
+    def submit(self, name: str, params: Optional[dict] = None, progress: Optional[dict] = None,
+               job_id: Optional[str] = None) -> schemas.Job:
+        """Queue a job; raises ValueError for an unknown type or invalid params"""
+        spec = _types.get(name)
+        if spec is None:
+            raise ValueError(f"Unknown job type '{name}'")
+        params = dict(params or {})
+        if spec.params is not None:
+            try:
+                params = spec.params.model_validate(params).model_dump(mode="json")
+            except ValidationError as e:
+                raise ValueError(f"Invalid params for {name}: {e.errors(include_url=False)}")
+
+        job = schemas.Job(
+            id=job_id or uuid.uuid4().hex, type=name, params=params, progress=dict(progress or {}),
+            created_at=_now(),
+        )
+        self.backend.save(job)
+        self.backend.push(name, job.id)
+        self._ensure_workers(spec)
+        return job
+
+    def get(self, job_id: str) -> Optional[schemas.Job]:
+        job = self.backend.get(job_id)
+        if job is not None and job.status not in FINISHED:
+            job.cancel_requested = self.backend.cancel_requested(job_id)
+        return job
+
+    def recent(self, limit: int = MAX_JOBS) -> List[schemas.Job]:
+        return self.backend.recent(limit)
+
+    def cancel(self, job_id: str) -> Optional[schemas.Job]:
+        """Cancel a queued job now, or ask a running one to stop at its next checkpoint"""
+        self.backend.request_cancel(job_id)
+        if self.backend.transition(job_id, "queued", status="cancelled", finished_at=_now()) is not None:
+            self._notify()
+        return self.get(job_id)
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[schemas.Job]:
+        """Block until the job finishes (or the timeout passes); return its last state"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            job = self.get(job_id)
+            if job is None or job.status in FINISHED:
+                return job
+            remaining = deadline - time.monotonic() if deadline is not None else POLL_SECONDS
+            if remaining <= 0:
+                return job
+            with self._finished:
+                # Jobs finished by another process aren't notified here: poll
+                self._finished.wait(min(remaining, POLL_SECONDS))
+
+    def _notify(self) -> None:
+        with self._finished:
+            self._finished.notify_all()
+
+    def _ensure_workers(self, spec: JobType) -> None:
+        with self._lock:
+            workers = [thread for thread in self._workers.get(spec.name, []) if thread.is_alive()]
+            while len(workers) < spec.concurrency:
+                thread = threading.Thread(
+                    target=self._work, args=(spec,), name=f"job-{spec.name}-{len(workers)}", daemon=True,
+                )
+                thread.start()
+                workers.append(thread)
+            self._workers[spec.name] = workers
+
+    def _work(self, spec: JobType) -> None:
+        while not self._stopping.is_set():
+            job_id = self.backend.pop(spec.name, POLL_SECONDS)
+            if job_id is not None:
+                self._execute(spec, job_id)
+
+    def _execute(self, spec: JobType, job_id: str) -> None:
+        # Claiming fails when the job was cancelled while queued
+        job = self.backend.transition(job_id, "queued", status="running", started_at=_now())
+        if job is None:
+            return
+        with self._lock:
+            self._running.add(job_id)
+            stopping = self._stopping.is_set()
+        if stopping:
+            # Popped while stop() was asking the others to stop
+            self.backend.request_cancel(job_id)
+        run = Run(self, job)
+        try:
+            if inspect.iscoroutinefunction(spec.handler):
+                if self._loop is None:
+                    raise RuntimeError("No event loop bound for coroutine jobs")
+                job.result = asyncio.run_coroutine_threadsafe(spec.handler(run), self._loop).result()
+            else:
+                job.result = spec.handler(run)
+            job.status = "completed"
+        except Cancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job.id, job.type)
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = _now()
+            self.backend.save(job)
+            with self._lock:
+                self._running.discard(job_id)
+            self._notify()
+
+    def stop(self, timeout: float = SHUTDOWN_SECONDS) -> None:
+        """Stop taking jobs, ask the ones this runner is running to stop and wait for them"""
+        with self._lock:
+            self._stopping.set()
+            workers = [thread for threads in self._workers.values() for thread in threads]
+            for name, threads in self._workers.items():
+                self.backend.wake(name, len(threads))
+            self._workers = {}
+            running = list(self._running)
+        for job_id in running:
+            self.backend.request_cancel(job_id)
+        deadline = time.monotonic() + timeout
+        for thread in workers:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+
+runner = Runner()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    runner.bind(asyncio.get_running_loop())
+    try:
+        yield
+    finally:
+        # Coroutine handlers need the loop to finish, so don't block it while waiting
+        await asyncio.to_thread(runner.stop)
+
+
+# ======================================================================
+# ENDPOINTS
+# ======================================================================
+
+def _get_or_404(job_id: str) -> schemas.Job:
+    job = runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("", response_model=schemas.Job, status_code=202)
+def create_job(request: schemas.JobCreate):
+    """Queue a job; poll `GET /jobs/{id}` for its progress and result"""
+    spec = _types.get(request.type)
+    if spec is None or not spec.public:
+        raise HTTPException(status_code=400, detail=f"Unknown job type '{request.type}'")
+    try:
+        return runner.submit(request.type, request.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("", response_model=List[schemas.Job])
+def list_jobs(type: Optional[str] = None, status: Optional[str] = None):
+    """Recent jobs, newest first"""
+    return [
+        job for job in runner.recent()
+        if (type is None or job.type == type) and (status is None or job.status == status)
+    ]
+
+
+@router.get("/{job_id}", response_model=schemas.Job)
+def get_job(job_id: str):
+    """Status, progress and result of a job"""
+    return _get_or_404(job_id)
+
+
+@router.post("/{job_id}/cancel", response_model=schemas.Job)
+def cancel_job(job_id: str):
+    """Cancel a queued job, or stop a running one at its next checkpoint"""
+    job = _get_or_404(job_id)
+    if job.status in FINISHED:
+        raise HTTPException(status_code=400, detail=f"Job already {job.status}")
+    return runner.cancel(job_id)
+
+
+@router.get("/{job_id}/download")
+def download_job_output(job_id: str):
+    """The file a completed job wrote"""
+    job = _get_or_404(job_id)
+    path = artifact_path(job.id)
+    if job.status != "completed" or not isinstance(job.result, dict) or not path.exists():
+        raise HTTPException(status_code=404, detail="Job has no file to download")
+    return FileResponse(path, filename=job.result.get("filename"), media_type=job.result.get("media_type"))
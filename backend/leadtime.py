@@ -0,0 +1,286 @@
+"""
+Lead-time and SLA-compliance statistics of completed tasks.
+
+The lead time of a task runs from creation_timestamp to completion_timestamp;
+it meets its SLA when completion_date is on or before sla_date.  For every
+group of completed tasks
+
+    all         every task
+    client      per client_id
+    priority    per priority
+    month       per month of completion_date (YYYY-MM)
+
+one lead_time_stats row holds the number of completed tasks, the SLA hits and
+misses, and a quantile sketch of the lead times.  The rows are kept up to date
+by the task writes themselves, imports included (`record`, in the transaction
+of the write), so GET /analytics/lead-time reads a handful of rows however
+many tasks were ever completed.  `rebuild` recomputes them from the tasks
+table: migration 7 runs it, as does the "lead_time" job.
+
+The sketch is a logarithmic histogram (DDSketch): value v falls in bucket
+ceil(log(v) / log(GAMMA)), so every quantile it reports is within ALPHA of
+the true value relative to it.  Merging two sketches adds their counts, which
+also makes them exact to subtract: a task that is reopened, edited or deleted
+after completion takes its sample back out.  Lead times from a second to
+years fit in a few hundred buckets, stored as a short JSON array.
+"""
+
+import json
+import math
+from collections import Counter, defaultdict
+from collections.abc import Mapping
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+import jobs
+from models import LeadTimeStat, Task, TaskStatus
+
+ALPHA = 0.01
+GAMMA = (1 + ALPHA) / (1 - ALPHA)
+_LOG_GAMMA = math.log(GAMMA)
+# Lead times shorter than this count as zero
+MIN_SECONDS = 1.0
+QUANTILES = (0.5, 0.9, 0.99)
+
+COMPLETED = TaskStatus.COMPLETED.value
+
+# What a task's contribution depends on: read before a write that may change it
+COLUMNS = (
+    Task.status, Task.client_id, Task.priority, Task.creation_timestamp,
+    Task.completion_timestamp, Task.completion_date, Task.sla_date,
+)
+_stats = LeadTimeStat.__table__
+
+
+class Sketch:
+    """Mergeable quantile sketch of non-negative values, relative error ALPHA"""
+
+    def __init__(self, zeros: int = 0, buckets: Optional[Dict[int, int]] = None):
+        self.zeros = zeros
+        self.buckets = Counter(buckets or {})
+
+    @property
+    def count(self) -> int:
+        return self.zeros + sum(self.buckets.values())
+
+    def add(self, value: float, count: int = 1) -> None:
+        """Add `count` samples of `value`; a negative count removes them"""
+        if value < MIN_SECONDS:
+            self.zeros += count
+        else:
+            self.buckets[math.ceil(math.log(value) / _LOG_GAMMA)] += count
+
+    def merge(self, other: "Sketch") -> None:
+        self.zeros += other.zeros
+        self.buckets.update(other.buckets)
+
+    def discard_empty(self) -> None:
+        """Drop buckets left at zero (or below, by removals that were never added)"""
+        self.zeros = max(self.zeros, 0)
+        self.buckets = Counter({index: count for index, count in self.buckets.items() if count > 0})
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Value at quantile q (0..1), or None for an empty sketch"""
+        total = self.count
+        if total <= 0:
+            return None
+        # Nearest rank: the smallest value with at least q of the samples at or below it
+        rank = max(math.ceil(q * total), 1) - 1
+        if rank < self.zeros:
+            return 0.0
+        seen = self.zeros
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # The midpoint of (GAMMA^(index-1), GAMMA^index] in relative terms
+                return 2 * GAMMA ** index / (GAMMA + 1)
+        return 2 * GAMMA ** max(self.buckets) / (GAMMA + 1)
+
+    def dumps(self) -> str:
+        """[zeros, index, count, gap to next index, count, ...]"""
+        encoded, previous = [self.zeros], None
+        for index in sorted(self.buckets):
+            encoded += [index if previous is None else index - previous, self.buckets[index]]
+            previous = index
+        return json.dumps(encoded, separators=(",", ":"))
+
+    @classmethod
+    def loads(cls, text: Optional[str]) -> "Sketch":
+        encoded = json.loads(text) if text else [0]
+        buckets, index = {}, 0
+        for position in range(1, len(encoded), 2):
+            index = encoded[position] if position == 1 else index + encoded[position]
+            buckets[index] = encoded[position + 1]
+        return cls(encoded[0], buckets)
+
+
+class _Delta:
+    """Change to one group's row"""
+
+    def __init__(self):
+        self.completed = 0
+        self.sla_met = 0
+        self.sla_missed = 0
+        self.sketch = Sketch()
+
+    def __bool__(self) -> bool:
+        return bool(self.completed or self.sla_met or self.sla_missed or self.sketch.zeros
+                    or any(self.sketch.buckets.values()))
+
+
+def state(task) -> Optional[dict]:
+    """The COLUMNS of a task, from a Task, a row or a dict of column values"""
+    if task is None:
+        return None
+    if isinstance(task, Mapping):
+        return {column.key: task.get(column.key) for column in COLUMNS}
+    return {column.key: getattr(task, column.key) for column in COLUMNS}
+
+
+def groups(task: dict) -> List[Tuple[str, str]]:
+    """(dimension, key) of every group a completed task belongs to"""
+    found = [("all", "")]
+    if task["client_id"]:
+        found.append(("client", task["client_id"]))
+    if task["priority"]:
+        found.append(("priority", task["priority"]))
+    completed_on = task["completion_date"] or (task["completion_timestamp"] and task["completion_timestamp"].date())
+    if completed_on:
+        found.append(("month", completed_on.strftime("%Y-%m")))
+    return found
+
+
+def lead_time(task: dict) -> Optional[float]:
+    """Seconds from creation to completion, None if either is unknown or they are out of order"""
+    if task["creation_timestamp"] is None or task["completion_timestamp"] is None:
+        return None
+    seconds = (task["completion_timestamp"] - task["creation_timestamp"]).total_seconds()
+    return seconds if seconds >= 0 else None
+
+
+def _accumulate(deltas: Dict[tuple, _Delta], task: Optional[dict], sign: int) -> None:
+    if task is None or task["status"] != COMPLETED:
+        return
+    seconds = lead_time(task)
+    met = None
+    if task["sla_date"] is not None and task["completion_date"] is not None:
+        met = task["completion_date"] <= task["sla_date"]
+    for group in groups(task):
+        delta = deltas[group]
+        delta.completed += sign
+        if met is True:
+            delta.sla_met += sign
+        elif met is False:
+            delta.sla_missed += sign
+        if seconds is not None:
+            delta.sketch.add(seconds, sign)
+
+
+def _apply(stat: LeadTimeStat, delta: _Delta) -> None:
+    sketch = Sketch.loads(stat.sketch)
+    sketch.merge(delta.sketch)
+    sketch.discard_empty()
+    stat.completed = max(stat.completed + delta.completed, 0)
+    stat.sla_met = max(stat.sla_met + delta.sla_met, 0)
+    stat.sla_missed = max(stat.sla_missed + delta.sla_missed, 0)
+    stat.sketch = sketch.dumps()
+
+
+async def previous(db: AsyncSession, *where) -> list:
+    """Id and COLUMNS of the tasks matching `where`, read before a write for `record`"""
+    return (await db.execute(select(Task.id, *COLUMNS).where(*where))).all()
+
+
+async def record(db: AsyncSession, changed: Iterable[tuple]) -> None:
+    """Move the stats from each (before, after) state of a task to the other.
+
+    Either may be None (a task created or deleted); see `state` for what
+    else they can be.  Writes nothing unless a completed task is involved.
+    """
+    await db.run_sync(record_changes, list(changed))
+
+
+def record_changes(session: Session, changed: Iterable[tuple]) -> None:
+    """`record` in a synchronous session, such as the importer's"""
+    deltas: Dict[tuple, _Delta] = defaultdict(_Delta)
+    for before, after in changed:
+        before, after = state(before), state(after)
+        if before != after:
+            _accumulate(deltas, before, -1)
+            _accumulate(deltas, after, 1)
+    deltas = {group: delta for group, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    stats = _locked(session, list(deltas))
+    missing = [group for group in deltas if group not in stats]
+    if missing:
+        # FOR UPDATE locks nothing for a row that isn't there: create the rows
+        # first, so a concurrent writer of the same new group waits for this one
+        session.execute(
+            _insert_ignore(session).values([
+                {"dimension": dimension, "key": group_key, "completed": 0, "sla_met": 0, "sla_missed": 0,
+                 "sketch": Sketch().dumps()}
+                for dimension, group_key in missing
+            ])
+        )
+        stats.update(_locked(session, missing))
+    for group, delta in deltas.items():
+        stat = stats[group]
+        _apply(stat, delta)
+        if not stat.completed:
+            # The last completed task of the group went (a deleted client, say)
+            session.delete(stat)
+
+
+def _locked(session: Session, groups: list) -> dict:
+    """The stats rows of `groups`, locked: concurrent writers on PostgreSQL must not lose each other's counts"""
+    key = tuple_(LeadTimeStat.dimension, LeadTimeStat.key)
+    return {
+        (stat.dimension, stat.key): stat
+        for stat in session.scalars(select(LeadTimeStat).where(key.in_(groups)).with_for_update())
+    }
+
+
+def _insert_ignore(session: Session):
+    """INSERT INTO lead_time_stats that skips the rows already there"""
+    if session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(_stats).on_conflict_do_nothing()
+    return sqlite.insert(_stats).on_conflict_do_nothing()
+
+
+def rebuild(session: Session, batch_size: int = 10000) -> int:
+    """Recompute every group from the completed tasks, in the session's transaction; returns how many were read"""
+    if session.get_bind().dialect.name == "postgresql":
+        session.connection().exec_driver_sql(f"LOCK TABLE {_stats.name} IN EXCLUSIVE MODE")
+    # Deleting first takes SQLite's write lock, so no write lands between the scan and the insert
+    session.execute(delete(LeadTimeStat))
+    deltas: Dict[tuple, _Delta] = defaultdict(_Delta)
+    rows = session.execute(
+        select(*COLUMNS).where(Task.status == COMPLETED).execution_options(yield_per=batch_size)
+    )
+    read = 0
+    for row in rows:
+        _accumulate(deltas, state(row), 1)
+        read += 1
+    if deltas:
+        session.execute(insert(LeadTimeStat), [
+            {"dimension": dimension, "key": key, "completed": delta.completed, "sla_met": delta.sla_met,
+             "sla_missed": delta.sla_missed, "sketch": delta.sketch.dumps()}
+            for (dimension, key), delta in deltas.items()
+        ])
+    return read
+
+
+@jobs.job_type("lead_time", concurrency=1)
+def rebuild_stats(run: jobs.Run) -> dict:
+    """Job handler: recompute the stats, after writes that bypassed the API for instance"""
+    with SessionLocal() as session:
+        tasks = rebuild(session)
+        session.commit()
+    return {"completed_tasks": tasks}
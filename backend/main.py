@@ -1,26 +1,56 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-import json
-from typing import List
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from typing import List, Optional
+from contextlib import asynccontextmanager
 import os
 from pathlib import Path
 from datetime import datetime, timezone
 import uuid
 
-from models import Base, Client, Task, Comment
-from database import engine, get_db
+from models import Client, Task, Comment
+from cache import versioned_json
+from database import async_engine, engine, get_async_db, pool_stats
 import schemas
+import admission
+import analytics
+import changes
+import events
+import exporter
+import importer
+import jobs
+import leadtime
+import metrics
+import migrations
+import profiler
+import search
+import serialization
+import sla
+import tasks
+import writer
+import writes
 
-# Create the database tables
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app):
+    # Builds a new database; an existing one must be migrated first (see migrations.py)
+    await run_in_threadpool(migrations.prepare, engine)
+    async with events.lifespan(app), jobs.lifespan(app), writer.lifespan(app):
+        yield
 
 app = FastAPI(
     title="Task Manager API",
     description="API for managing clients and their tasks",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
+# Inside CORS, so that 503s from load shedding carry the CORS headers too
+app.add_middleware(admission.AdmissionMiddleware)
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -28,7 +58,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", profiler.HEADER],
 )
+app.add_middleware(profiler.ProfilerMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+# Outermost: under serve.py a reader hands writes to the writer process, which counts them itself
+app.add_middleware(writer.WriterMiddleware)
+for instrumented, name in ((engine, "sync"), (async_engine.sync_engine, "async")):
+    metrics.instrument_engine(instrumented, name)
+    profiler.instrument_engine(instrumented)
+
+app.include_router(analytics.router)
+app.include_router(tasks.router)
+app.include_router(sla.router)
+app.include_router(importer.router)
+app.include_router(exporter.router)
+app.include_router(jobs.router)
+app.include_router(changes.router)
+app.include_router(events.router)
+app.include_router(metrics.router)
+app.include_router(profiler.router)
 
 # ======================================================================
 # SYSTEM ENDPOINTS
@@ -43,361 +92,299 @@ async def health_check():
         "version": "1.0.0"
     }
 
+@app.get("/health/db")
+async def database_health():
+    """Connection pool statistics, for sizing the pool under real load"""
+    return {
+        "backend": engine.dialect.name,
+        "sync_pool": pool_stats(engine),
+        "async_pool": pool_stats(async_engine.sync_engine),
+    }
+
 @app.post("/import-data/")
-async def import_data(db: Session = Depends(get_db)):
+async def import_data():
     """Import data from JSON file"""
-    try:
-        # Get the absolute path to data.json
-        current_dir = Path(__file__).parent
-        json_path = current_dir / "data.json"
-        
-        # Read the JSON file
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        
-        # Import each client and their tasks
-        for client_data in data:
-            # Check if client already exists
-            existing_client = db.query(Client).filter(Client.id == client_data["id"]).first()
-            if existing_client:
-                continue
-                
-            db_client = Client(
-                id=client_data["id"],
-                name=client_data["name"],
-                company=client_data["company"],
-                origin=client_data["origin"]
-            )
-            db.add(db_client)
-            
-            for task_data in client_data["tasks"]:
-                db_task = Task(
-                    date=task_data["date"],
-                    description=task_data["description"],
-                    status=task_data["status"],
-                    priority=task_data["priority"],
-                    client_id=client_data["id"]
-                )
-                db.add(db_task)
-        
-        db.commit()
-        return {"message": "Data imported successfully"}
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
+    # Get the absolute path to data.json
+    json_path = Path(__file__).parent / "data.json"
+
+    # Existing clients are left untouched, as before.  Runs as an import job,
+    # so it queues behind uploads instead of competing with them.
+    queued = importer.submit_import(str(json_path), "skip")
+    job = importer.import_status(await run_in_threadpool(jobs.runner.wait, queued.id))
+    if job.status != "completed":
+        raise HTTPException(status_code=500, detail=job.error)
+    return {"message": "Data imported successfully", "job": job}
 
 # ======================================================================
 # CLIENT ENDPOINTS
 # ======================================================================
 
+def client_values(client: schemas.ClientBase) -> dict:
+    return {"id": client.id, "name": client.name, "company": client.company, "origin": client.origin}
+
 @app.post("/clients/", response_model=schemas.Client)
-async def create_client(client: schemas.ClientCreate, db: Session = Depends(get_db)):
+async def create_client(client: schemas.ClientCreate):
     """Create a new client with optional tasks (legacy support)"""
-    # Check if this is a client with tasks (legacy) or just client data
-    if hasattr(client, 'tasks') and client.tasks:
+    async def write(db: AsyncSession):
+        # Check if this is a client with tasks (legacy) or just client data
+        if not client.tasks:
+            return schemas.Client.model_validate(await writes.insert_row(db, Client, client_values(client)))
+
         # Legacy mode: create client with tasks
-        db_client = Client(
-            id=client.id,
-            name=client.name,
-            company=client.company,
-            origin=client.origin
-        )
-        db.add(db_client)
-        
+        db.add(Client(**client_values(client)))
         for task in client.tasks:
-            db_task = Task(
+            db.add(Task(
                 date=task.date,
                 description=task.description,
                 status=task.status,
                 priority=task.priority,
                 client_id=client.id
-            )
-            db.add(db_task)
-    else:
-        # New mode: create client only
-        db_client = Client(
-            id=client.id,
-            name=client.name,
-            company=client.company,
-            origin=client.origin
-        )
-        db.add(db_client)
-    
-    try:
-        db.commit()
-        db.refresh(db_client)
-        return db_client
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
+            ))
+        await db.flush()
+        return schemas.Client.model_validate(await load_client(db, client.id))
+
+    return await writes.run(write)
 
 @app.post("/clients-only/", response_model=schemas.ClientOnly)
-async def create_client_only(client: schemas.ClientOnly, db: Session = Depends(get_db)):
+async def create_client_only(client: schemas.ClientOnly):
     """Create a new client without tasks"""
-    # Check if client ID already exists
-    existing_client = db.query(Client).filter(Client.id == client.id).first()
-    if existing_client:
-        raise HTTPException(status_code=400, detail="Client with this ID already exists")
-    
-    db_client = Client(
-        id=client.id,
-        name=client.name,
-        company=client.company,
-        origin=client.origin
-    )
-    db.add(db_client)
-    
-    try:
-        db.commit()
-        db.refresh(db_client)
-        return db_client
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
+    async def write(db: AsyncSession):
+        try:
+            return schemas.ClientOnly.model_validate(await writes.insert_row(db, Client, client_values(client)))
+        except IntegrityError:
+            raise HTTPException(status_code=400, detail="Client with this ID already exists")
+
+    return await writes.run(write)
+
+def client_with_tasks():
+    """Loader options fetching a client's tasks and their comments in two extra SELECTs
+    instead of lazy-loading them per client and per task during serialization"""
+    return (selectinload(Client.tasks).selectinload(Task.comments),)
+
+def select_clients_with_tasks():
+    return select(Client).options(*client_with_tasks())
+
+async def load_client(db: AsyncSession, client_id: str) -> Optional[Client]:
+    """Fetch a client with its tasks and comments fully loaded"""
+    query = select_clients_with_tasks().where(Client.id == client_id)
+    result = await db.execute(query.execution_options(populate_existing=True))
+    return result.scalars().first()
 
 @app.get("/clients/", response_model=List[schemas.Client])
-async def get_clients(skip: int = 0, limit: int = 1000, db: Session = Depends(get_db)):
-    """Get clients with pagination"""
-    clients = db.query(Client).offset(skip).limit(limit).all()
-    return clients
+async def get_clients(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(1000, ge=1),
+    fieldset: serialization.Fieldset = Depends(serialization.fieldset_parameter("clients")),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Get clients with keyset pagination.
+
+    Pass the `X-Next-Cursor` header of a page as `cursor` to get the next one;
+    the header is absent on the last page.  Send the `ETag` back as
+    `If-None-Match` to get a 304 when nothing has changed.  `fields` and
+    `include` trim the documents, e.g. `include=tasks&fields=tasks.status`.
+    """
+    async def build():
+        query = serialization.select_client_rows(fieldset).order_by(Client.id)
+        if cursor is not None:
+            query = query.where(Client.id > cursor)
+        clients = await serialization.load_client_documents(db, query.limit(limit + 1), fieldset)
+
+        headers = {}
+        if len(clients) > limit:
+            clients = clients[:limit]
+            headers["X-Next-Cursor"] = clients[-1]["id"]
+        return serialization.dumps(clients), headers
+
+    return await versioned_json(request, ("clients", cursor, limit, fieldset), build)
 
 @app.get("/clients/all", response_model=List[schemas.Client])
-async def get_all_clients(db: Session = Depends(get_db)):
+async def get_all_clients(
+    request: Request,
+    fieldset: serialization.Fieldset = Depends(serialization.fieldset_parameter("clients")),
+    db: AsyncSession = Depends(get_async_db),
+):
     """Get all clients without pagination"""
-    clients = db.query(Client).all()
-    return clients
+    async def build():
+        query = serialization.select_client_rows(fieldset)
+        clients = await serialization.load_client_documents(db, query, fieldset)
+        return serialization.dumps(clients), {}
+
+    return await versioned_json(request, ("clients-all", fieldset), build)
 
 @app.get("/clients/{client_id}", response_model=schemas.Client)
-async def get_client(client_id: str, db: Session = Depends(get_db)):
+async def get_client(
+    client_id: str,
+    fieldset: serialization.Fieldset = Depends(serialization.fieldset_parameter("clients")),
+    db: AsyncSession = Depends(get_async_db),
+):
     """Get a specific client by ID"""
-    client = db.query(Client).filter(Client.id == client_id).first()
-    if client is None:
+    query = serialization.select_client_rows(fieldset).where(Client.id == client_id)
+    clients = await serialization.load_client_documents(db, query, fieldset)
+    if not clients:
         raise HTTPException(status_code=404, detail="Client not found")
-    return client
+    return Response(serialization.dumps(clients[0]), media_type="application/json")
 
 @app.put("/clients/{client_id}", response_model=schemas.Client)
-async def update_client(client_id: str, client_update: schemas.ClientUpdate, db: Session = Depends(get_db)):
+async def update_client(client_id: str, client_update: schemas.ClientUpdate):
     """Update a client's information"""
-    db_client = db.query(Client).filter(Client.id == client_id).first()
-    if db_client is None:
-        raise HTTPException(status_code=404, detail="Client not found")
-    
-    # Update client fields
-    for field, value in client_update.dict(exclude_unset=True).items():
-        if value is not None:  # Only update fields that are provided
-            setattr(db_client, field, value)
-    
-    try:
-        db.commit()
-        db.refresh(db_client)
-        return db_client
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
+    # Only update fields that are provided
+    values = {field: value for field, value in client_update.model_dump(exclude_unset=True).items()
+              if value is not None}
+
+    async def write(db: AsyncSession):
+        if values:
+            db_client = await writes.update_row(db, Client, client_id, values, *client_with_tasks())
+        else:
+            db_client = await load_client(db, client_id)
+        if db_client is None:
+            raise HTTPException(status_code=404, detail="Client not found")
+        return schemas.Client.model_validate(db_client)
+
+    return await writes.run(write)
 
 @app.delete("/clients/{client_id}", response_model=schemas.ClientOnly)
-async def delete_client(client_id: str, db: Session = Depends(get_db)):
+async def delete_client(client_id: str):
     """Delete a client and all associated tasks"""
-    client = db.query(Client).filter(Client.id == client_id).first()
-    if client is None:
-        raise HTTPException(status_code=404, detail="Client not found")
-    
-    try:
-        # Delete all associated tasks first
-        db.query(Task).filter(Task.client_id == client_id).delete()
-        # Then delete the client
-        db.delete(client)
-        db.commit()
-        return client
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
+    async def write(db: AsyncSession):
+        completed = await leadtime.previous(db, Task.client_id == client_id, Task.status == leadtime.COMPLETED)
+        # Delete all associated comments and tasks first, for the foreign keys
+        client_tasks = select(Task.id).where(Task.client_id == client_id)
+        await db.execute(delete(Comment).where(Comment.task_id.in_(client_tasks)))
+        await db.execute(delete(Task).where(Task.client_id == client_id))
+        # Then the client; a missing one rolls the write back
+        deleted = await writes.delete_rows(db, Client, Client.id == client_id)
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Client not found")
+        await leadtime.record(db, [(task, None) for task in completed])
+        return schemas.ClientOnly.model_validate(deleted[0])
+
+    return await writes.run(write)
 
 # ======================================================================
 # TASK ENDPOINTS
 # ======================================================================
 
 @app.post("/tasks/", response_model=schemas.Task)
-async def create_task(task: schemas.TaskCreate, db: Session = Depends(get_db)):
+async def create_task(task: schemas.TaskCreate):
     """Create a new task for a client"""
-    # Verify client exists
-    client = db.query(Client).filter(Client.id == task.client_id).first()
-    if client is None:
-        raise HTTPException(status_code=404, detail="Client not found")
-    
-    # Set completion_date and timestamps if status is 'completed'
-    completion_date = None
-    completion_timestamp = None
-    creation_timestamp = datetime.now(timezone.utc).isoformat()
-    
-    if task.status == 'completed':
-        completion_date = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-        completion_timestamp = creation_timestamp
-    
-    db_task = Task(
-        date=task.date,
-        description=task.description,
-        status=task.status,
-        priority=task.priority,
-        client_id=task.client_id,
-        sla_date=task.sla_date,
-        completion_date=completion_date if task.completion_date is None else task.completion_date,
-        creation_timestamp=creation_timestamp,
-        completion_timestamp=completion_timestamp
-    )
-    db.add(db_task)
-    
-    try:
-        db.commit()
-        db.refresh(db_task)
-        return db_task
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
+    async def write(db: AsyncSession):
+        # Verify client exists
+        if await db.scalar(select(Client.id).where(Client.id == task.client_id)) is None:
+            raise HTTPException(status_code=404, detail="Client not found")
+        # Stamps creation_timestamp, and completion fields if created as 'completed'
+        db_task = await writes.insert_row(db, Task, tasks.new_task_row(task))
+        await leadtime.record(db, [(None, db_task)])
+        return schemas.Task.model_validate(db_task)
+
+    return await writes.run(write)
 
 @app.put("/tasks/{task_id}", response_model=schemas.Task)
-async def update_task(task_id: int, task_update: schemas.TaskUpdate, db: Session = Depends(get_db)):
+async def update_task(task_id: int, task_update: schemas.TaskUpdate):
     """Update a task's information"""
-    db_task = db.query(Task).filter(Task.id == task_id).first()
-    if db_task is None:
-        raise HTTPException(status_code=404, detail="Task not found")
-    
-    # Store original status to check if it changed
-    original_status = db_task.status
-    
-    # Update task fields
-    for field, value in task_update.dict(exclude_unset=True).items():
-        if value is not None:  # Only update fields that are provided
-            setattr(db_task, field, value)
-    
-    # Auto-set completion_date and completion_timestamp when status changes to 'completed'
-    if task_update.status == 'completed' and original_status != 'completed':
-        db_task.completion_date = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-        db_task.completion_timestamp = datetime.now(timezone.utc).isoformat()
-    # Clear completion_date and completion_timestamp if status changes from 'completed' to something else
-    elif original_status == 'completed' and task_update.status != 'completed' and task_update.completion_date is None:
-        db_task.completion_date = None
-        db_task.completion_timestamp = None
-    
-    try:
-        db.commit()
-        db.refresh(db_task)
-        return db_task
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
+    # Only update fields that are provided, then auto-set or clear the
+    # completion fields when the status moves to or away from 'completed'
+    values = tasks.provided_fields(task_update)
+    values.update(tasks.completion_values(values))
+
+    async def write(db: AsyncSession):
+        if not values:
+            db_task = await db.get(Task, task_id, options=[selectinload(Task.comments)])
+            if db_task is None:
+                raise HTTPException(status_code=404, detail="Task not found")
+            return schemas.Task.model_validate(db_task)
+
+        # The task as it was, to move its lead-time stats if it is or was completed
+        found = await leadtime.previous(db, Task.id == task_id)
+        if not found:
+            raise HTTPException(status_code=404, detail="Task not found")
+        db_task = await writes.update_row(db, Task, task_id, values, selectinload(Task.comments), previous=found[0])
+        if db_task is None:
+            raise HTTPException(status_code=404, detail="Task not found")
+        await leadtime.record(db, [(found[0], db_task)])
+        return schemas.Task.model_validate(db_task)
+
+    return await writes.run(write)
 
 @app.delete("/tasks/{task_id}", response_model=schemas.Task)
-async def delete_task(task_id: int, db: Session = Depends(get_db)):
+async def delete_task(task_id: int):
     """Delete a task"""
-    db_task = db.query(Task).filter(Task.id == task_id).first()
-    if db_task is None:
-        raise HTTPException(status_code=404, detail="Task not found")
-    
-    try:
-        db.delete(db_task)
-        db.commit()
-        return db_task
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
+    async def write(db: AsyncSession):
+        # Comments first, for the foreign key; a missing task rolls the write back
+        comments = await writes.delete_rows(db, Comment, Comment.task_id == task_id)
+        deleted = await writes.delete_rows(db, Task, Task.id == task_id)
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Task not found")
+        db_task = deleted[0]
+        await leadtime.record(db, [(db_task, None)])
+        set_committed_value(db_task, "comments", comments)
+        return schemas.Task.model_validate(db_task)
+
+    return await writes.run(write)
 
 # ======================================================================
 # COMMENT ENDPOINTS
 # ======================================================================
 
 @app.post("/tasks/{task_id}/comments/", response_model=schemas.Comment)
-async def create_comment(task_id: int, comment: schemas.CommentCreate, db: Session = Depends(get_db)):
+async def create_comment(task_id: int, comment: schemas.CommentCreate):
     """Create a new comment for a task"""
-    # Verify task exists
-    task = db.query(Task).filter(Task.id == task_id).first()
-    if task is None:
-        raise HTTPException(status_code=404, detail="Task not found")
-    
     # Generate a unique comment ID
-    comment_id = str(uuid.uuid4())[:8]
-    
-    db_comment = Comment(
-        id=comment_id,
-        task_id=task_id,
-        text=comment.text,
-        timestamp=datetime.now(timezone.utc).isoformat(),
-        author=comment.author or "User"
-    )
-    db.add(db_comment)
-    
-    try:
-        db.commit()
-        db.refresh(db_comment)
-        return db_comment
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
+    values = {
+        "id": str(uuid.uuid4())[:8],
+        "task_id": task_id,
+        "text": comment.text,
+        "timestamp": datetime.now(timezone.utc),
+        "author": comment.author or "User",
+    }
+
+    async def write(db: AsyncSession):
+        # Verify task exists
+        if await db.scalar(select(Task.id).where(Task.id == task_id)) is None:
+            raise HTTPException(status_code=404, detail="Task not found")
+        return schemas.Comment.model_validate(await writes.insert_row(db, Comment, values))
+
+    return await writes.run(write)
 
 @app.get("/tasks/{task_id}/comments/", response_model=List[schemas.Comment])
-async def get_task_comments(task_id: int, db: Session = Depends(get_db)):
+async def get_task_comments(task_id: int, db: AsyncSession = Depends(get_async_db)):
     """Get all comments for a specific task"""
     # Verify task exists
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await db.get(Task, task_id)
     if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    comments = db.query(Comment).filter(Comment.task_id == task_id).all()
+    comments = (await db.execute(select(Comment).where(Comment.task_id == task_id))).scalars().all()
     return comments
 
 @app.get("/comments/search")
-async def search_all_comments(q: str = "", db: Session = Depends(get_db)):
-    """Search across all comments globally"""
-    if not q or len(q.strip()) < 2:
-        return {"results": [], "total": 0, "query": q}
-    
-    search_term = f"%{q.strip()}%"
-    
-    # Search in comment text and author fields
-    comments = db.query(Comment, Task, Client).join(
-        Task, Comment.task_id == Task.id
-    ).join(
-        Client, Task.client_id == Client.id
-    ).filter(
-        (Comment.text.ilike(search_term)) | 
-        (Comment.author.ilike(search_term))
-    ).order_by(Comment.timestamp.desc()).all()
-    
-    results = []
-    for comment, task, client in comments:
-        results.append({
-            "id": comment.id,
-            "text": comment.text,
-            "author": comment.author,
-            "timestamp": comment.timestamp,
-            "task_id": comment.task_id,
-            "task_description": task.description,
-            "client_id": client.id,
-            "client_name": client.name,
-            "client_company": client.company
-        })
-    
-    return {
-        "results": results,
-        "total": len(results),
-        "query": q
-    }
+async def search_all_comments(
+    q: str = "",
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Search across all comments globally, best matches first.
 
-@app.delete("/comments/{comment_id}", response_model=schemas.Comment)
-async def delete_comment(comment_id: str, db: Session = Depends(get_db)):
-    """Delete a comment"""
-    comment = db.query(Comment).filter(Comment.id == comment_id).first()
-    if comment is None:
-        raise HTTPException(status_code=404, detail="Comment not found")
-    
+    Pass `next_cursor` from a response as `cursor` to fetch the next page.
+    """
     try:
-        db.delete(comment)
-        db.commit()
-        return comment
-    except Exception as e:
-        db.rollback()
+        return await search.search_comments(db, q, limit=limit, cursor=cursor)
+    except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.delete("/comments/{comment_id}", response_model=schemas.Comment)
+async def delete_comment(comment_id: str):
+    """Delete a comment"""
+    async def write(db: AsyncSession):
+        deleted = await writes.delete_rows(db, Comment, Comment.id == comment_id)
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Comment not found")
+        return schemas.Comment.model_validate(deleted[0])
+
+    return await writes.run(write)
+
 # ======================================================================
 # APPLICATION STARTUP
 # ======================================================================
@@ -0,0 +1,234 @@
+"""
+Prometheus metrics and the slow-query log.
+
+`GET /metrics` exposes, in the Prometheus text format:
+
+    http_requests_total                     requests per route template, method and status
+    http_request_duration_seconds           latency histogram per route and method
+    http_requests_in_progress               requests being handled right now, per route
+    db_query_duration_seconds               every SQL statement, by operation
+    db_queries_per_request                  statements a request ran, per route
+    db_query_seconds_per_request            time a request spent in SQL, per route
+    db_pool_checkout_wait_seconds           time to get a pooled connection, per engine
+    process_*                               CPU, memory and file descriptors of the worker
+
+Routes are labelled by their template (`/tasks/{task_id}`), so the number of
+series stays bounded.  SQL is timed with engine events on both engines and
+attributed to the request through a context variable, which reaches the
+async engine's greenlets and the threadpool.  Statements slower than
+SLOW_QUERY_MS are logged with their route.
+
+Each process counts on its own.  Under serve.py, PROMETHEUS_MULTIPROC_DIR
+is set and every worker writes its samples there, so whichever worker
+answers /metrics reports the sum over all of them (gauges of live workers
+only; no process_* metrics in that mode).
+"""
+
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import APIRouter, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, ProcessCollector, generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["metrics"])
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_MAX_CHARS = 2000
+
+UNMATCHED = "unmatched"
+
+# prometheus_client switches to file-backed values when this is set at import
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+registry = CollectorRegistry()
+if not MULTIPROCESS:
+    ProcessCollector(registry=registry)
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests", ("method", "route", "status"), registry=registry,
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route"), registry=registry,
+)
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests being handled", ("method", "route"), registry=registry,
+    multiprocess_mode="livesum",
+)
+QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "SQL statement latency", ("operation",), registry=registry,
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "SQL statements per HTTP request", ("route",), registry=registry,
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 1000),
+)
+QUERY_SECONDS_PER_REQUEST = Histogram(
+    "db_query_seconds_per_request", "Time spent in SQL per HTTP request", ("route",), registry=registry,
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time to check a connection out of the pool", ("engine",),
+    registry=registry, buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+
+
+class RequestStats:
+    """SQL run on behalf of one request"""
+
+    __slots__ = ("route", "queries", "seconds")
+
+    def __init__(self, route: str):
+        self.route = route
+        self.queries = 0
+        self.seconds = 0.0
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def _flatten(routes):
+    for route in routes:
+        # Newer FastAPI keeps included routers as one entry; expand them to their full paths
+        if hasattr(route, "effective_route_contexts"):
+            yield from route.effective_route_contexts()
+        elif hasattr(route, "path_regex"):
+            yield route
+
+
+def _route_table(app) -> list:
+    table = getattr(app.state, "metrics_routes", None)
+    if table is None:
+        table = [
+            (route.path_regex, getattr(route, "methods", None), route.path)
+            for route in _flatten(getattr(app, "routes", ()))
+        ]
+        app.state.metrics_routes = table
+    return table
+
+
+def route_template(scope) -> str:
+    """The path template of the route a request will be routed to"""
+    app = scope.get("app")
+    if app is None or not hasattr(app, "state"):
+        return UNMATCHED
+    path = scope["path"]
+    root_path = scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+
+    partial = UNMATCHED
+    for regex, methods, template in _route_table(app):
+        if regex.match(path):
+            if not methods or scope["method"] in methods or (scope["method"] == "HEAD" and "GET" in methods):
+                return template
+            if partial == UNMATCHED:
+                partial = template  # path matches, method doesn't
+    return partial
+
+
+class MetricsMiddleware:
+    """Count and time every HTTP request, and the SQL it runs"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        route = route_template(scope)
+        stats = RequestStats(route)
+        token = _current.set(stats)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress = IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_DURATION.labels(method, route).observe(time.perf_counter() - started)
+            REQUESTS.labels(method, route, str(status)).inc()
+            QUERIES_PER_REQUEST.labels(route).observe(stats.queries)
+            QUERY_SECONDS_PER_REQUEST.labels(route).observe(stats.seconds)
+            in_progress.dec()
+            _current.reset(token)
+
+
+def _operation(statement: str) -> str:
+    word = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return word if word in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH") else "OTHER"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    elapsed = time.perf_counter() - started
+    QUERY_DURATION.labels(_operation(statement)).observe(elapsed)
+
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning(
+            "Slow query (%.1f ms) on %s: %s",
+            elapsed * 1000, stats.route if stats else "(no request)", statement[:SLOW_QUERY_MAX_CHARS],
+        )
+
+
+def _handle_error(context):
+    # The statement never reached after_cursor_execute
+    started = context.connection.info.get("query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def instrument_engine(engine: Engine, name: str) -> Engine:
+    """Time the statements and pool checkouts of a sync engine (or an async engine's sync_engine)"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+    # The pool has no "before checkout" event; every checkout goes through raw_connection
+    raw_connection = engine.raw_connection
+    wait = POOL_CHECKOUT_WAIT.labels(name)
+
+    def timed_raw_connection():
+        started = time.perf_counter()
+        try:
+            return raw_connection()
+        finally:
+            wait.observe(time.perf_counter() - started)
+
+    engine.raw_connection = timed_raw_connection
+    return engine
+
+
+@router.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Prometheus scrape endpoint"""
+    if MULTIPROCESS:
+        combined = CollectorRegistry()
+        multiprocess.MultiProcessCollector(combined)
+        return Response(generate_latest(combined), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations.
+
+Every change to the schema of an existing database is a numbered migration
+below, and the schema_migrations table records which ones a database has
+applied.  New databases are built from models.py and recorded at the latest
+version, so migrations only ever run against databases that predate them:
+
+    python migrations.py                  apply the pending migrations
+    python migrations.py --status         list them
+    python migrations.py --batch-size 500 --pause 0.05
+
+Migrations are written so the API keeps serving while they run.  Schema
+changes are additive and short (a nullable column, a new table, an index,
+built CONCURRENTLY on PostgreSQL).  Data changes go through
+`Context.batches`, which walks a table in primary-key order, one short
+transaction per batch, and saves its position in the same transaction, so an
+interrupted run resumes where it stopped.  On SQLite, where a batch holds the
+write lock, --pause leaves the API's writers room between batches.
+
+The API refuses to start while migrations are pending (unless
+MIGRATE_ON_STARTUP is set): run them before deploying the new version.
+Never edit a migration that has shipped; add a new one.  Startup checks hold
+`startup_lock`, so worker processes starting together on a fresh database
+don't all try to create it.
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, List, NamedTuple, Optional
+
+from sqlalchemy import String, bindparam, func, insert, inspect, select, text, true, type_coerce, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from database import engine
+from dates import parse_date, parse_timestamp
+from models import Base, Client, Comment, ISODate, LeadTimeStat, SchemaMigration, SyncState, Task, Tombstone
+import leadtime
+import search
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "1000"))
+# pg_advisory_lock key of startup_lock
+ADVISORY_LOCK_KEY = 0x7A5C
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "").lower() in ("1", "true", "yes")
+
+_versions = SchemaMigration.__table__
+_clients = Client.__table__
+_tasks = Task.__table__
+_comments = Comment.__table__
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int):
+    """Register a function as migration `version`; versions must increase"""
+    def register(apply):
+        if MIGRATIONS and version <= MIGRATIONS[-1].version:
+            raise ValueError(f"Migration {version} registered after {MIGRATIONS[-1].version}")
+        MIGRATIONS.append(Migration(version, apply.__name__, apply))
+        return apply
+    return register
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Context:
+    """What a running migration works with: the engine, its checkpoint and the batching helpers"""
+
+    def __init__(self, bind: Engine, version: int, checkpoint: Optional[dict] = None,
+                 batch_size: int = BATCH_SIZE, pause: float = 0):
+        self.bind = bind
+        self.version = version
+        self.checkpoint = checkpoint or {}
+        self.batch_size = batch_size
+        self.pause = pause
+
+    @property
+    def dialect(self) -> str:
+        return self.bind.dialect.name
+
+    def has_table(self, name: str) -> bool:
+        return inspect(self.bind).has_table(name)
+
+    def columns(self, table_name: str) -> dict:
+        return {column["name"]: column for column in inspect(self.bind).get_columns(table_name)}
+
+    def create_table(self, table) -> None:
+        if not self.has_table(table.name):
+            print(f"Creating table {table.name}")
+            table.create(bind=self.bind)
+
+    def add_column(self, column, ddl: Optional[str] = None) -> None:
+        """Add a model column missing from the database, typed as in models.py unless `ddl` is given"""
+        table = column.table.name
+        if column.name in self.columns(table):
+            return
+        ddl = ddl or column.type.compile(dialect=self.bind.dialect)
+        print(f"Adding {table}.{column.name} {ddl}")
+        with self.bind.begin() as conn:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column.name} {ddl}")
+
+    def save(self, conn: Connection, progress: dict) -> None:
+        """Record progress, in the transaction of the work it describes"""
+        self.checkpoint.update(progress)
+        conn.execute(
+            update(_versions).where(_versions.c.version == self.version)
+            .values(checkpoint=json.dumps(self.checkpoint))
+        )
+
+    def batches(self, step: str, table, columns, where, handle: Callable) -> int:
+        """Call handle(conn, rows) on the rows matching `where`, a batch at a time in id order.
+
+        Each batch is one transaction and checkpoints its last id under
+        `step`, so a resumed run starts after the last committed batch.
+        Returns the number of rows handled.
+        """
+        last_id = self.checkpoint.get(step)
+
+        def remaining():
+            return table.c.id > last_id if last_id is not None else true()
+
+        with self.bind.connect() as conn:
+            total = conn.scalar(select(func.count()).select_from(table).where(where, remaining()))
+        done = 0
+        while True:
+            with self.bind.begin() as conn:
+                rows = conn.execute(
+                    select(table.c.id, *columns).where(where, remaining())
+                    .order_by(table.c.id).limit(self.batch_size)
+                ).mappings().all()
+                if not rows:
+                    break
+                handle(conn, rows)
+                last_id = rows[-1]["id"]
+                self.save(conn, {step: last_id})
+            done += len(rows)
+            print(f"  {step}: {done}/{total} rows")
+            if self.pause:
+                time.sleep(self.pause)
+        return done
+
+    def backfill(self, step: str, table, values: dict, where) -> int:
+        """UPDATE table SET values WHERE where, in batches (see `batches`)"""
+        def handle(conn, rows):
+            conn.execute(update(table).where(table.c.id.in_([row["id"] for row in rows])).values(values))
+        return self.batches(step, table, (), where, handle)
+
+
+# ======================================================================
+# MIGRATIONS
+# ======================================================================
+
+@migration(1)
+def add_sla_dates(ctx: Context):
+    """tasks.sla_date and tasks.completion_date"""
+    ctx.add_column(_tasks.c.sla_date)
+    ctx.add_column(_tasks.c.completion_date)
+
+
+@migration(2)
+def add_comments(ctx: Context):
+    """The comments table"""
+    ctx.create_table(_comments)
+
+
+@migration(3)
+def add_task_timestamps(ctx: Context):
+    """tasks.creation_timestamp and completion_timestamp, set to the time of the migration on existing tasks"""
+    ctx.add_column(_tasks.c.creation_timestamp)
+    ctx.add_column(_tasks.c.completion_timestamp)
+    now = datetime.now(timezone.utc)
+    ctx.backfill(
+        "tasks.creation_timestamp", _tasks, {"creation_timestamp": now},
+        _tasks.c.creation_timestamp.is_(None),
+    )
+    ctx.backfill(
+        "tasks.completion_timestamp", _tasks, {"completion_timestamp": now},
+        (_tasks.c.status == "completed") & _tasks.c.completion_timestamp.is_(None),
+    )
+
+
+@migration(4)
+def add_revisions(ctx: Context):
+    """Change tracking (see changes.py); existing rows get revision 1, so syncing from 0 returns them"""
+    ctx.create_table(SyncState.__table__)
+    ctx.create_table(Tombstone.__table__)
+    now = _now()
+    for table in (_clients, _tasks, _comments):
+        ctx.add_column(table.c.revision, "INTEGER NOT NULL DEFAULT 0")
+        ctx.add_column(table.c.updated_at)
+        ctx.backfill(f"{table.name}.revision", table, {"revision": 1, "updated_at": now}, table.c.revision == 0)
+    with ctx.bind.begin() as conn:
+        if conn.scalar(select(func.count()).select_from(SyncState.__table__)) == 0:
+            conn.execute(insert(SyncState.__table__).values(id=1, revision=1))
+
+
+DATE_COLUMNS = {
+    _tasks: ("date", "sla_date", "completion_date", "creation_timestamp", "completion_timestamp"),
+    _comments: ("timestamp",),
+}
+
+_SHADOW = "{}__typed"
+
+
+def convert_values(table, columns, row, now: datetime) -> dict:
+    """Typed values for one row's raw strings, falling back where a value doesn't parse"""
+    values = {}
+    for name in columns:
+        column = table.c[name]
+        parse = parse_date if isinstance(column.type, ISODate) else parse_timestamp
+        try:
+            values[name] = parse(row[name])
+        except ValueError:
+            print(f"  Unparseable {table.name}.{name} of {row['id']}: {row[name]!r}")
+            values[name] = None
+        if values[name] is None and not column.nullable:
+            created = None
+            if "creation_timestamp" in row:
+                try:
+                    created = parse_timestamp(row["creation_timestamp"])
+                except ValueError:
+                    pass
+            fallback = created or now
+            values[name] = fallback.date() if isinstance(column.type, ISODate) else fallback
+    return values
+
+
+def _raw_columns(table, columns) -> list:
+    """The stored text of `columns` (and the creation timestamp, for fallbacks), skipping the typed result processing"""
+    names = list(columns)
+    if "creation_timestamp" in table.c and "creation_timestamp" not in names:
+        names.append("creation_timestamp")
+    return [type_coerce(table.c[name], String).label(name) for name in names]
+
+
+def _convert_sqlite(ctx: Context, table, columns, now: datetime) -> None:
+    stored = {name: table.c[name].type.bind_processor(ctx.bind.dialect) for name in columns}
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("_id"))
+        .values({name: bindparam(name) for name in columns})
+    )
+
+    def handle(conn, rows):
+        params = []
+        for row in rows:
+            values = convert_values(table, columns, row, now)
+            if any((stored[name](value) if stored[name] else value) != row[name] for name, value in values.items()):
+                params.append({"_id": row["id"], **values})
+        if params:
+            conn.execute(statement, params)
+
+    ctx.batches(f"{table.name}.dates", table, _raw_columns(table, columns), true(), handle)
+
+
+def _convert_postgresql(ctx: Context, table, columns, now: datetime) -> None:
+    types = {name: table.c[name].type for name in columns}
+    # Ids of the rows written while the migration runs, appended by a trigger
+    log = f"{table.name}__dates_log"
+    id_type = table.c.id.type.compile(dialect=ctx.bind.dialect)
+    with ctx.bind.begin() as conn:
+        for name in columns:
+            ddl = "DATE" if isinstance(types[name], ISODate) else "TIMESTAMP WITH TIME ZONE"
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS {_SHADOW.format(name)} {ddl}")
+        conn.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {log} (seq BIGSERIAL PRIMARY KEY, id {id_type} NOT NULL)")
+        conn.exec_driver_sql(
+            f"CREATE OR REPLACE FUNCTION {log}() RETURNS trigger LANGUAGE plpgsql AS "
+            f"$$ BEGIN INSERT INTO {log} (id) VALUES (NEW.id); RETURN NULL; END $$"
+        )
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {log} ON {table.name}")
+        # Not on the shadow columns, so the backfill itself isn't logged
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER {log} AFTER INSERT OR UPDATE OF {', '.join(columns)} ON {table.name} "
+            f"FOR EACH ROW EXECUTE FUNCTION {log}()"
+        )
+
+    assignments = ", ".join(f"{_SHADOW.format(name)} = :{name}" for name in columns)
+    statement = text(f"UPDATE {table.name} SET {assignments} WHERE id = :_id").bindparams(
+        *(bindparam(name, type_=types[name]) for name in columns)
+    )
+
+    def handle(conn, rows):
+        conn.execute(statement, [{"_id": row["id"], **convert_values(table, columns, row, now)} for row in rows])
+
+    def catch_up(conn, limit: Optional[int] = None) -> int:
+        """Convert the logged rows again and clear their entries; returns how many entries it took"""
+        oldest = f" WHERE seq IN (SELECT seq FROM {log} ORDER BY seq LIMIT {int(limit)})" if limit else ""
+        # An entry committed after this DELETE stays for the next round
+        ids = sorted(set(conn.exec_driver_sql(f"DELETE FROM {log}{oldest} RETURNING id").scalars()))
+        for start in range(0, len(ids), ctx.batch_size):
+            rows = conn.execute(
+                select(table.c.id, *_raw_columns(table, columns))
+                .where(table.c.id.in_(ids[start:start + ctx.batch_size]))
+            ).mappings().all()
+            if rows:
+                handle(conn, rows)
+        return len(ids)
+
+    ctx.batches(f"{table.name}.dates", table, _raw_columns(table, columns), true(), handle)
+
+    # Drain the log while writers keep going, then lock only for the remainder
+    while True:
+        with ctx.bind.begin() as conn:
+            taken = catch_up(conn, ctx.batch_size)
+        print(f"  {table.name}.dates: {taken} rows written meanwhile")
+        if taken < ctx.batch_size:
+            break
+        if ctx.pause:
+            time.sleep(ctx.pause)
+
+    # Writers wait only for the last catch-up and the catalog changes
+    with ctx.bind.begin() as conn:
+        conn.exec_driver_sql(f"LOCK TABLE {table.name} IN EXCLUSIVE MODE")
+        catch_up(conn)
+        conn.exec_driver_sql(f"DROP TRIGGER {log} ON {table.name}")
+        conn.exec_driver_sql(f"DROP FUNCTION {log}()")
+        conn.exec_driver_sql(f"DROP TABLE {log}")
+        for name in columns:
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} DROP COLUMN {name}")
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} RENAME COLUMN {_SHADOW.format(name)} TO {name}")
+            if not table.c[name].nullable:
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} ALTER COLUMN {name} SET NOT NULL")
+
+
+@migration(5)
+def typed_dates(ctx: Context):
+    """Free-form date strings to typed dates and UTC timestamps (see dates.py).
+
+    SQLite rewrites the values in place into the storage format of the new
+    column types, which sorts correctly as text; rows already in that format
+    are left alone.  PostgreSQL backfills typed shadow columns and swaps them
+    in with one short transaction.  A trigger logs the rows written from the
+    start, by this version of the API or any other, and they are converted
+    again before the swap.  Values that don't parse are printed and cleared,
+    or for the required columns replaced with the task's creation date or
+    the time of the migration.
+    """
+    now = datetime.now(timezone.utc)
+    for table, columns in DATE_COLUMNS.items():
+        if ctx.dialect == "postgresql":
+            existing = ctx.columns(table.name)
+            pending = tuple(name for name in columns if isinstance(existing[name]["type"], String))
+            if pending:
+                _convert_postgresql(ctx, table, pending, now)
+        else:
+            _convert_sqlite(ctx, table, columns, now)
+
+
+@migration(6)
+def add_indexes(ctx: Context):
+    """The query indexes declared in models.py.
+
+    PostgreSQL builds them CONCURRENTLY, so writes carry on; SQLite holds
+    the write lock while each one builds.
+    """
+    created = 0
+    for table in Base.metadata.sorted_tables:
+        if not ctx.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspect(ctx.bind).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            columns = ", ".join(column.name for column in index.columns)
+            print(f"Creating index {index.name} on {table.name} ({columns})")
+            if ctx.dialect == "postgresql":
+                index.dialect_kwargs["postgresql_concurrently"] = True
+                try:
+                    with ctx.bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                        index.create(bind=conn)
+                finally:
+                    index.dialect_kwargs["postgresql_concurrently"] = False
+            else:
+                index.create(bind=ctx.bind)
+            created += 1
+
+    if created:
+        # Refresh planner statistics so the new indexes are picked up
+        with ctx.bind.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+
+
+@migration(7)
+def add_lead_time_stats(ctx: Context):
+    """The lead_time_stats table, computed from the tasks completed so far (see leadtime.py)"""
+    ctx.create_table(LeadTimeStat.__table__)
+    with Session(ctx.bind) as session:
+        print(f"  lead_time_stats: {leadtime.rebuild(session, ctx.batch_size)} completed tasks")
+        session.commit()
+
+
+# ======================================================================
+# RUNNER
+# ======================================================================
+
+def is_new(bind: Engine = engine) -> bool:
+    """Whether the database has none of the application's tables yet"""
+    existing = set(inspect(bind).get_table_names())
+    return not any(table.name in existing for table in Base.metadata.sorted_tables if table is not _versions)
+
+
+def create_schema(bind: Engine = engine) -> None:
+    """Build a new database from models.py, recorded as fully migrated"""
+    Base.metadata.create_all(bind=bind)
+    now = _now()
+    with bind.begin() as conn:
+        conn.execute(insert(_versions), [
+            {"version": m.version, "name": m.name, "started_at": now, "applied_at": now} for m in MIGRATIONS
+        ])
+
+
+def _recorded(bind: Engine) -> dict:
+    if not inspect(bind).has_table(_versions.name):
+        return {}
+    with bind.connect() as conn:
+        return {row.version: row for row in conn.execute(select(_versions))}
+
+
+def pending_migrations(bind: Engine = engine) -> List[Migration]:
+    recorded = _recorded(bind)
+    return [m for m in MIGRATIONS if m.version not in recorded or not recorded[m.version].applied_at]
+
+
+def upgrade(bind: Engine = engine, target: Optional[int] = None,
+            batch_size: int = BATCH_SIZE, pause: float = 0) -> List[Migration]:
+    """Apply the pending migrations up to `target` (default: all); returns the ones applied"""
+
+    print(f"Migrating database at {bind.url.render_as_string(hide_password=True)}")
+    if is_new(bind):
+        create_schema(bind)
+        print(f"Created a new database at version {MIGRATIONS[-1].version}")
+        return []
+
+    _versions.create(bind=bind, checkfirst=True)
+    recorded = _recorded(bind)
+    applied = []
+    for m in MIGRATIONS:
+        if target is not None and m.version > target:
+            break
+        row = recorded.get(m.version)
+        if row is not None and row.applied_at:
+            continue
+
+        if row is None:
+            with bind.begin() as conn:
+                conn.execute(insert(_versions).values(version=m.version, name=m.name, started_at=_now()))
+            checkpoint = {}
+            print(f"Applying {m.version:04} {m.name}")
+        else:
+            checkpoint = json.loads(row.checkpoint or "{}")
+            print(f"Resuming {m.version:04} {m.name}")
+
+        started = time.perf_counter()
+        m.apply(Context(bind, m.version, checkpoint, batch_size, pause))
+        with bind.begin() as conn:
+            conn.execute(
+                update(_versions).where(_versions.c.version == m.version)
+                .values(applied_at=_now(), checkpoint=None)
+            )
+        print(f"Applied {m.version:04} {m.name} in {time.perf_counter() - started:.1f}s")
+        applied.append(m)
+
+    if not applied:
+        print("Database is already up to date!")
+    return applied
+
+
+@contextmanager
+def startup_lock(bind: Engine = engine):
+    """Hold a lock shared by every process using the database.
+
+    An advisory lock on PostgreSQL; on SQLite, a lock on a file next to the
+    database (SQLite's own lock can't be held across the DDL of create_all).
+    """
+    if bind.dialect.name == "postgresql":
+        with bind.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+        return
+
+    database = bind.url.database if bind.dialect.name == "sqlite" else None
+    if fcntl is None or not database or database == ":memory:" or database.startswith("file:"):
+        yield
+        return
+    with open(f"{database}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def prepare(bind: Engine = engine) -> None:
+    """Startup check: build a new database, or make sure an existing one is fully migrated"""
+    with startup_lock(bind):
+        if is_new(bind):
+            create_schema(bind)
+        else:
+            pending = pending_migrations(bind)
+            if pending and MIGRATE_ON_STARTUP:
+                upgrade(bind)
+            elif pending:
+                names = ", ".join(f"{m.version:04} {m.name}" for m in pending)
+                raise RuntimeError(f"Database has pending migrations ({names}), run `python migrations.py` first")
+        search.init_search_index(bind)
+
+
+def print_status(bind: Engine = engine) -> None:
+    recorded = _recorded(bind)
+    for m in MIGRATIONS:
+        row = recorded.get(m.version)
+        if row is None:
+            state = "pending"
+        elif row.applied_at:
+            state = f"applied {row.applied_at}"
+        else:
+            state = f"incomplete, started {row.started_at}"
+        print(f"{m.version:04} {m.name:<24} {state}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.add_argument("--status", action="store_true", help="list the migrations and exit")
+    parser.add_argument("--target", type=int, help="stop after this version")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per backfill transaction")
+    parser.add_argument("--pause", type=float, default=0, help="seconds to sleep between batches")
+    args = parser.parse_args()
+
+    if args.status:
+        print_status()
+    else:
+        upgrade(target=args.target, batch_size=args.batch_size, pause=args.pause)
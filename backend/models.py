@@ -1,8 +1,11 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Enum, create_engine, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, Enum, create_engine, Date, DateTime, Index, text
 from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
 import enum
 
+from dates import parse_date, parse_timestamp
+
 Base = declarative_base()
 
 class TaskStatus(enum.Enum):
@@ -16,6 +19,32 @@ class TaskPriority(enum.Enum):
     MEDIUM = "medium"
     HIGH = "high"
 
+class ISODate(TypeDecorator):
+    """Calendar date; also accepts ISO strings, so filters and cursors can bind them"""
+    impl = Date
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return parse_date(value)
+
+class UTCDateTime(TypeDecorator):
+    """Timezone-aware UTC timestamp.
+
+    SQLite has no timezone support, so there it is stored as naive UTC in
+    SQLAlchemy's fixed-width format, which sorts correctly as text.
+    """
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        value = parse_timestamp(value)
+        if value is not None and dialect.name == "sqlite":
+            return value.replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        return parse_timestamp(value)
+
 class Client(Base):
     __tablename__ = "clients"
 
@@ -23,32 +52,107 @@ class Client(Base):
     name = Column(String, nullable=False)
     company = Column(String, nullable=False)
     origin = Column(String, nullable=False)
+    revision = Column(Integer, nullable=False, default=0)  # Revision of the last change (see changes.py)
+    updated_at = Column(String, nullable=True)  # Full timestamp of the last change
     tasks = relationship("Task", back_populates="client", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_clients_revision", "revision"),
+    )
+
 class Task(Base):
     __tablename__ = "tasks"
 
     id = Column(Integer, primary_key=True)
     client_id = Column(String, ForeignKey("clients.id"))
-    date = Column(String, nullable=False)  # Task date (for display/organization)
+    date = Column(ISODate, nullable=False)  # Task date (for display/organization)
     description = Column(String, nullable=False)
     status = Column(String, nullable=False)
     priority = Column(String, nullable=False)
-    sla_date = Column(String, nullable=True)  # Data limite do SLA
-    completion_date = Column(String, nullable=True)  # Data de conclusão real (date only)
-    creation_timestamp = Column(String, nullable=True)  # Full timestamp when task was created
-    completion_timestamp = Column(String, nullable=True)  # Full timestamp when task was completed
+    sla_date = Column(ISODate, nullable=True)  # Data limite do SLA
+    completion_date = Column(ISODate, nullable=True)  # Data de conclusão real (date only)
+    creation_timestamp = Column(UTCDateTime, nullable=True)  # Full timestamp when task was created
+    completion_timestamp = Column(UTCDateTime, nullable=True)  # Full timestamp when task was completed
+    revision = Column(Integer, nullable=False, default=0)  # Revision of the last change (see changes.py)
+    updated_at = Column(String, nullable=True)  # Full timestamp of the last change
     
     client = relationship("Client", back_populates="tasks")
     comments = relationship("Comment", back_populates="task", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_tasks_status_sla_date", "status", "sla_date"),  # status tabs / SLA views sorted by deadline
+        Index("ix_tasks_client_id_status", "client_id", "status"),  # per-client task lists
+        Index("ix_tasks_date", "date"),  # date ranges and timelines
+        Index("ix_tasks_creation_timestamp", "creation_timestamp"),  # sort=creation_timestamp
+        Index("ix_tasks_completion_date", "completion_date"),  # completion reporting
+        Index("ix_tasks_revision", "revision"),  # change feed
+        # SLA buckets only ever look at open tasks that have a deadline
+        Index(
+            "ix_tasks_open_sla_date", "sla_date",
+            sqlite_where=text("status != 'completed' AND sla_date IS NOT NULL"),
+            postgresql_where=text("status != 'completed' AND sla_date IS NOT NULL"),
+        ),
+    )
+
 class Comment(Base):
     __tablename__ = "comments"
     
     id = Column(String, primary_key=True)
     task_id = Column(Integer, ForeignKey("tasks.id"))
     text = Column(String, nullable=False)
-    timestamp = Column(String, nullable=False)
+    timestamp = Column(UTCDateTime, nullable=False)
     author = Column(String, nullable=True, default="User")
+    revision = Column(Integer, nullable=False, default=0)  # Revision of the last change (see changes.py)
+    updated_at = Column(String, nullable=True)  # Full timestamp of the last change
     
-    task = relationship("Task", back_populates="comments") 
\ No newline at end of file
+    task = relationship("Task", back_populates="comments")
+
+    __table_args__ = (
+        Index("idx_comments_task_id", "task_id"),
+        Index("ix_comments_timestamp", "timestamp"),  # newest-first comment listings
+        Index("ix_comments_revision", "revision"),
+    )
+
+class SyncState(Base):
+    """Single row holding the latest revision handed out"""
+    __tablename__ = "sync_state"
+
+    id = Column(Integer, primary_key=True)
+    revision = Column(Integer, nullable=False, default=0)
+
+class Tombstone(Base):
+    """Marker left behind by a deleted client, task or comment"""
+    __tablename__ = "tombstones"
+
+    id = Column(Integer, primary_key=True)
+    table_name = Column(String, nullable=False)
+    row_id = Column(String, nullable=False)
+    revision = Column(Integer, nullable=False)
+    deleted_at = Column(String, nullable=False)
+
+    __table_args__ = (
+        Index("ix_tombstones_revision", "revision"),
+    ) 
+
+
+class LeadTimeStat(Base):
+    """Lead-time sketch and SLA counts of the completed tasks in one group (see leadtime.py)"""
+    __tablename__ = "lead_time_stats"
+
+    dimension = Column(String, primary_key=True)  # all, client, priority or month
+    key = Column(String, primary_key=True)  # client id, priority or YYYY-MM; "" for all
+    completed = Column(Integer, nullable=False, default=0)
+    sla_met = Column(Integer, nullable=False, default=0)
+    sla_missed = Column(Integer, nullable=False, default=0)
+    sketch = Column(String, nullable=False, default="[0]")  # Sketch.dumps()
+
+
+class SchemaMigration(Base):
+    """A migration from migrations.py, applied or still running"""
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    started_at = Column(String, nullable=False)
+    applied_at = Column(String, nullable=True)  # NULL while the migration is incomplete
+    checkpoint = Column(String, nullable=True)  # JSON progress of its backfills, to resume from
@@ -0,0 +1,81 @@
+"""
+Helpers for keyset (cursor) pagination.
+
+Cursors are opaque to clients: a urlsafe-base64 JSON list holding the sort
+key of the last row of a page, tie-broken by the row's id.  Dates travel as
+ISO strings, which the typed date columns accept back as bound values.
+"""
+
+import base64
+import json
+from datetime import date, datetime
+from typing import Any, Optional
+
+from sqlalchemy import and_, or_
+from sqlalchemy.types import TypeDecorator
+
+from dates import parse_date, parse_timestamp, to_json
+
+
+def encode_cursor(*values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, default=to_json).encode()).decode()
+
+
+def decode_cursor(cursor: str, size: int = 2) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def decode_keyset(cursor: str, column, id_column) -> tuple:
+    """(value, last_id) of a cursor, parsed as the types of the two columns.
+
+    A cursor is client input: a value the column can't hold must be a
+    ValueError here, not an error binding it to the query.
+    """
+    value, last_id = decode_cursor(cursor)
+    return _parse_key(value, column), _parse_key(last_id, id_column)
+
+
+def _parse_key(value, column):
+    if value is None:
+        if column.nullable:
+            return None
+        raise ValueError("Invalid cursor")
+    column_type = column.type
+    if isinstance(column_type, TypeDecorator):
+        column_type = column_type.impl_instance
+    python_type = column_type.python_type
+    try:
+        if python_type is date:
+            return parse_date(value)
+        if python_type is datetime:
+            return parse_timestamp(value)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    # bool is an int too, but never a key
+    if python_type is int and isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if python_type is str and isinstance(value, str):
+        return value
+    raise ValueError("Invalid cursor")
+
+
+def after_cursor(column, id_column, value: Optional[Any], last_id: Any, descending: bool = False):
+    """Condition selecting the rows after (value, last_id) in ORDER BY column, id.
+
+    NULLs are treated as the smallest value, which is how SQLite orders them
+    in an index, so they come first ascending and last descending.
+    """
+    if descending:
+        if value is None:
+            return and_(column.is_(None), id_column < last_id)
+        return or_(column < value, and_(column == value, id_column < last_id), column.is_(None))
+
+    if value is None:
+        return or_(and_(column.is_(None), id_column > last_id), column.isnot(None))
+    return or_(column > value, and_(column == value, id_column > last_id))
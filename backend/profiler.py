@@ -0,0 +1,254 @@
+"""
+Opt-in per-request SQL profiler with an N+1 detector.
+
+SQL_PROFILER selects which requests are profiled:
+
+    off      (default) none; the debug endpoints return 404
+    header   requests sending `X-SQL-Profile: 1`
+    all      every request
+
+A profiled request records each statement it runs, with its duration and
+the line of application code that issued it.  Identical statements run
+REPEAT_THRESHOLD or more times are flagged as N+1 suspects (the statement
+text is parameterized, so "the same query for every row" shows up as one
+statement with a high count) and logged.  The response carries a summary
+header:
+
+    X-SQL-Profile: id=3fa2c1; queries=14; time_ms=6.2; suspects=1
+
+and the full profile stays available at `GET /debug/sql-profiles/{id}` for
+the last PROFILES_KEPT requests.  Profiles include SQL text: don't enable
+this on a public deployment.
+
+Tests use `capture()` through the `query_budget` fixture in conftest.py.
+"""
+
+import logging
+import os
+import sys
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    import greenlet
+except ImportError:  # pragma: no cover - SQLAlchemy's asyncio support requires it
+    greenlet = None
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/debug/sql-profiles", tags=["debug"])
+
+MODE = os.getenv("SQL_PROFILER", "off").lower()
+HEADER = "X-SQL-Profile"
+REPEAT_THRESHOLD = int(os.getenv("SQL_PROFILER_REPEAT_THRESHOLD", "5"))
+PROFILES_KEPT = 100
+
+_APP_DIR = str(Path(__file__).resolve().parent)
+_SKIPPED = (__file__, os.sep + "site-packages" + os.sep, os.sep + "tests" + os.sep)
+
+
+def _origin() -> Optional[str]:
+    """The innermost application frame on the stack, as "file.py:line in function".
+
+    Async sessions run statements in a child greenlet whose stack starts at
+    SQLAlchemy; the code that awaited it is on the parent greenlet's stack.
+    """
+    frame = sys._getframe(2)
+    current = greenlet.getcurrent() if greenlet else None
+    while True:
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename.startswith(_APP_DIR) and not any(part in filename for part in _SKIPPED):
+                return f"{os.path.relpath(filename, _APP_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}"
+            frame = frame.f_back
+        current = current.parent if current is not None else None
+        if current is None:
+            return None
+        frame = current.gr_frame
+
+
+class Profile:
+    """The statements one request (or one captured block) ran"""
+
+    def __init__(self, method: str = "", path: str = ""):
+        self.id = uuid.uuid4().hex[:8]
+        self.method = method
+        self.path = path
+        self.statements: List[dict] = []
+
+    def record(self, statement: str, seconds: float, origin: Optional[str]) -> None:
+        self.statements.append({"statement": statement, "duration_ms": round(seconds * 1000, 3), "origin": origin})
+
+    @property
+    def time_ms(self) -> float:
+        return round(sum(item["duration_ms"] for item in self.statements), 3)
+
+    def suspects(self, threshold: Optional[int] = None) -> List[dict]:
+        """Statements repeated `threshold` or more times, most repeated first"""
+        threshold = threshold or REPEAT_THRESHOLD
+        counts = Counter(item["statement"] for item in self.statements)
+        suspects = []
+        for statement, count in counts.most_common():
+            if count < threshold:
+                break
+            runs = [item for item in self.statements if item["statement"] == statement]
+            suspects.append({
+                "statement": statement,
+                "count": count,
+                "time_ms": round(sum(item["duration_ms"] for item in runs), 3),
+                "origins": sorted({item["origin"] for item in runs if item["origin"]}),
+            })
+        return suspects
+
+    def summary_header(self) -> str:
+        return f"id={self.id}; queries={len(self.statements)}; time_ms={self.time_ms:.1f}; " \
+               f"suspects={len(self.suspects())}"
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "queries": len(self.statements),
+            "time_ms": self.time_ms,
+            "suspects": self.suspects(),
+            "statements": self.statements,
+        }
+
+    def report(self) -> str:
+        """Readable listing, for assertion messages"""
+        lines = [f"{len(self.statements)} statements, {self.time_ms:.1f} ms"]
+        for suspect in self.suspects():
+            lines.append(f"  N+1 suspect, {suspect['count']}x from {', '.join(suspect['origins'])}: "
+                         f"{suspect['statement']}")
+        for number, item in enumerate(self.statements, 1):
+            lines.append(f"  {number:>3}. [{item['origin']}] {' '.join(item['statement'].split())[:200]}")
+        return "\n".join(lines)
+
+
+_current: ContextVar[Optional[Profile]] = ContextVar("sql_profile", default=None)
+_captures: List[Profile] = []
+_recent: "OrderedDict[str, Profile]" = OrderedDict()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None or _captures:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    if profile is None and not _captures:
+        return
+    started = conn.info.get("profile_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    origin = _origin()
+    for target in ([profile] if profile is not None else []) + _captures:
+        target.record(statement, elapsed, origin)
+
+
+def _handle_error(context):
+    started = context.connection.info.get("profile_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def instrument_engine(engine: Engine) -> Engine:
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    return engine
+
+
+def _wants_profile(scope) -> bool:
+    if MODE == "all":
+        return True
+    if MODE != "header":
+        return False
+    name = HEADER.lower().encode()
+    return any(key == name and value.strip() in (b"1", b"true") for key, value in scope.get("headers", ()))
+
+
+class ProfilerMiddleware:
+    """Profile the requests SQL_PROFILER selects and add the summary header"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _wants_profile(scope):
+            return await self.app(scope, receive, send)
+
+        profile = Profile(scope["method"], scope["path"])
+        token = _current.set(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", ()))
+                headers.append((HEADER.lower().encode(), profile.summary_header().encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            _recent[profile.id] = profile
+            while len(_recent) > PROFILES_KEPT:
+                _recent.popitem(last=False)
+            for suspect in profile.suspects():
+                logger.warning(
+                    "Possible N+1 on %s %s: %dx from %s: %s", profile.method, profile.path,
+                    suspect["count"], ", ".join(suspect["origins"]) or "?", suspect["statement"],
+                )
+
+
+@contextmanager
+def capture():
+    """Collect every statement run on the instrumented engines inside the block, from any thread"""
+    profile = Profile()
+    _captures.append(profile)
+    try:
+        yield profile
+    finally:
+        _captures.remove(profile)
+
+
+# ======================================================================
+# ENDPOINTS
+# ======================================================================
+
+def _require_enabled():
+    if MODE not in ("header", "all"):
+        raise HTTPException(status_code=404, detail="SQL profiler is off")
+
+
+@router.get("")
+def list_profiles():
+    """Summaries of the most recent profiled requests, newest first"""
+    _require_enabled()
+    return [
+        {key: value for key, value in profile.as_dict().items() if key != "statements"}
+        for profile in reversed(_recent.values())
+    ]
+
+
+@router.get("/{profile_id}")
+def get_profile(profile_id: str):
+    """Every statement of one profiled request"""
+    _require_enabled()
+    profile = _recent.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile.as_dict()
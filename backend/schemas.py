@@ -1,5 +1,12 @@
-from pydantic import BaseModel, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field
+from typing import Annotated, Any, List, Literal, Optional, Union
+from datetime import date, datetime
+
+from dates import parse_date, parse_timestamp
+
+# YYYY-MM-DD (a time part is dropped) and ISO 8601 timestamps, normalized to UTC
+TaskDate = Annotated[date, BeforeValidator(parse_date)]
+Timestamp = Annotated[datetime, BeforeValidator(parse_timestamp)]
 
 class CommentBase(BaseModel):
     text: str
@@ -11,19 +18,19 @@ class CommentCreate(CommentBase):
 class Comment(CommentBase):
     id: str
     task_id: int
-    timestamp: str
+    timestamp: Timestamp
     
     model_config = ConfigDict(from_attributes=True)
 
 class TaskBase(BaseModel):
-    date: str
+    date: TaskDate
     description: str
     status: str
     priority: str
-    sla_date: Optional[str] = None
-    completion_date: Optional[str] = None
-    creation_timestamp: Optional[str] = None
-    completion_timestamp: Optional[str] = None
+    sla_date: Optional[TaskDate] = None
+    completion_date: Optional[TaskDate] = None
+    creation_timestamp: Optional[Timestamp] = None
+    completion_timestamp: Optional[Timestamp] = None
 
 class TaskCreate(TaskBase):
     client_id: str
@@ -36,15 +43,46 @@ class Task(TaskBase):
     model_config = ConfigDict(from_attributes=True)
 
 class TaskUpdate(BaseModel):
-    date: Optional[str] = None
+    date: Optional[TaskDate] = None
     description: Optional[str] = None
     status: Optional[str] = None
     priority: Optional[str] = None
     client_id: Optional[str] = None
-    sla_date: Optional[str] = None
-    completion_date: Optional[str] = None
-    creation_timestamp: Optional[str] = None
-    completion_timestamp: Optional[str] = None
+    sla_date: Optional[TaskDate] = None
+    completion_date: Optional[TaskDate] = None
+    creation_timestamp: Optional[Timestamp] = None
+    completion_timestamp: Optional[Timestamp] = None
+
+class TaskBatchCreate(BaseModel):
+    op: Literal["create"]
+    task: TaskCreate
+
+class TaskBatchUpdate(BaseModel):
+    op: Literal["update"]
+    id: int
+    changes: TaskUpdate
+
+class TaskBatchDelete(BaseModel):
+    op: Literal["delete"]
+    id: int
+
+TaskBatchOperation = Annotated[
+    Union[TaskBatchCreate, TaskBatchUpdate, TaskBatchDelete], Field(discriminator="op")
+]
+
+class TaskBatchRequest(BaseModel):
+    operations: List[TaskBatchOperation] = Field(..., max_length=5000)
+
+class TaskBatchResult(BaseModel):
+    index: int
+    op: str
+    ok: bool
+    id: Optional[int] = None
+    task: Optional[Task] = None
+    error: Optional[str] = None
+
+class TaskBatchResponse(BaseModel):
+    results: List[TaskBatchResult]
 
 class ClientBase(BaseModel):
     name: str
@@ -72,4 +110,145 @@ class ClientUpdate(BaseModel):
 class ClientOnly(ClientBase):
     id: str
     
-    model_config = ConfigDict(from_attributes=True) 
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True) 
+
+# ======================================================================
+# ANALYTICS
+# ======================================================================
+
+class CountSeries(BaseModel):
+    labels: List[str]
+    data: List[int]
+
+class ClientCompletion(BaseModel):
+    client_id: str
+    client_name: str
+    total_tasks: int
+    completed_tasks: int
+    completion_rate: float
+
+class TaskTrends(BaseModel):
+    labels: List[str]
+    completed: List[int]
+    created: List[int]
+
+class AnalyticsSummary(BaseModel):
+    total_tasks: int
+    completed_tasks: int
+    tasks_by_status: CountSeries
+    tasks_by_priority: CountSeries
+    completion_rate_by_client: List[ClientCompletion]
+    task_trends: TaskTrends
+
+class LeadTimeGroup(BaseModel):
+    key: str
+    completed_tasks: int
+    median_seconds: Optional[float] = None
+    p90_seconds: Optional[float] = None
+    p99_seconds: Optional[float] = None
+    sla_met: int
+    sla_missed: int
+    sla_hit_rate: Optional[float] = None  # Percent of the tasks with an SLA date that met it
+
+class LeadTimeStats(BaseModel):
+    by: str
+    groups: List[LeadTimeGroup]
+
+# ======================================================================
+# SLA
+# ======================================================================
+
+class SLASummary(BaseModel):
+    today: date
+    overdue: int
+    due_today: int
+    due_this_week: int
+    on_track: int
+    no_sla: int
+
+# ======================================================================
+# IMPORT
+# ======================================================================
+
+class ImportJob(BaseModel):
+    id: str
+    status: Literal["pending", "running", "completed", "failed", "cancelled"] = "pending"
+    mode: Literal["skip", "upsert", "replace"] = "skip"
+    chunk_size: int
+    total_bytes: Optional[int] = None
+    bytes_read: int = 0
+    records_read: int = 0
+    records_failed: int = 0
+    clients_inserted: int = 0
+    clients_updated: int = 0
+    clients_skipped: int = 0
+    tasks_inserted: int = 0
+    tasks_updated: int = 0
+    tasks_skipped: int = 0
+    comments_imported: int = 0
+    errors: List[str] = []
+    error: Optional[str] = None
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+
+# ======================================================================
+# JOBS
+# ======================================================================
+
+class JobCreate(BaseModel):
+    type: str
+    params: dict = {}
+
+class Job(BaseModel):
+    id: str
+    type: str
+    status: Literal["queued", "running", "completed", "failed", "cancelled"] = "queued"
+    params: dict = {}
+    progress: dict = {}
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    created_at: Optional[str] = None
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+
+# ======================================================================
+# CHANGES
+# ======================================================================
+
+class ClientChange(ClientBase):
+    id: str
+    revision: int
+    updated_at: Optional[str] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class TaskChange(TaskBase):
+    id: int
+    client_id: Optional[str] = None
+    revision: int
+    updated_at: Optional[str] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class CommentChange(CommentBase):
+    id: str
+    task_id: int
+    timestamp: Timestamp
+    revision: int
+    updated_at: Optional[str] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class Deletion(BaseModel):
+    table: Literal["clients", "tasks", "comments"]
+    id: str
+    revision: int
+
+class Changes(BaseModel):
+    revision: int
+    has_more: bool
+    clients: List[ClientChange]
+    tasks: List[TaskChange]
+    comments: List[CommentChange]
+    deleted: List[Deletion]
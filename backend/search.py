@@ -0,0 +1,291 @@
+"""
+Full-text search over comments.
+
+On SQLite the comments are mirrored into an FTS5 table together with the
+description of their task and the name/company of the task's client.  Triggers
+keep the mirror in sync with every write to comments, tasks and clients, so
+the API code never has to touch it.  Searches use BM25 ranking, prefix
+matching and keyset pagination on (rank, rowid), which keeps latency tied to
+the number of matches instead of the size of the comments table.
+
+Databases without FTS5 fall back to a paginated ILIKE scan.
+"""
+
+import logging
+import math
+import re
+from typing import Optional
+
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from dates import parse_timestamp
+from models import Client, Comment, Task
+from pagination import decode_cursor, decode_keyset, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+# Relative BM25 weights for text, author, task_description, client_name, client_company
+RANK_WEIGHTS = (10.0, 5.0, 2.0, 1.0, 1.0)
+
+MIN_QUERY_LENGTH = 2
+
+_fts_enabled = False
+
+_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS comments_fts USING fts5(
+        text, author, task_description, client_name, client_company,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS comments_fts_insert AFTER INSERT ON comments BEGIN
+        INSERT INTO comments_fts (rowid, text, author, task_description, client_name, client_company)
+        SELECT new.rowid, new.text, new.author, t.description, c.name, c.company
+        FROM tasks t LEFT JOIN clients c ON c.id = t.client_id
+        WHERE t.id = new.task_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS comments_fts_delete AFTER DELETE ON comments BEGIN
+        DELETE FROM comments_fts WHERE rowid = old.rowid;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS comments_fts_update AFTER UPDATE OF text, author, task_id ON comments BEGIN
+        DELETE FROM comments_fts WHERE rowid = old.rowid;
+        INSERT INTO comments_fts (rowid, text, author, task_description, client_name, client_company)
+        SELECT new.rowid, new.text, new.author, t.description, c.name, c.company
+        FROM tasks t LEFT JOIN clients c ON c.id = t.client_id
+        WHERE t.id = new.task_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF description, client_id ON tasks BEGIN
+        UPDATE comments_fts
+        SET task_description = new.description,
+            client_name = (SELECT name FROM clients WHERE id = new.client_id),
+            client_company = (SELECT company FROM clients WHERE id = new.client_id)
+        WHERE rowid IN (SELECT rowid FROM comments WHERE task_id = new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+        DELETE FROM comments_fts WHERE rowid IN (SELECT rowid FROM comments WHERE task_id = old.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS clients_fts_update AFTER UPDATE OF name, company ON clients BEGIN
+        UPDATE comments_fts
+        SET client_name = new.name, client_company = new.company
+        WHERE rowid IN (
+            SELECT cm.rowid FROM comments cm JOIN tasks t ON t.id = cm.task_id
+            WHERE t.client_id = new.id
+        );
+    END
+    """,
+]
+
+
+def init_search_index(engine: Engine) -> bool:
+    """Create the FTS5 table and its triggers, filling it if it is out of date.
+
+    Returns False (and leaves search on the ILIKE fallback) when the database
+    is not SQLite or was built without FTS5.
+    """
+    global _fts_enabled
+
+    if engine.dialect.name != "sqlite":
+        _fts_enabled = False
+        return False
+
+    try:
+        with engine.begin() as conn:
+            for statement in _DDL:
+                conn.exec_driver_sql(statement)
+            conn.execute(
+                text("INSERT INTO comments_fts (comments_fts, rank) VALUES ('rank', :rank)"),
+                {"rank": "bm25(%s)" % ", ".join(str(weight) for weight in RANK_WEIGHTS)},
+            )
+
+            indexed = conn.exec_driver_sql("SELECT count(*) FROM comments_fts").scalar()
+            stored = conn.exec_driver_sql("SELECT count(*) FROM comments").scalar()
+            if indexed != stored:
+                logger.info("Rebuilding comment search index (%s indexed, %s stored)", indexed, stored)
+                _rebuild(conn)
+    except OperationalError as e:
+        logger.warning("FTS5 unavailable, comment search falls back to LIKE: %s", e)
+        _fts_enabled = False
+        return False
+
+    _fts_enabled = True
+    return True
+
+
+def rebuild_search_index(engine: Engine) -> None:
+    """Repopulate the index from scratch.
+
+    Rows are linked through the implicit rowid of `comments`, which VACUUM may
+    renumber, so run this after vacuuming the database.
+    """
+    with engine.begin() as conn:
+        _rebuild(conn)
+
+
+def _rebuild(conn) -> None:
+    conn.exec_driver_sql("DELETE FROM comments_fts")
+    conn.exec_driver_sql(
+        """
+        INSERT INTO comments_fts (rowid, text, author, task_description, client_name, client_company)
+        SELECT cm.rowid, cm.text, cm.author, t.description, c.name, c.company
+        FROM comments cm
+        JOIN tasks t ON t.id = cm.task_id
+        LEFT JOIN clients c ON c.id = t.client_id
+        """
+    )
+
+
+def build_match_query(q: str) -> Optional[str]:
+    """Turn user input into an FTS5 query where every word is a quoted prefix term."""
+    terms = re.findall(r"\w+", q)
+    if not terms:
+        return None
+    return " ".join('"%s"*' % term.replace('"', '""') for term in terms)
+
+
+async def search_comments(db: AsyncSession, q: str, limit: int = 50, cursor: Optional[str] = None) -> dict:
+    q = q.strip()
+    if len(q) < MIN_QUERY_LENGTH:
+        return {"results": [], "total": 0, "query": q, "next_cursor": None}
+
+    if _fts_enabled:
+        return await _search_fts(db, q, limit, cursor)
+    return await _search_like(db, q, limit, cursor)
+
+
+async def _search_fts(db: AsyncSession, q: str, limit: int, cursor: Optional[str]) -> dict:
+    match = build_match_query(q)
+    if match is None:
+        return {"results": [], "total": 0, "query": q, "next_cursor": None}
+
+    params = {"match": match, "limit": limit + 1}
+    after = ""
+    if cursor:
+        params["rank"], params["rowid"] = _decode_fts_cursor(cursor)
+        after = "AND (f.rank > :rank OR (f.rank = :rank AND f.rowid > :rowid))"
+
+    rows = (await db.execute(
+        text(
+            f"""
+            SELECT cm.id, cm.text, cm.author, cm.timestamp, cm.task_id,
+                   t.description, c.id, c.name, c.company,
+                   snippet(comments_fts, 0, '<mark>', '</mark>', '…', 16),
+                   f.rank, f.rowid
+            FROM comments_fts f
+            JOIN comments cm ON cm.rowid = f.rowid
+            JOIN tasks t ON t.id = cm.task_id
+            JOIN clients c ON c.id = t.client_id
+            WHERE comments_fts MATCH :match {after}
+            ORDER BY f.rank, f.rowid
+            LIMIT :limit
+            """
+        ),
+        params,
+    )).all()
+    total = await db.scalar(
+        text("SELECT count(*) FROM comments_fts WHERE comments_fts MATCH :match"), {"match": match}
+    )
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][10], rows[-1][11])
+
+    results = [
+        {
+            "id": row[0],
+            "text": row[1],
+            "author": row[2],
+            "timestamp": parse_timestamp(row[3]),  # raw SQL skips the column type
+            "task_id": row[4],
+            "task_description": row[5],
+            "client_id": row[6],
+            "client_name": row[7],
+            "client_company": row[8],
+            "snippet": row[9],
+            "rank": row[10],
+        }
+        for row in rows
+    ]
+    return {"results": results, "total": total, "query": q, "next_cursor": next_cursor}
+
+
+def _decode_fts_cursor(cursor: str) -> tuple:
+    """(rank, rowid) of an FTS cursor: a finite number and an integer"""
+    rank, rowid = decode_cursor(cursor)
+    # bool is an int too, but never a key
+    if (not isinstance(rank, (int, float)) or isinstance(rank, bool) or not math.isfinite(rank)
+            or not isinstance(rowid, int) or isinstance(rowid, bool)):
+        raise ValueError("Invalid cursor")
+    return rank, rowid
+
+
+async def _search_like(db: AsyncSession, q: str, limit: int, cursor: Optional[str]) -> dict:
+    search_term = f"%{q}%"
+    matches = (
+        (Comment.text.ilike(search_term))
+        | (Comment.author.ilike(search_term))
+        | (Task.description.ilike(search_term))
+        | (Client.name.ilike(search_term))
+        | (Client.company.ilike(search_term))
+    )
+    query = (
+        select(Comment, Task, Client)
+        .join(Task, Comment.task_id == Task.id)
+        .join(Client, Task.client_id == Client.id)
+        .where(matches)
+    )
+    total = await db.scalar(select(func.count()).select_from(query.subquery()))
+
+    if cursor:
+        timestamp, comment_id = decode_keyset(cursor, Comment.timestamp, Comment.id)
+        query = query.where(
+            (Comment.timestamp < timestamp)
+            | ((Comment.timestamp == timestamp) & (Comment.id > comment_id))
+        )
+    rows = (await db.execute(query.order_by(Comment.timestamp.desc(), Comment.id).limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1][0]
+        next_cursor = encode_cursor(last.timestamp, last.id)
+
+    results = [
+        {
+            "id": comment.id,
+            "text": comment.text,
+            "author": comment.author,
+            "timestamp": comment.timestamp,
+            "task_id": comment.task_id,
+            "task_description": task.description,
+            "client_id": client.id,
+            "client_name": client.name,
+            "client_company": client.company,
+            "snippet": None,
+            "rank": None,
+        }
+        for comment, task, client in rows
+    ]
+    return {"results": results, "total": total, "query": q, "next_cursor": next_cursor}
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    rebuild_search_index(engine)
+    print("Comment search index rebuilt")
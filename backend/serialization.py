@@ -0,0 +1,207 @@
+"""
+Fast serialization for large client listings.
+
+Returning ORM objects through `response_model=List[schemas.Client]` makes
+pydantic rebuild and re-validate every nested task and comment before encoding
+it, which dominates the cost of the listing endpoints.  This path skips both:
+it selects only the columns the schema exposes, turns each row into a dict
+with the keys in schema field order, nests tasks and comments the way
+selectinload would (same IN batches, same row order) and encodes the result
+with orjson.
+
+The bytes are identical to `schemas.Client` serialized by pydantic
+(`dumps_validated`); the tests compare both paths, and
+benchmarks/serialization.py times them.
+
+Listings also take a sparse fieldset (`fields=` / `include=`, see
+`parse_fieldset`).  It decides which columns are selected and which child
+tables are queried at all, so a list view that doesn't show comments never
+reads them.
+"""
+
+from typing import List, NamedTuple, Optional, Tuple
+
+import orjson
+from fastapi import HTTPException, Query
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Client, Comment, Task
+import schemas
+
+# selectinload's batch size, so children come back in the same order
+IN_BATCH_SIZE = 500
+
+CLIENT_FIELDS = tuple(name for name in schemas.Client.model_fields if name != "tasks")
+TASK_FIELDS = tuple(name for name in schemas.Task.model_fields if name != "comments")
+COMMENT_FIELDS = tuple(schemas.Comment.model_fields)
+
+_clients_adapter = TypeAdapter(List[schemas.Client])
+
+_tables = {"clients": Client.__table__, "tasks": Task.__table__, "comments": Comment.__table__}
+_fields = {"clients": CLIENT_FIELDS, "tasks": TASK_FIELDS, "comments": COMMENT_FIELDS}
+# Each resource nests the next one, under its name, joined on this column
+_children = {"clients": "tasks", "tasks": "comments"}
+_parent_keys = {"tasks": "client_id", "comments": "task_id"}
+
+
+class Level(NamedTuple):
+    """One resource of a fieldset: the fields it outputs and the columns read to build them"""
+    resource: str
+    fields: Tuple[str, ...]
+    # `fields` first, then keys needed for nesting or paging, dropped from the output
+    columns: Tuple[str, ...]
+
+    def with_columns(self, *names: str) -> "Level":
+        return self._replace(columns=self.columns + tuple(name for name in names if name not in self.columns))
+
+    def select(self):
+        table = _tables[self.resource]
+        return select(*(table.c[name] for name in self.columns))
+
+
+# The root resource first, then each included child
+Fieldset = Tuple[Level, ...]
+
+
+def _split(value: Optional[str]) -> List[str]:
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+def parse_fieldset(root: str, fields: Optional[str] = None, include: Optional[str] = None) -> Fieldset:
+    """The resources and fields a listing returns.
+
+    `include` lists the nested resources to embed, by path from the root
+    (`tasks`, `tasks.comments`); an empty value embeds none.  `fields` lists
+    the fields to return, prefixed with the path for nested ones
+    (`name,tasks.status,tasks.comments.text`); a resource with no fields
+    listed keeps all of them, and `id` is always returned.  Without
+    `include`, the resources `fields` mentions are embedded, or all of them
+    when neither is given.  Raises ValueError on unknown names.
+    """
+    paths = {"": root}
+    path, resource = "", root
+    while resource in _children:
+        resource = _children[resource]
+        path = f"{path}.{resource}" if path else resource
+        paths[path] = resource
+
+    requested = {}
+    mentioned = set()
+    for name in _split(fields):
+        if name in paths:
+            mentioned.add(name)
+            continue
+        path, _, field = name.rpartition(".")
+        if path not in paths or field not in _fields[paths[path]]:
+            raise ValueError(f"Unknown field '{name}'")
+        requested.setdefault(path, set()).add(field)
+        mentioned.add(path)
+    mentioned.discard("")
+
+    def with_parents(names):
+        return {p for name in names for p in paths if p and (name == p or name.startswith(p + "."))}
+
+    if include is not None:
+        included = set(_split(include))
+        unknown = sorted(path for path in included if path not in paths)
+        if unknown:
+            raise ValueError(f"Cannot include '{unknown[0]}'")
+        included = with_parents(included)
+        missing = sorted(mentioned - included)
+        if missing:
+            raise ValueError(f"Fields of '{missing[0]}' were requested but it is not included")
+    elif fields is not None:
+        included = with_parents(mentioned)
+    else:
+        included = set(paths)
+
+    levels = []
+    for path, resource in paths.items():
+        if path and path not in included:
+            break
+        names = _fields[resource]
+        if path in requested:
+            names = tuple(name for name in names if name == "id" or name in requested[path])
+        level = Level(resource, names, names)
+        if resource in _parent_keys:
+            level = level.with_columns(_parent_keys[resource])
+        levels.append(level)
+    return tuple(levels)
+
+
+def fieldset_parameter(root: str):
+    """FastAPI dependency reading `fields` and `include` for a listing of `root`"""
+    nested = "tasks, tasks.comments" if root == "clients" else "comments"
+
+    def dependency(
+        fields: Optional[str] = Query(None, description=f"Comma-separated fields; prefix nested ones with their path ({nested})"),
+        include: Optional[str] = Query(None, description=f"Comma-separated nested resources to embed ({nested}); empty for none"),
+    ) -> Fieldset:
+        try:
+            return parse_fieldset(root, fields, include)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return dependency
+
+
+FULL_CLIENTS = parse_fieldset("clients")
+FULL_TASKS = parse_fieldset("tasks")
+
+
+def select_client_rows(fieldset: Fieldset = FULL_CLIENTS):
+    """Client rows with the columns of the fieldset, to filter and order like select(Client)"""
+    return fieldset[0].select()
+
+
+def _batches(ids: list):
+    for start in range(0, len(ids), IN_BATCH_SIZE):
+        yield ids[start:start + IN_BATCH_SIZE]
+
+
+def _document(row, level: Level, nested: Optional[str], children: dict) -> dict:
+    document = dict(zip(level.columns, row))
+    if nested:
+        document[nested] = children[document["id"]] = []
+    for name in level.columns[len(level.fields):]:
+        del document[name]
+    return document
+
+
+async def build_documents(db: AsyncSession, rows, fieldset: Fieldset) -> List[dict]:
+    """Turn rows of `fieldset[0].select()` into dicts, loading the included children in IN batches"""
+    conn = await db.connection()
+    nested = [level.resource for level in fieldset[1:]] + [None]
+
+    parents = {}
+    documents = [_document(row, fieldset[0], nested[0], parents) for row in rows]
+
+    for level, grandchild in zip(fieldset[1:], nested[1:]):
+        children = {}
+        key = level.columns.index(_parent_keys[level.resource])
+        query = level.select()
+        parent_key = query.selected_columns[key]
+        for batch in _batches(list(parents)):
+            for row in await conn.execute(query.where(parent_key.in_(batch))):
+                parents[row[key]].append(_document(row, level, grandchild, children))
+        parents = children
+
+    return documents
+
+
+async def load_client_documents(db: AsyncSession, query, fieldset: Fieldset = FULL_CLIENTS) -> List[dict]:
+    """Run a select_client_rows() query; return the clients as dicts with the fieldset's children nested"""
+    conn = await db.connection()
+    return await build_documents(db, await conn.execute(query), fieldset)
+
+
+def dumps(documents) -> bytes:
+    # UTC timestamps end in "Z", as pydantic writes them
+    return orjson.dumps(documents, option=orjson.OPT_UTC_Z)
+
+
+def dumps_validated(clients) -> bytes:
+    """The reference path: ORM clients validated and encoded by pydantic"""
+    return _clients_adapter.dump_json(_clients_adapter.validate_python(clients, from_attributes=True))
@@ -0,0 +1,258 @@
+"""
+Production launcher: N worker processes sharing one listening socket.
+
+    python serve.py --workers 4 --port 8000
+
+The parent process checks the database (creating or verifying it under
+migrations.startup_lock), imports the application once and forks the
+workers, so they start fast and share the preloaded code.  It then only
+supervises: a worker that dies is replaced, and SIGTERM or SIGINT drains
+them, with each worker finishing its in-flight requests for up to --grace
+seconds before it is killed.
+
+With SQLite and more than one worker, one extra process is the writer (see
+writer.py): it listens on a Unix socket, and the workers on the public port
+forward every write to it, so there is only ever one process writing to the
+database.  On shutdown the readers are drained first, so writes they are
+still forwarding can complete.  PostgreSQL handles concurrent writers
+itself, so there every worker serves everything, checking before each
+request whether another worker committed; background jobs must then be in a
+shared backend (JOBS_BACKEND=redis) so any worker can report on any job.
+
+Metrics from all workers are combined on /metrics (PROMETHEUS_MULTIPROC_DIR
+is set to a fresh directory).  POSIX only; use run.py for development.
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from typing import Optional
+
+logger = logging.getLogger("serve")
+
+DEFAULT_WORKERS = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+DEFAULT_GRACE = float(os.getenv("SHUTDOWN_GRACE_SECONDS", "30"))
+# A worker dying faster than this after starting isn't restarted in a loop
+MIN_UPTIME_SECONDS = 1.0
+POLL_SECONDS = 0.2
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the API with several worker processes")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="reader processes on the public port (default: WEB_CONCURRENCY or the CPU count)")
+    parser.add_argument("--grace", type=float, default=DEFAULT_GRACE,
+                        help="seconds a worker gets to finish in-flight requests on shutdown")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+
+def _bind_tcp(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _bind_unix(path: str) -> socket.socket:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Worker:
+    def __init__(self, role: str, sock: socket.socket):
+        self.role = role
+        self.sock = sock
+        self.pid: Optional[int] = None
+        self.started = 0.0
+
+
+class Supervisor:
+    """Forks the workers, replaces the ones that die and drains them on shutdown"""
+
+    def __init__(self, args: argparse.Namespace, app, public: socket.socket,
+                 writer_socket: Optional[socket.socket], writer_path: Optional[str]):
+        import writer
+
+        self.args = args
+        self.app = app
+        self.writer_path = writer_path
+        if writer_socket is not None:
+            role = writer.READER
+        else:
+            role = writer.PEER if args.workers > 1 else writer.SINGLE
+        self.workers = [Worker(role, public) for _ in range(args.workers)]
+        if writer_socket is not None:
+            self.workers.append(Worker(writer.WRITER, writer_socket))
+        self.stopping = False
+
+    def spawn(self, worker: Worker) -> None:
+        pid = os.fork()
+        if pid:
+            worker.pid, worker.started = pid, time.monotonic()
+            logger.info("Started %s worker %d", worker.role, pid)
+            return
+        try:
+            self._run_worker(worker)
+            code = 0
+        except BaseException:
+            logger.exception("Worker %s failed", worker.role)
+            code = 1
+        os._exit(code)
+
+    def _run_worker(self, worker: Worker) -> None:
+        import uvicorn
+
+        import writer
+        from database import async_engine, engine
+
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        # Connections opened by the parent must not be shared with it
+        engine.dispose(close=False)
+        async_engine.sync_engine.dispose(close=False)
+        writer.configure(worker.role, self.writer_path)
+
+        config = uvicorn.Config(
+            self.app, lifespan="on", log_level=self.args.log_level,
+            timeout_graceful_shutdown=self.args.grace, proxy_headers=True,
+        )
+        uvicorn.Server(config).run(sockets=[worker.sock])
+
+    def _on_exit(self, pid: int, status: int) -> None:
+        from prometheus_client import multiprocess
+
+        if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            multiprocess.mark_process_dead(pid)
+        for worker in self.workers:
+            if worker.pid != pid:
+                continue
+            worker.pid = None
+            if self.stopping:
+                return
+            logger.warning("%s worker %d exited with status %d, restarting", worker.role, pid, status)
+            if time.monotonic() - worker.started < MIN_UPTIME_SECONDS:
+                time.sleep(MIN_UPTIME_SECONDS)
+            self.spawn(worker)
+
+    def _reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self._on_exit(pid, os.waitstatus_to_exitcode(status))
+
+    def _stop(self, role_filter, deadline: float) -> None:
+        workers = [worker for worker in self.workers if worker.pid and role_filter(worker.role)]
+        for worker in workers:
+            try:
+                os.kill(worker.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        while any(worker.pid for worker in workers) and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(POLL_SECONDS)
+        for worker in workers:
+            if worker.pid:
+                logger.warning("%s worker %d didn't stop in time, killing it", worker.role, worker.pid)
+                try:
+                    os.kill(worker.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        while any(worker.pid for worker in workers):
+            self._reap()
+            time.sleep(POLL_SECONDS)
+
+    def run(self) -> None:
+        import writer
+
+        def request_stop(signum, frame):
+            self.stopping = True
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        # The writer first, so the readers' first forwarded writes find it listening
+        for worker in sorted(self.workers, key=lambda w: w.role != writer.WRITER):
+            self.spawn(worker)
+        while not self.stopping:
+            self._reap()
+            time.sleep(POLL_SECONDS)
+
+        logger.info("Shutting down, draining workers for up to %.0fs", self.args.grace)
+        # The deadline leaves uvicorn's own graceful timeout room to run out first
+        self._stop(lambda role: role != writer.WRITER, time.monotonic() + self.args.grace + 5)
+        self._stop(lambda role: role == writer.WRITER, time.monotonic() + self.args.grace + 5)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    if not hasattr(os, "fork"):
+        logger.error("serve.py needs os.fork; use run.py or uvicorn directly on this platform")
+        return 1
+
+    # Must be set before prometheus_client is imported
+    metrics_dir = None
+    if args.workers > 1 and not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        metrics_dir = tempfile.mkdtemp(prefix="tasker-metrics-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+
+    import jobs
+    import migrations
+    from database import async_engine, engine
+
+    if engine.dialect.name != "sqlite" and args.workers > 1 and jobs.BACKEND == "local":
+        # No writer process to send them to: a job would only be visible to the worker running it
+        logger.error("%d workers need a shared jobs backend: set JOBS_BACKEND=redis, or use --workers 1",
+                     args.workers)
+        return 1
+
+    migrations.prepare(engine)
+    from main import app  # preload: workers inherit the imported application
+
+    engine.dispose()
+    async_engine.sync_engine.dispose()
+
+    socket_dir = None
+    writer_socket = writer_path = None
+    public = _bind_tcp(args.host, args.port)
+    if engine.dialect.name == "sqlite" and args.workers > 1:
+        socket_dir = tempfile.mkdtemp(prefix="tasker-writer-")
+        writer_path = os.path.join(socket_dir, "writer.sock")
+        writer_socket = _bind_unix(writer_path)
+    logger.info("Listening on %s:%d with %d worker(s)%s", args.host, args.port, args.workers,
+                " and a writer" if writer_socket else "")
+
+    try:
+        Supervisor(args, app, public, writer_socket, writer_path).run()
+    finally:
+        for directory in (socket_dir, metrics_dir):
+            if directory:
+                shutil.rmtree(directory, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""
+SLA endpoints.
+
+Open tasks are bucketed by how their sla_date compares to "today", using the
+same rules as getSLAStatus in the frontend:
+
+    overdue        sla_date before today
+    due_today      sla_date today
+    due_this_week  sla_date in the next 7 days
+    on_track       sla_date later than that
+
+Every bucket is a range on sla_date, so queries walk the partial index of open
+tasks with a deadline (ix_tasks_open_sla_date) and cost O(bucket size).
+Results are cached per day and dropped on the next committed task write.
+"""
+
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import and_, case, func, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from cache import cache
+from dates import parse_date
+from database import get_async_db
+from models import Task, TaskStatus
+from pagination import after_cursor, decode_keyset, encode_cursor
+from tasks import day_range
+import schemas
+
+router = APIRouter(prefix="/sla", tags=["sla"])
+
+BUCKETS = ("overdue", "due_today", "due_this_week", "on_track")
+DUE_SOON_DAYS = 7
+
+# Rendered inline so SQLite can match the predicate of the partial index
+_open_with_sla = and_(
+    Task.status != literal(TaskStatus.COMPLETED.value, literal_execute=True),
+    Task.sla_date.isnot(None),
+)
+
+
+def bucket_range(bucket: str, today: date) -> list:
+    """sla_date filters selecting one bucket"""
+    if bucket == "overdue":
+        return day_range(Task.sla_date, None, today - timedelta(days=1))
+    if bucket == "due_today":
+        return day_range(Task.sla_date, today, today)
+    if bucket == "due_this_week":
+        return day_range(Task.sla_date, today + timedelta(days=1), today + timedelta(days=DUE_SOON_DAYS))
+    return day_range(Task.sla_date, today + timedelta(days=DUE_SOON_DAYS + 1), None)
+
+
+def bucket_of(sla_date: Optional[date], status: Optional[str], today: date) -> Optional[str]:
+    """Bucket of a single task, by the same comparisons as sla_summary; None if it has none"""
+    sla_date = parse_date(sla_date)
+    if status == TaskStatus.COMPLETED.value or sla_date is None:
+        return None
+    if sla_date < today:
+        return "overdue"
+    if sla_date == today:
+        return "due_today"
+    if sla_date <= today + timedelta(days=DUE_SOON_DAYS):
+        return "due_this_week"
+    return "on_track"
+
+
+def _today(today: Optional[date]) -> date:
+    return today or datetime.now(timezone.utc).date()
+
+
+async def sla_summary(db: AsyncSession, today: date) -> schemas.SLASummary:
+    tomorrow = today + timedelta(days=1)
+    week_end = today + timedelta(days=DUE_SOON_DAYS + 1)
+    bucket = case(
+        (Task.sla_date < today, "overdue"),
+        (Task.sla_date < tomorrow, "due_today"),
+        (Task.sla_date < week_end, "due_this_week"),
+        else_="on_track",
+    )
+    rows = await db.execute(select(bucket, func.count()).where(_open_with_sla).group_by(bucket))
+    counts = dict(rows.all())
+
+    no_sla = await db.scalar(
+        select(func.count()).select_from(Task).where(
+            Task.status != TaskStatus.COMPLETED.value, Task.sla_date.is_(None)
+        )
+    )
+    return schemas.SLASummary(
+        today=today,
+        no_sla=no_sla,
+        **{name: counts.get(name, 0) for name in BUCKETS},
+    )
+
+
+async def day_transitions(db: AsyncSession, today: date) -> list:
+    """(task, old bucket, new bucket) for open tasks that changed bucket when the date became `today`"""
+    moves = (
+        ("due_today", "overdue", today - timedelta(days=1)),
+        ("due_this_week", "due_today", today),
+        ("on_track", "due_this_week", today + timedelta(days=DUE_SOON_DAYS)),
+    )
+    transitions = []
+    for before, after, day in moves:
+        tasks = await db.scalars(
+            select(Task).where(_open_with_sla, *day_range(Task.sla_date, day, day)).order_by(Task.id)
+        )
+        transitions += [(task, before, after) for task in tasks]
+    return transitions
+
+
+def select_bucket(bucket: str, today: date, cursor: Optional[str] = None):
+    """Open tasks of a bucket ordered by (sla_date, id), optionally after a cursor"""
+    query = select(Task).where(_open_with_sla, *bucket_range(bucket, today))
+    if cursor:
+        value, last_id = decode_keyset(cursor, Task.sla_date, Task.id)
+        query = query.where(after_cursor(Task.sla_date, Task.id, value, last_id))
+    return query.order_by(Task.sla_date, Task.id)
+
+
+async def sla_tasks(db: AsyncSession, bucket: str, today: date, limit: int, cursor: Optional[str]):
+    query = select_bucket(bucket, today, cursor).options(selectinload(Task.comments)).limit(limit + 1)
+    tasks = (await db.scalars(query)).all()
+
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = encode_cursor(tasks[-1].sla_date, tasks[-1].id)
+    return [schemas.Task.model_validate(task) for task in tasks], next_cursor
+
+
+# ======================================================================
+# ENDPOINTS
+# ======================================================================
+
+@router.get("/summary", response_model=schemas.SLASummary)
+async def get_sla_summary(today: Optional[date] = None, db: AsyncSession = Depends(get_async_db)):
+    """Number of open tasks in each SLA bucket.
+
+    Pass the client's local `today` so buckets match what the user sees;
+    it defaults to the current UTC date.
+    """
+    today = _today(today)
+    key = ("sla-summary", today)
+    summary = cache.get(key)
+    if summary is None:
+        # Read before the queries: a write committing meanwhile must not be cached over
+        version = cache.version
+        summary = await sla_summary(db, today)
+        cache.set(key, summary, tables=("tasks",), version=version)
+    return summary
+
+@router.get("/tasks", response_model=List[schemas.Task])
+async def get_sla_tasks(
+    response: Response,
+    bucket: Literal["overdue", "due_today", "due_this_week", "on_track"],
+    today: Optional[date] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Open tasks in one SLA bucket, most urgent first.
+
+    Pass the `X-Next-Cursor` header of a page as `cursor` to get the next one.
+    """
+    today = _today(today)
+    key = ("sla-tasks", bucket, today, limit, cursor)
+    page = cache.get(key)
+    if page is None:
+        version = cache.version
+        try:
+            page = await sla_tasks(db, bucket, today, limit, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        cache.set(key, page, tables=("tasks", "comments"), version=version)
+
+    tasks, next_cursor = page
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return tasks
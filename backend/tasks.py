@@ -0,0 +1,338 @@
+"""
+Task rules shared by the single-task endpoints in main.py, the filtered task
+listing and the batch mutation endpoint.
+
+The listing filters and sorts in SQL with keyset pagination; its common
+shapes are served by the composite indexes declared on models.Task.
+
+The batch endpoint folds a list of create/update/delete operations in memory,
+then writes them as a handful of set-based statements in one transaction:
+one multi-row INSERT, one UPDATE per distinct set of new values, and one
+DELETE for tasks (plus one for their comments).
+"""
+
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import case, delete, insert, literal, null, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from database import get_async_db
+import leadtime
+from models import Client, Comment, Task, TaskStatus
+from pagination import after_cursor, decode_keyset, encode_cursor
+import schemas
+import serialization
+
+router = APIRouter(prefix="/tasks", tags=["tasks"])
+
+COMPLETED = TaskStatus.COMPLETED.value
+
+# Keep IN lists well below SQLite's bound-parameter limit
+CHUNK_SIZE = 500
+
+SORT_COLUMNS = {
+    "date": Task.date,
+    "sla_date": Task.sla_date,
+    "creation_timestamp": Task.creation_timestamp,
+    "id": Task.id,
+}
+
+
+def new_task_row(task: schemas.TaskCreate, now: Optional[datetime] = None) -> dict:
+    """Column values for a new task, with creation/completion stamps filled in"""
+    now = now or datetime.now(timezone.utc)
+    completed = task.status == COMPLETED
+
+    completion_date = task.completion_date
+    if completion_date is None and completed:
+        completion_date = now.date()
+
+    return {
+        "date": task.date,
+        "description": task.description,
+        "status": task.status,
+        "priority": task.priority,
+        "client_id": task.client_id,
+        "sla_date": task.sla_date,
+        "completion_date": completion_date,
+        "creation_timestamp": now,
+        "completion_timestamp": now if completed else None,
+    }
+
+
+def completion_changes(original_status: str, changes: dict, now: Optional[datetime] = None) -> dict:
+    """Completion fields implied by applying `changes` to a task in `original_status`.
+
+    A task moving to 'completed' is stamped with the current date and time;
+    a task leaving 'completed' has both cleared unless the caller supplied a
+    completion_date explicitly.
+    """
+    new_status = changes.get("status")
+    if new_status == COMPLETED and original_status != COMPLETED:
+        now = now or datetime.now(timezone.utc)
+        return {
+            "completion_date": now.date(),
+            "completion_timestamp": now,
+        }
+    if (original_status == COMPLETED and new_status is not None and new_status != COMPLETED
+            and changes.get("completion_date") is None):
+        return {"completion_date": None, "completion_timestamp": None}
+    return {}
+
+
+def completion_values(changes: dict, now: Optional[datetime] = None) -> dict:
+    """completion_changes() as SQL on the stored status, for an UPDATE that doesn't read the task first"""
+    new_status = changes.get("status")
+    if new_status is None:
+        return {}
+    stored_completed = Task.status == COMPLETED
+
+    def kept(field):
+        # What the column ends up as when completion_changes() leaves it alone
+        column = getattr(Task, field)
+        return literal(changes[field], column.type) if field in changes else column
+
+    if new_status == COMPLETED:
+        now = now or datetime.now(timezone.utc)
+        return {
+            "completion_date": case(
+                (stored_completed, kept("completion_date")), else_=literal(now.date(), Task.completion_date.type),
+            ),
+            "completion_timestamp": case(
+                (stored_completed, kept("completion_timestamp")),
+                else_=literal(now, Task.completion_timestamp.type),
+            ),
+        }
+    if changes.get("completion_date") is None:
+        return {
+            field: case((stored_completed, null()), else_=kept(field))
+            for field in ("completion_date", "completion_timestamp")
+        }
+    return {}
+
+
+def provided_fields(task_update: schemas.TaskUpdate) -> dict:
+    """Fields of an update payload that were sent with a non-null value"""
+    return {
+        field: value
+        for field, value in task_update.model_dump(exclude_unset=True).items()
+        if value is not None
+    }
+
+
+def day_range(column, start: Optional[date], end: Optional[date]) -> list:
+    """Filters for an inclusive [start, end] window of days on a date or timestamp column.
+
+    The upper bound is expressed as "< next day" so it also covers every
+    time of the last day, and stays usable by an index.
+    """
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="Start of range must not be after its end")
+
+    filters = []
+    if start:
+        filters.append(column >= start)
+    if end:
+        filters.append(column < end + timedelta(days=1))
+    return filters
+
+
+def select_tasks(
+    status: Optional[List[str]] = None,
+    priority: Optional[List[str]] = None,
+    client_id: Optional[List[str]] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    sla_from: Optional[date] = None,
+    sla_to: Optional[date] = None,
+    completed: Optional[bool] = None,
+    sort: str = "date",
+    order: str = "desc",
+    cursor: Optional[str] = None,
+):
+    """Build the filtered, sorted task query for one page (without LIMIT)"""
+    query = select(Task)
+    if status:
+        query = query.where(Task.status.in_(status))
+    if priority:
+        query = query.where(Task.priority.in_(priority))
+    if client_id:
+        query = query.where(Task.client_id.in_(client_id))
+    if completed is not None:
+        query = query.where(Task.status == COMPLETED if completed else Task.status != COMPLETED)
+    query = query.where(*day_range(Task.date, date_from, date_to))
+    query = query.where(*day_range(Task.sla_date, sla_from, sla_to))
+
+    column = SORT_COLUMNS[sort]
+    descending = order == "desc"
+    if cursor:
+        value, last_id = decode_keyset(cursor, column, Task.id)
+        query = query.where(after_cursor(column, Task.id, value, last_id, descending))
+
+    # Spell out NULL placement so SQLite and PostgreSQL page identically
+    if descending:
+        return query.order_by(column.desc().nulls_last(), Task.id.desc())
+    return query.order_by(column.asc().nulls_first(), Task.id.asc())
+
+
+def _chunks(values: Iterable, size: int = CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _error(index: int, op: str, message: str, task_id: Optional[int] = None) -> schemas.TaskBatchResult:
+    return schemas.TaskBatchResult(index=index, op=op, ok=False, id=task_id, error=message)
+
+
+async def apply_batch(db: AsyncSession, operations: List[schemas.TaskBatchOperation]) -> List[schemas.TaskBatchResult]:
+    """Apply the operations in order and commit once.
+
+    Operations that reference a missing task or client fail individually
+    without affecting the rest of the batch.  Operations act on the state left
+    by earlier ones, so an update after a delete of the same task fails.
+    """
+    now = datetime.now(timezone.utc)
+
+    target_ids = {op.id for op in operations if op.op != "create"}
+    # What the lead-time stats need of them too
+    before: Dict[int, dict] = {}
+    for ids in _chunks(target_ids):
+        before.update((row.id, leadtime.state(row)) for row in await leadtime.previous(db, Task.id.in_(ids)))
+    statuses = {task_id: task["status"] for task_id, task in before.items()}
+
+    client_ids = {op.task.client_id for op in operations if op.op == "create"}
+    known_clients = set()
+    for ids in _chunks(client_ids):
+        known_clients.update(await db.scalars(select(Client.id).where(Client.id.in_(ids))))
+
+    results: List[Optional[schemas.TaskBatchResult]] = [None] * len(operations)
+    new_rows = []  # (index, row)
+    updates: Dict[int, dict] = {}
+    deleted = set()
+
+    for index, op in enumerate(operations):
+        if op.op == "create":
+            if op.task.client_id not in known_clients:
+                results[index] = _error(index, op.op, "Client not found")
+            else:
+                new_rows.append((index, new_task_row(op.task, now)))
+            continue
+
+        if op.id not in statuses:
+            results[index] = _error(index, op.op, "Task not found", op.id)
+            continue
+
+        if op.op == "update":
+            changes = provided_fields(op.changes)
+            changes.update(completion_changes(statuses[op.id], changes, now))
+            updates.setdefault(op.id, {}).update(changes)
+            statuses[op.id] = changes.get("status", statuses[op.id])
+        else:
+            deleted.add(op.id)
+            updates.pop(op.id, None)
+            del statuses[op.id]
+        results[index] = schemas.TaskBatchResult(index=index, op=op.op, ok=True, id=op.id)
+
+    try:
+        if new_rows:
+            stmt = insert(Task).returning(Task.id, sort_by_parameter_order=True)
+            new_ids = (await db.scalars(stmt, [row for _, row in new_rows])).all()
+            for (index, _), task_id in zip(new_rows, new_ids):
+                results[index] = schemas.TaskBatchResult(index=index, op="create", ok=True, id=task_id)
+
+        # Tasks that end up with identical values share one UPDATE ... WHERE id IN (...)
+        groups = defaultdict(list)
+        for task_id, changes in updates.items():
+            if changes:
+                groups[tuple(sorted(changes.items()))].append(task_id)
+        for values, ids in groups.items():
+            for chunk in _chunks(ids):
+                await db.execute(
+                    update(Task).where(Task.id.in_(chunk)).values(dict(values)),
+                    execution_options={"synchronize_session": False},
+                )
+
+        for chunk in _chunks(deleted):
+            await db.execute(delete(Comment).where(Comment.task_id.in_(chunk)), execution_options={"synchronize_session": False})
+            await db.execute(delete(Task).where(Task.id.in_(chunk)), execution_options={"synchronize_session": False})
+
+        await leadtime.record(db, [
+            *((None, row) for _, row in new_rows),
+            *((before[task_id], {**before[task_id], **changes}) for task_id, changes in updates.items()),
+            *((before[task_id], None) for task_id in deleted),
+        ])
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Echo the final state of every created or updated task
+    live_ids = [r.id for r in results if r.ok and r.op != "delete" and r.id not in deleted]
+    tasks = {}
+    for ids in _chunks(set(live_ids)):
+        query = select(Task).options(selectinload(Task.comments)).where(Task.id.in_(ids))
+        tasks.update((task.id, task) for task in await db.scalars(query))
+    for result in results:
+        if result.ok and result.id in tasks:
+            result.task = schemas.Task.model_validate(tasks[result.id])
+
+    return results
+
+
+@router.get("/", response_model=List[schemas.Task])
+async def list_tasks(
+    status: Optional[List[str]] = Query(None),
+    priority: Optional[List[str]] = Query(None),
+    client_id: Optional[List[str]] = Query(None),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    sla_from: Optional[date] = None,
+    sla_to: Optional[date] = None,
+    completed: Optional[bool] = None,
+    sort: Literal["date", "sla_date", "creation_timestamp", "id"] = "date",
+    order: Literal["asc", "desc"] = "desc",
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    fieldset: serialization.Fieldset = Depends(serialization.fieldset_parameter("tasks")),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Filter and sort tasks on the server.
+
+    Repeat `status`, `priority` or `client_id` to match any of several values.
+    Date ranges are inclusive. Pass the `X-Next-Cursor` header of a page as
+    `cursor` to get the next one; the header is absent on the last page.
+    `fields` and `include` trim the documents, e.g. `fields=status,sla_date&include=`.
+    """
+    try:
+        query = select_tasks(
+            status, priority, client_id, date_from, date_to, sla_from, sla_to,
+            completed, sort, order, cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # The cursor needs the sort key of the last row even if it isn't returned
+    root = fieldset[0].with_columns(sort, "id")
+    query = query.with_only_columns(*root.select().selected_columns).limit(limit + 1)
+    rows = (await db.execute(query)).all()
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last[root.columns.index(sort)], last[root.columns.index("id")])
+    tasks = await serialization.build_documents(db, rows, (root,) + fieldset[1:])
+    return Response(serialization.dumps(tasks), media_type="application/json", headers=headers)
+
+@router.post("/batch", response_model=schemas.TaskBatchResponse)
+async def batch_tasks(batch: schemas.TaskBatchRequest, db: AsyncSession = Depends(get_async_db)):
+    """Create, update and delete many tasks in a single transaction.
+
+    Results are returned in request order, one per operation.
+    """
+    return {"results": await apply_batch(db, batch.operations)}
@@ -0,0 +1,93 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+from sqlalchemy import event
+
+# The backend modules import each other as top-level modules (`from models import ...`)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Point the app at a private database before database.py builds its engines.
+# It has to be a file so the sync fixtures and the async API see the same data.
+_db_dir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_dir.name}/test.db"
+
+import database  # noqa: E402
+
+test_engine = database.engine
+test_async_engine = database.async_engine
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+from cache import cache  # noqa: E402
+from migrations import create_schema  # noqa: E402
+from models import Base  # noqa: E402
+from profiler import capture  # noqa: E402
+from search import init_search_index  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def clean_database():
+    Base.metadata.drop_all(bind=test_engine)
+    create_schema(test_engine)
+    init_search_index(test_engine)
+    cache.clear()
+    yield
+
+
+@pytest.fixture
+def db():
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def count_queries():
+    """Return a context manager collecting every SQL statement run inside it"""
+    @contextmanager
+    def counter():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        engines = (test_engine, test_async_engine.sync_engine)
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            for engine in engines:
+                event.remove(engine, "before_cursor_execute", record)
+
+    return counter
+
+
+@pytest.fixture
+def query_budget():
+    """Return a context manager failing the test when its block runs more than `max_queries`
+    statements, or repeats one (an N+1 suspect, see profiler.py) unless `allow_repeats`"""
+    @contextmanager
+    def budget(max_queries: int, allow_repeats: bool = False):
+        with capture() as profile:
+            yield profile
+        assert len(profile.statements) <= max_queries, (
+            f"Query budget of {max_queries} exceeded:\n{profile.report()}"
+        )
+        if not allow_repeats:
+            assert not profile.suspects(), f"Repeated statements:\n{profile.report()}"
+
+    return budget
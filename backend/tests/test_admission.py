@@ -0,0 +1,136 @@
+import asyncio
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+import admission
+from admission import HEAVY, LIGHT, WRITE, AdmissionMiddleware, Controller, Rejected, parse_limits
+
+
+def test_parse_limits():
+    limits = parse_limits("heavy=2/3, write=8")
+    assert limits[HEAVY] == (2, 3)
+    assert limits[WRITE] == (8, admission.DEFAULT_LIMITS[WRITE].queue)
+    assert limits[LIGHT] == admission.DEFAULT_LIMITS[LIGHT]
+    with pytest.raises(ValueError):
+        parse_limits("bulk=1/1")
+
+
+def test_full_queue_is_refused_with_retry_after():
+    async def scenario():
+        controller = Controller(parse_limits("heavy=1/1"))
+        assert await controller.acquire(HEAVY) == 0.0
+        queued = asyncio.ensure_future(controller.acquire(HEAVY))
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as refused:
+            await controller.acquire(HEAVY)
+        assert refused.value.reason == "queue_full" and refused.value.retry_after >= 1
+
+        controller.release(HEAVY, 0.5)
+        assert await queued > 0
+        assert controller.classes[HEAVY].running == 1
+
+    asyncio.run(scenario())
+
+
+def test_queue_wait_times_out():
+    async def scenario():
+        controller = Controller(parse_limits("light=1/5"), queue_timeout=0.05)
+        await controller.acquire(LIGHT)
+        with pytest.raises(Rejected) as refused:
+            await controller.acquire(LIGHT)
+        assert refused.value.reason == "timeout"
+        assert not controller.classes[LIGHT].waiters
+
+    asyncio.run(scenario())
+
+
+def test_waiting_writes_go_before_heavy_reads():
+    async def scenario():
+        controller = Controller(parse_limits("heavy=1/5,write=1/5"))
+        await controller.acquire(HEAVY)
+        await controller.acquire(WRITE)
+        order = []
+
+        async def wait(name):
+            await controller.acquire(name)
+            order.append(name)
+
+        waiting = [asyncio.ensure_future(wait(HEAVY)), asyncio.ensure_future(wait(WRITE))]
+        await asyncio.sleep(0)
+
+        # The heavy slot frees up first, but a write is still waiting
+        controller.release(HEAVY, 0.1)
+        await asyncio.sleep(0)
+        assert order == []
+        controller.release(WRITE, 0.1)
+        await asyncio.gather(*waiting)
+        assert order == [WRITE, HEAVY]
+
+    asyncio.run(scenario())
+
+
+def test_light_reads_dont_wait_for_writes():
+    async def scenario():
+        controller = Controller(parse_limits("light=1/5,write=1/5"))
+        await controller.acquire(WRITE)
+        await controller.acquire(LIGHT)
+        queued_write = asyncio.ensure_future(controller.acquire(WRITE))
+        queued_read = asyncio.ensure_future(controller.acquire(LIGHT))
+        await asyncio.sleep(0)
+
+        # Its own slot is free: a light read goes ahead of the waiting write
+        controller.release(LIGHT, 0.1)
+        await asyncio.wait_for(queued_read, 1)
+        assert not queued_write.done()
+        # And a new one is admitted at once
+        controller.release(LIGHT, 0.1)
+        assert await controller.acquire(LIGHT) == 0.0
+        controller.release(WRITE, 0.1)
+        await queued_write
+
+    asyncio.run(scenario())
+
+
+def test_middleware_sheds_heavy_reads_but_not_writes():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow_listing(request):
+            await release.wait()
+            return PlainTextResponse("clients")
+
+        async def update_task(request):
+            return PlainTextResponse("updated")
+
+        app = Starlette(routes=[
+            Route("/clients/all", slow_listing),
+            Route("/tasks/{task_id}", update_task, methods=["PUT"]),
+            Route("/health", update_task),
+        ])
+        app.add_middleware(AdmissionMiddleware, limits="heavy=1/0")
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            first = asyncio.ensure_future(http.get("/clients/all"))
+            await asyncio.sleep(0.05)
+
+            refused = await http.get("/clients/all")
+            assert refused.status_code == 503
+            assert int(refused.headers["retry-after"]) >= 1
+
+            assert (await http.put("/tasks/1")).status_code == 200
+            assert (await http.get("/health")).status_code == 200
+            release.set()
+            assert (await first).status_code == 200
+
+    asyncio.run(scenario())
+
+
+def test_queue_waits_are_exported(client):
+    client.get("/clients/all")
+    body = client.get("/metrics").text
+    assert 'admission_queue_wait_seconds_count{class="heavy"}' in body
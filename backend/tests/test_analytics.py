@@ -0,0 +1,81 @@
+import asyncio
+
+import analytics
+from cache import cache
+from models import Client, Task
+
+
+def seed(db):
+    db.add_all([
+        Client(id="C1", name="Acme", company="Acme Inc", origin="web"),
+        Client(id="C2", name="Globex", company="Globex Corp", origin="email"),
+        Client(id="C3", name="Initech", company="Initech LLC", origin="phone"),
+    ])
+    db.add_all([
+        Task(client_id="C1", date="2024-05-01", description="a", status="completed", priority="high"),
+        Task(client_id="C1", date="2024-05-01T10:00:00", description="b", status="pending", priority="low"),
+        Task(client_id="C1", date="2024-05-03", description="c", status="completed", priority="medium"),
+        Task(client_id="C2", date="2024-05-02", description="d", status="in progress", priority="high"),
+        Task(client_id="C2", date="2024-06-10", description="e", status="awaiting client", priority="high"),
+    ])
+    db.commit()
+
+
+def test_summary_counts_with_group_by(client, db):
+    seed(db)
+    body = client.get("/analytics/summary").json()
+
+    assert body["total_tasks"] == 5
+    assert body["completed_tasks"] == 2
+    assert body["tasks_by_status"] == {
+        "labels": ["pending", "in progress", "completed", "awaiting client"],
+        "data": [1, 1, 2, 1],
+    }
+    assert body["tasks_by_priority"] == {"labels": ["low", "medium", "high"], "data": [1, 1, 3]}
+
+    rates = {row["client_id"]: row for row in body["completion_rate_by_client"]}
+    assert rates["C1"]["total_tasks"] == 3
+    assert round(rates["C1"]["completion_rate"], 2) == 66.67
+    assert rates["C3"] == {
+        "client_id": "C3", "client_name": "Initech",
+        "total_tasks": 0, "completed_tasks": 0, "completion_rate": 0.0,
+    }
+
+
+def test_date_window_is_inclusive_and_fills_trend_axis(client, db):
+    seed(db)
+    body = client.get("/analytics/summary", params={"start_date": "2024-05-01", "end_date": "2024-05-04"}).json()
+
+    assert body["total_tasks"] == 4
+    assert body["task_trends"] == {
+        "labels": ["2024-05-01", "2024-05-02", "2024-05-03", "2024-05-04"],
+        "completed": [1, 0, 1, 0],
+        "created": [2, 1, 1, 0],
+    }
+
+
+def test_inverted_window_is_rejected(client):
+    response = client.get("/analytics/status", params={"start_date": "2024-05-04", "end_date": "2024-05-01"})
+    assert response.status_code == 400
+
+
+def test_cache_is_invalidated_by_task_writes(client, db):
+    seed(db)
+    assert client.get("/analytics/status").json()["data"] == [1, 1, 2, 1]
+
+    task_id = db.query(Task).filter(Task.status == "pending").first().id
+    client.put(f"/tasks/{task_id}", json={"status": "completed"})
+    assert client.get("/analytics/status").json()["data"] == [0, 1, 3, 1]
+
+    client.delete("/clients/C2")
+    assert client.get("/analytics/status").json()["data"] == [0, 0, 3, 0]
+
+
+def test_a_result_raced_by_a_write_is_not_cached():
+    async def compute():
+        # A task write commits while the result is being computed
+        cache.invalidate("tasks")
+        return "stale"
+
+    assert asyncio.run(analytics._cached("racy", compute)) == "stale"
+    assert cache.get("racy") is None
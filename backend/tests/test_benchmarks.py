@@ -0,0 +1,60 @@
+import asyncio
+from datetime import date
+
+from sqlalchemy import text
+
+import main
+from benchmarks.dataset import Dataset, load
+from benchmarks.endpoints import SCENARIOS, compare, run
+from database import engine
+
+DATASET = Dataset(clients=8, tasks=60, comments=90, seed=7, today=date(2024, 6, 1))
+
+
+def test_dataset_is_deterministic():
+    tasks = list(DATASET.task_rows())
+    assert tasks == list(DATASET._replace().task_rows())
+    assert list(DATASET.comment_rows()) == list(DATASET.comment_rows())
+    assert tasks != list(DATASET._replace(seed=8).task_rows())
+
+    client_ids = {client["id"] for client in DATASET.client_rows()}
+    for task in tasks:
+        assert task["client_id"] in client_ids
+        assert task["date"] <= DATASET.today
+        if task["status"] == "completed":
+            assert task["date"] <= task["completion_date"] <= DATASET.today
+        else:
+            assert task["completion_timestamp"] is None
+    assert {task["status"] for task in tasks} == {"completed", "pending", "in progress", "awaiting client"}
+
+
+def test_every_scenario_runs_without_errors():
+    load(engine, DATASET)
+    completed = sum(task["status"] == "completed" for task in DATASET.task_rows())
+    with engine.connect() as conn:
+        assert conn.scalar(text("SELECT completed FROM lead_time_stats WHERE dimension = 'all'")) == completed
+    results = asyncio.run(run(main.app, DATASET, requests=3, concurrency=2))
+
+    assert list(results["scenarios"]) == [scenario.name for scenario in SCENARIOS]
+    for name, result in results["scenarios"].items():
+        assert result["errors"] == 0, name
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+    assert results["meta"]["dataset"]["today"] == "2024-06-01"
+    assert results["peak_rss_mb"] > 0
+
+
+def test_compare_flags_regressions_beyond_the_tolerance():
+    def results(p95, throughput, rss=100.0):
+        return {
+            "scenarios": {"tasks": {"p95_ms": p95, "throughput_rps": throughput, "errors": 0}},
+            "peak_rss_mb": rss,
+        }
+
+    baseline = results(10.0, 100.0)
+    assert compare(results(11.5, 85.0, 110.0), baseline, tolerance=0.2) == []
+    assert compare(results(0.5, 100.0), results(0.3, 100.0), tolerance=0.2) == []  # below min_delta_ms
+    assert compare(results(13.0, 70.0, 130.0), baseline, tolerance=0.2) == [
+        "tasks: p95 10.00 -> 13.00 ms",
+        "tasks: throughput 100.0 -> 70.0 req/s",
+        "peak RSS 100.0 -> 130.0 MB",
+    ]
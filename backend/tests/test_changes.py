@@ -0,0 +1,122 @@
+import json
+
+import importer
+from models import Task
+
+
+def changes(client, since=0, **params):
+    response = client.get("/changes", params={"since": since, **params})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def new_task(client, client_id="C1", description="task"):
+    response = client.post("/tasks/", json={
+        "client_id": client_id, "date": "2024-05-01", "description": description,
+        "status": "pending", "priority": "low",
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def create_client(client, client_id="C1"):
+    response = client.post("/clients/", json={"id": client_id, "name": "Acme", "company": "Acme Inc", "origin": "web"})
+    assert response.status_code == 200, response.text
+
+
+def test_each_write_transaction_gets_the_next_revision(client):
+    assert changes(client) == {
+        "revision": 0, "has_more": False, "clients": [], "tasks": [], "comments": [], "deleted": [],
+    }
+
+    create_client(client)
+    task_id = new_task(client)
+    first = changes(client)
+    assert first["revision"] == 2
+    assert [(c["id"], c["revision"]) for c in first["clients"]] == [("C1", 1)]
+    assert [(t["id"], t["revision"]) for t in first["tasks"]] == [(task_id, 2)]
+    assert first["tasks"][0]["updated_at"]
+
+    # Reads don't consume revisions; updates restamp only what they touch
+    client.get("/clients/all")
+    client.put(f"/tasks/{task_id}", json={"status": "completed"})
+    delta = changes(client, since=first["revision"])
+    assert delta["revision"] == 3
+    assert delta["clients"] == []
+    assert [(t["id"], t["status"]) for t in delta["tasks"]] == [(task_id, "completed")]
+
+
+def test_deletes_leave_tombstones(client):
+    create_client(client)
+    task_id = new_task(client)
+    comment_id = client.post(f"/tasks/{task_id}/comments/", json={"text": "hi", "task_id": task_id}).json()["id"]
+    other_task = new_task(client, description="other")
+    since = changes(client)["revision"]
+
+    assert client.delete(f"/tasks/{task_id}").status_code == 200
+    delta = changes(client, since=since)
+    assert sorted((d["table"], d["id"]) for d in delta["deleted"]) == [
+        ("comments", comment_id), ("tasks", str(task_id)),
+    ]
+
+    since = delta["revision"]
+    assert client.delete("/clients/C1").status_code == 200
+    delta = changes(client, since=since)
+    assert sorted((d["table"], d["id"]) for d in delta["deleted"]) == [("clients", "C1"), ("tasks", str(other_task))]
+    assert len({d["revision"] for d in delta["deleted"]}) == 1
+
+
+def test_bulk_statements_are_stamped(client, db, tmp_path):
+    create_client(client)
+    ids = [new_task(client, description=f"t{i}") for i in range(3)]
+    since = changes(client)["revision"]
+
+    response = client.post("/tasks/batch", json={"operations": [
+        {"op": "update", "id": ids[0], "changes": {"priority": "high"}},
+        {"op": "delete", "id": ids[1]},
+        {"op": "create", "task": {"client_id": "C1", "date": "2024-05-02", "description": "new",
+                                  "status": "pending", "priority": "low"}},
+    ]})
+    assert response.status_code == 200
+    delta = changes(client, since=since)
+    assert sorted(t["description"] for t in delta["tasks"]) == ["new", "t0"]
+    assert [(d["table"], d["id"]) for d in delta["deleted"]] == [("tasks", str(ids[1]))]
+    assert len({t["revision"] for t in delta["tasks"]} | {d["revision"] for d in delta["deleted"]}) == 1
+
+    since = delta["revision"]
+    dump = tmp_path / "dump.ndjson"
+    dump.write_text(json.dumps({"id": "C2", "name": "Globex", "company": "Globex", "origin": "web",
+                                "tasks": [{"date": "2024-05-01", "description": "imported",
+                                           "status": "pending", "priority": "low"}]}))
+    assert importer.import_file(str(dump), importer.new_job()).status == "completed"
+    delta = changes(client, since=since)
+    assert [c["id"] for c in delta["clients"]] == ["C2"]
+    assert [t["description"] for t in delta["tasks"]] == ["imported"]
+    assert db.query(Task).filter(Task.revision == 0).count() == 0
+
+
+def test_pages_never_split_a_revision(client):
+    for i in range(3):
+        create_client(client, f"C{i}")
+        for j in range(2):
+            new_task(client, f"C{i}", f"t{i}{j}")
+    expected = changes(client)
+    total = len(expected["clients"]) + len(expected["tasks"])
+
+    seen, seen_revisions, since, pages = [], set(), 0, 0
+    while True:
+        page = changes(client, since=since, limit=2)
+        pages += 1
+        rows = [("clients", c["id"], c["revision"]) for c in page["clients"]]
+        rows += [("tasks", t["id"], t["revision"]) for t in page["tasks"]]
+        revisions = {row[2] for row in rows}
+        assert not revisions & seen_revisions
+        seen += rows
+        seen_revisions |= revisions
+        since = page["revision"]
+        if not page["has_more"]:
+            break
+
+    assert pages > 1
+    assert len(seen) == total
+    assert since == expected["revision"]
@@ -0,0 +1,97 @@
+from models import Client, Comment, Task
+
+
+def seed_clients(db, count, tasks_per_client=2, comments_per_task=1, start=0):
+    for i in range(start, start + count):
+        client_id = f"C{i:05d}"
+        db.add(Client(id=client_id, name=f"Client {i}", company="Co", origin="web"))
+        for j in range(tasks_per_client):
+            task = Task(client_id=client_id, date="2024-05-01", description=f"task {j}",
+                        status="pending", priority="low")
+            task.comments = [
+                Comment(id=f"{client_id}-{j}-{k}", text="note", timestamp="2024-05-01T00:00:00")
+                for k in range(comments_per_task)
+            ]
+            db.add(task)
+    db.commit()
+
+
+def test_listing_issues_constant_number_of_queries(client, db, count_queries):
+    seed_clients(db, 10)
+    with count_queries() as small:
+        assert len(client.get("/clients/?limit=1000").json()) == 10
+
+    seed_clients(db, 990, start=10)
+    with count_queries() as large:
+        body = client.get("/clients/?limit=1000").json()
+    assert len(body) == 1000
+    assert body[-1]["tasks"][1]["comments"][0]["text"] == "note"
+
+    # One SELECT for clients, then IN-batched SELECTs for tasks and comments
+    # (SQLAlchemy chunks IN lists by 500), independent of the lazy-load fan-out
+    assert len(small) == 3
+    assert len(large) <= 7, large
+
+
+def test_all_clients_is_eager_loaded(client, db, count_queries):
+    seed_clients(db, 200)
+    with count_queries() as statements:
+        assert len(client.get("/clients/all").json()) == 200
+    assert len(statements) == 3
+
+
+def test_keyset_pagination_walks_every_client_once(client, db):
+    seed_clients(db, 25, tasks_per_client=0)
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 10}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/clients/", params=params)
+        seen.extend(row["id"] for row in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert seen == sorted(f"C{i:05d}" for i in range(25))
+
+
+def test_exact_page_boundary_has_no_next_cursor(client, db):
+    seed_clients(db, 10, tasks_per_client=0)
+    response = client.get("/clients/", params={"limit": 10})
+    assert len(response.json()) == 10
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_unchanged_listing_revalidates_with_304(client, db, count_queries):
+    seed_clients(db, 3)
+    first = client.get("/clients/?limit=2")
+    etag = first.headers["ETag"]
+    assert first.headers["X-Next-Cursor"] == "C00001"
+
+    with count_queries() as statements:
+        not_modified = client.get("/clients/?limit=2", headers={"If-None-Match": etag})
+        cached = client.get("/clients/?limit=2")
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["ETag"] == etag
+    assert cached.content == first.content
+    assert cached.headers["X-Next-Cursor"] == "C00001"
+    assert statements == []
+
+
+def test_writes_change_the_etag(client, db):
+    seed_clients(db, 1)
+    etag = client.get("/clients/all").headers["ETag"]
+
+    response = client.post("/tasks/", json={
+        "client_id": "C00000", "date": "2024-05-02", "description": "new",
+        "status": "pending", "priority": "low",
+    })
+    assert response.status_code == 200
+
+    refreshed = client.get("/clients/all", headers={"If-None-Match": etag})
+    assert refreshed.status_code == 200
+    assert refreshed.headers["ETag"] != etag
+    assert len(refreshed.json()[0]["tasks"]) == 3
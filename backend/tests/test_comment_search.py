@@ -0,0 +1,105 @@
+import pytest
+
+import search
+from models import Client, Comment, Task
+from pagination import encode_cursor
+
+
+@pytest.fixture
+def seeded(db):
+    db.add_all([
+        Client(id="C1", name="Acme", company="Acme Inc", origin="web"),
+        Client(id="C2", name="Globex", company="Globex Corp", origin="email"),
+    ])
+    db.add_all([
+        Task(id=1, client_id="C1", date="2024-05-01", description="Install printer", status="pending", priority="low"),
+        Task(id=2, client_id="C2", date="2024-05-01", description="Renew licence", status="pending", priority="low"),
+    ])
+    db.add_all([
+        Comment(id="a", task_id=1, text="Printer driver missing", author="Ana", timestamp="2024-05-01T10:00:00"),
+        Comment(id="b", task_id=1, text="Called about the printer again, printer still offline", author="Bruno", timestamp="2024-05-02T10:00:00"),
+        Comment(id="c", task_id=2, text="Waiting for approval", author="Ana", timestamp="2024-05-03T10:00:00"),
+    ])
+    db.commit()
+
+
+def search_ids(client, q, **params):
+    return [row["id"] for row in client.get("/comments/search", params={"q": q, **params}).json()["results"]]
+
+
+def test_prefix_match_ranked_by_bm25(client, seeded):
+    body = client.get("/comments/search", params={"q": "print"}).json()
+    assert body["total"] == 2
+    # "b" mentions printer twice in the text column
+    assert [row["id"] for row in body["results"]] == ["b", "a"]
+    assert "<mark>printer</mark>" in body["results"][0]["snippet"].lower()
+
+
+def test_matches_author_task_and_client_columns(client, seeded):
+    assert sorted(search_ids(client, "ana")) == ["a", "c"]
+    assert search_ids(client, "licence") == ["c"]
+    assert search_ids(client, "globex") == ["c"]
+
+
+def test_index_follows_comment_task_and_client_writes(client, db, seeded):
+    new_id = client.post("/tasks/2/comments/", json={"text": "Printer toner ordered", "task_id": 2}).json()["id"]
+    assert search_ids(client, "toner") == [new_id]
+
+    client.delete("/comments/a")
+    assert search_ids(client, "driver") == []
+
+    client.put("/tasks/1", json={"description": "Replace scanner"})
+    assert search_ids(client, "scanner") == ["b"]
+
+    client.put("/clients/C2", json={"name": "Initech"})
+    assert sorted(search_ids(client, "initech")) == sorted(["c", new_id])
+    # The company column was left untouched by the rename
+    assert sorted(search_ids(client, "globex")) == sorted(["c", new_id])
+
+
+def test_cursor_pagination_returns_each_match_once(client, db):
+    db.add(Client(id="C1", name="Acme", company="Acme Inc", origin="web"))
+    db.add(Task(id=1, client_id="C1", date="2024-05-01", description="x", status="pending", priority="low"))
+    db.add_all(
+        Comment(id=f"n{i:02d}", task_id=1, text="network " * (i % 4 + 1), timestamp="2024-05-01")
+        for i in range(23)
+    )
+    db.commit()
+
+    seen, cursor = [], None
+    while True:
+        params = {"q": "netw", "limit": 5}
+        if cursor:
+            params["cursor"] = cursor
+        body = client.get("/comments/search", params=params).json()
+        assert body["total"] == 23
+        seen.extend(row["id"] for row in body["results"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+
+    assert sorted(seen) == [f"n{i:02d}" for i in range(23)]
+
+
+def test_short_queries_and_bad_cursors(client, seeded, monkeypatch):
+    assert client.get("/comments/search", params={"q": "a"}).json()["results"] == []
+    assert client.get("/comments/search", params={"q": "printer", "cursor": "garbage"}).status_code == 400
+    # Well-formed cursors whose keys have the wrong type, for FTS and for the LIKE fallback
+    for fts in (True, False):
+        monkeypatch.setattr(search, "_fts_enabled", fts)
+        for key in (["notatime", "a"], ["x", 1], [None, "a"], [1.5, True], [2024, None]):
+            response = client.get("/comments/search", params={"q": "printer", "cursor": encode_cursor(*key)})
+            assert response.status_code == 400, (fts, key)
+
+
+def test_like_fallback_pages_the_same_way(client, seeded, monkeypatch):
+    monkeypatch.setattr(search, "_fts_enabled", False)
+    body = client.get("/comments/search", params={"q": "printer", "limit": 1}).json()
+    assert body["total"] == 2
+    assert [row["id"] for row in body["results"]] == ["b"]
+    assert search_ids(client, "printer", limit=1, cursor=body["next_cursor"]) == ["a"]
+
+
+def test_match_query_escapes_operators():
+    assert search.build_match_query('foo "bar" OR baz-') == '"foo"* "bar"* "OR"* "baz"*'
+    assert search.build_match_query("--") is None
@@ -0,0 +1,49 @@
+def create_client(client, client_id="C1", **extra):
+    payload = {"id": client_id, "name": "Acme", "company": "Acme Inc", "origin": "web", **extra}
+    response = client.post("/clients/", json=payload)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def create_task(client, client_id="C1", **extra):
+    payload = {"client_id": client_id, "date": "2024-05-01", "description": "Install printer",
+               "status": "pending", "priority": "low", **extra}
+    response = client.post("/tasks/", json=payload)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_client_lifecycle(client):
+    body = create_client(client, tasks=[{"client_id": "C1", "date": "2024-05-01", "description": "a",
+                                          "status": "pending", "priority": "low"}])
+    assert [task["description"] for task in body["tasks"]] == ["a"]
+    assert client.post("/clients-only/", json={"id": "C1", "name": "x", "company": "y", "origin": "z"}).status_code == 400
+
+    updated = client.put("/clients/C1", json={"name": "Acme 2"}).json()
+    assert updated["name"] == "Acme 2"
+    assert len(updated["tasks"]) == 1
+
+    assert client.delete("/clients/C1").json()["id"] == "C1"
+    assert client.get("/clients/C1").status_code == 404
+
+
+def test_task_and_comment_lifecycle(client):
+    create_client(client)
+    task = create_task(client, status="completed")
+    assert task["comments"] == []
+    assert task["completion_timestamp"] == task["creation_timestamp"]
+    assert client.post("/tasks/", json={
+        "client_id": "missing", "date": "2024-05-01", "description": "x", "status": "pending", "priority": "low",
+    }).status_code == 404
+
+    comment = client.post(f"/tasks/{task['id']}/comments/", json={"text": "hello", "task_id": task["id"]}).json()
+    assert comment["author"] == "User"
+    assert [c["id"] for c in client.get(f"/tasks/{task['id']}/comments/").json()] == [comment["id"]]
+
+    reopened = client.put(f"/tasks/{task['id']}", json={"status": "pending"}).json()
+    assert reopened["completion_date"] is None
+    assert reopened["comments"][0]["text"] == "hello"
+
+    assert client.delete(f"/comments/{comment['id']}").status_code == 200
+    assert client.delete(f"/tasks/{task['id']}").json()["id"] == task["id"]
+    assert client.put(f"/tasks/{task['id']}", json={"status": "pending"}).status_code == 404
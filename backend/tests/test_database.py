@@ -0,0 +1,41 @@
+import asyncio
+
+from sqlalchemy import text
+
+import database
+
+
+def test_sqlite_connections_get_tuned_pragmas():
+    with database.engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == database.SQLITE_PRAGMAS["busy_timeout"]
+        assert conn.execute(text("PRAGMA cache_size")).scalar() == database.SQLITE_PRAGMAS["cache_size"]
+
+
+def test_async_connections_get_the_same_pragmas():
+    async def read_pragma():
+        async with database.async_engine.connect() as conn:
+            return (await conn.execute(text("PRAGMA busy_timeout"))).scalar()
+
+    assert asyncio.run(read_pragma()) == database.SQLITE_PRAGMAS["busy_timeout"]
+
+
+def test_postgresql_urls_get_a_sized_pool():
+    url = "postgresql://app:secret@db:5432/tasks"
+    options = database.engine_options(url)
+    assert options["pool_size"] == database.POOL_SIZE
+    assert options["max_overflow"] == database.MAX_OVERFLOW
+    assert options["pool_recycle"] == database.POOL_RECYCLE
+    assert options["pool_pre_ping"] is True
+    assert database.to_async_url(url) == "postgresql+asyncpg://app:secret@db:5432/tasks"
+
+
+def test_in_memory_sqlite_skips_pool_sizing():
+    assert database.engine_options("sqlite://") == {"connect_args": {"check_same_thread": False}}
+
+
+def test_pool_stats_endpoint(client):
+    body = client.get("/health/db").json()
+    assert body["backend"] == "sqlite"
+    assert {"size", "checkedin", "checkedout", "overflow"} <= set(body["async_pool"])
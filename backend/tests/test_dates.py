@@ -0,0 +1,45 @@
+from models import Client
+
+
+def create_task(client, **fields):
+    return client.post("/tasks/", json={
+        "client_id": "C1", "date": "2024-05-01", "description": "task",
+        "status": "pending", "priority": "low", **fields,
+    })
+
+
+def test_dates_are_validated_and_normalized(client, db):
+    db.add(Client(id="C1", name="Acme", company="Acme Inc", origin="web"))
+    db.commit()
+
+    response = create_task(client, date="2024-05-01T23:30:00", sla_date="2024-05-10")
+    assert response.status_code == 200, response.text
+    task = response.json()
+    assert task["date"] == "2024-05-01"
+    assert task["sla_date"] == "2024-05-10"
+    assert task["creation_timestamp"].endswith("Z")
+
+    response = client.put(f"/tasks/{task['id']}", json={"creation_timestamp": "2024-05-01T06:00:00-03:00"})
+    assert response.json()["creation_timestamp"] == "2024-05-01T09:00:00Z"
+
+    for field, value in (("date", "01/05/2024"), ("sla_date", "soon"), ("creation_timestamp", "yesterday")):
+        assert create_task(client, **{field: value}).status_code == 422
+    assert client.put(f"/tasks/{task['id']}", json={"sla_date": "2024-13-01"}).status_code == 422
+
+
+def test_sorting_and_ranges_use_the_typed_values(client, db):
+    db.add(Client(id="C1", name="Acme", company="Acme Inc", origin="web"))
+    db.commit()
+    # As strings these sorted "2024-05-09T..." after "2024-05-09" and before "2024-05-10"
+    for sla in ("2024-05-10", "2024-05-09T18:00:00", "2024-05-09", "2024-05-11"):
+        assert create_task(client, sla_date=sla, description=sla).status_code == 200
+
+    page = client.get("/tasks/", params={"sort": "sla_date", "order": "asc", "limit": 2}).json()
+    rest = client.get("/tasks/", params={
+        "sort": "sla_date", "order": "asc", "limit": 10,
+        "cursor": client.get("/tasks/", params={"sort": "sla_date", "order": "asc", "limit": 2}).headers["X-Next-Cursor"],
+    }).json()
+    assert [t["sla_date"] for t in page + rest] == ["2024-05-09", "2024-05-09", "2024-05-10", "2024-05-11"]
+
+    window = client.get("/tasks/", params={"sla_from": "2024-05-09", "sla_to": "2024-05-09"}).json()
+    assert len(window) == 2
@@ -0,0 +1,188 @@
+import asyncio
+import json
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+import events
+from events import Broker, broker, event_stream
+from models import Client, Task
+
+
+def parse(chunk):
+    """Events in a text/event-stream chunk, as the decoded data fields"""
+    return [
+        json.loads(line[len("data: "):])
+        for block in chunk.split("\n\n")
+        for line in block.split("\n")
+        if line.startswith("data: ")
+    ]
+
+
+@pytest.fixture
+def subscribe(client):
+    """Subscribe to the app's broker on its event loop; return a function draining the queue"""
+    subscribers = []
+
+    async def add(topics):
+        return broker.subscribe(topics)
+
+    async def drain(subscriber):
+        await asyncio.sleep(0)  # let call_soon_threadsafe deliveries run
+        received = []
+        while not subscriber.queue.empty():
+            received += parse(subscriber.queue.get_nowait())
+        return received
+
+    def factory(topics=None):
+        subscriber = client.portal.call(add, topics)
+        subscribers.append(subscriber)
+        return lambda: client.portal.call(drain, subscriber)
+
+    yield factory
+    for subscriber in subscribers:
+        broker.unsubscribe(subscriber)
+
+
+def create_client(client):
+    response = client.post("/clients/", json={"id": "C1", "name": "Acme", "company": "Acme Inc", "origin": "web"})
+    assert response.status_code == 200, response.text
+
+
+def new_task(client, **fields):
+    response = client.post("/tasks/", json={
+        "client_id": "C1", "date": "2024-05-01", "description": "task",
+        "status": "pending", "priority": "low", **fields,
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def test_task_and_comment_writes_are_published_after_commit(client, subscribe):
+    create_client(client)
+    received = subscribe()
+
+    task_id = new_task(client)
+    client.put(f"/tasks/{task_id}", json={"description": "renamed"})
+    comment = client.post(f"/tasks/{task_id}/comments/", json={"task_id": task_id, "text": "hi"}).json()
+    client.delete(f"/comments/{comment['id']}")
+    client.delete(f"/tasks/{task_id}")
+
+    got = received()
+    assert [event["type"] for event in got] == [
+        "task.created", "task.updated", "comment.created", "comment.deleted", "task.deleted",
+    ]
+    assert got[0]["data"]["id"] == task_id
+    assert got[1]["data"]["description"] == "renamed"
+    assert got[2]["data"]["text"] == "hi"
+    assert got[3]["data"] == {"id": comment["id"], "task_id": task_id}
+    assert got[4]["data"] == {"id": task_id, "client_id": "C1"}
+
+    revisions = [event["revision"] for event in got]
+    assert revisions == sorted(revisions) and len(set(revisions)) == len(revisions)
+    assert client.get("/changes", params={"since": revisions[-1]}).json()["revision"] == revisions[-1]
+
+
+def test_sla_transitions_on_write(client, subscribe):
+    create_client(client)
+    received = subscribe(["sla"])
+    today = datetime.now(timezone.utc).date()
+
+    task_id = new_task(client, sla_date=today.isoformat())
+    client.put(f"/tasks/{task_id}", json={"sla_date": (today - timedelta(days=3)).isoformat()})
+    client.put(f"/tasks/{task_id}", json={"description": "no bucket change"})
+    client.put(f"/tasks/{task_id}", json={"status": "completed"})
+
+    assert [(event["data"]["from"], event["data"]["to"]) for event in received()] == [
+        (None, "due_today"), ("due_today", "overdue"), ("overdue", None),
+    ]
+
+
+def test_bulk_writes_publish_one_sync_event(client, subscribe):
+    create_client(client)
+    task_id = new_task(client)
+    received = subscribe()
+
+    response = client.post("/tasks/batch", json={"operations": [
+        {"op": "update", "id": task_id, "changes": {"status": "completed"}},
+        {"op": "delete", "id": task_id},
+    ]})
+    assert response.status_code == 200
+
+    # Deleting a task deletes its comments too
+    assert [(event["type"], event["data"]) for event in received()] == [
+        ("sync", {"tables": ["comments", "tasks"]}),
+    ]
+
+
+def test_writes_from_other_threads_and_rollbacks(client, subscribe, db):
+    received = subscribe()
+
+    db.add(Client(id="C1", name="Acme", company="Acme Inc", origin="web"))
+    db.commit()
+    db.add(Client(id="C2", name="Gone", company="Gone Inc", origin="web"))
+    db.flush()
+    db.rollback()
+
+    assert [(event["type"], event["data"]["id"]) for event in received()] == [("client.created", "C1")]
+
+
+def test_topics_filter_event_families(client, subscribe):
+    create_client(client)
+    tasks_only = subscribe(["task"])
+    new_task(client)
+    assert [event["type"] for event in tasks_only()] == ["task.created"]
+
+
+def test_date_rollover_publishes_sla_transitions(client, subscribe, db):
+    today = date(2024, 5, 10)
+    db.add(Client(id="C1", name="Acme", company="Acme Inc", origin="web"))
+    db.add_all(
+        Task(id=id, client_id="C1", date="2024-05-01", description="t", status=status,
+             priority="low", sla_date=sla)
+        for id, status, sla in [
+            (1, "pending", "2024-05-09"),   # due today -> overdue
+            (2, "pending", "2024-05-10"),   # due this week -> due today
+            (3, "pending", "2024-05-17"),   # on track -> due this week
+            (4, "pending", "2024-05-16"),   # stays due this week
+            (5, "completed", "2024-05-09"),
+        ]
+    )
+    db.commit()
+    received = subscribe()
+
+    assert client.portal.call(events.publish_day_transitions, today) == 3
+    assert [(e["data"]["task_id"], e["data"]["from"], e["data"]["to"]) for e in received()] == [
+        (1, "due_today", "overdue"), (2, "due_this_week", "due_today"), (3, "on_track", "due_this_week"),
+    ]
+
+
+def test_slow_subscribers_get_a_resync_instead_of_a_backlog():
+    async def scenario():
+        small = Broker(queue_size=2)
+        slow = small.subscribe()
+        small.publish([{"type": "task.created", "revision": n, "data": {}} for n in range(5)])
+        await asyncio.sleep(0)
+        return [slow.queue.get_nowait() for _ in range(slow.queue.qsize())], small.stats()
+
+    queued, stats = asyncio.run(scenario())
+    assert queued == [events.RESYNC]
+    assert stats["published"] == 5 and stats["dropped"] > 0
+
+
+def test_stream_framing_heartbeats_and_unsubscribe():
+    async def scenario():
+        subscriber = broker.subscribe()
+        stream = event_stream(subscriber, resync=True, heartbeat=0.01)
+        chunks = [await anext(stream), await anext(stream)]
+        broker.publish([{"type": "task.deleted", "revision": 7, "data": {"id": 1}}])
+        chunks.append(await anext(stream))
+        await stream.aclose()
+        return chunks, subscriber in broker.subscribers
+
+    (opening, heartbeat, event), subscribed = asyncio.run(scenario())
+    assert opening.startswith("retry: ") and parse(opening) == [{"type": "resync"}]
+    assert heartbeat == ": keep-alive\n\n"
+    assert event.startswith("id: 7\nevent: task.deleted\n")
+    assert parse(event) == [{"type": "task.deleted", "revision": 7, "data": {"id": 1}}]
+    assert not subscribed
@@ -0,0 +1,106 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+import database
+import exporter
+import importer
+from models import Client, Comment, Task
+
+
+@pytest.fixture
+def seeded(db):
+    db.add_all([
+        Client(id="C1", name="Acme", company="Acme Inc", origin="web"),
+        Client(id="C2", name="Globex, \"the\" corp", company="Globex", origin="email"),
+        Client(id="C3", name="Empty", company="Nobody", origin="web"),
+    ])
+    db.add_all([
+        Task(id=1, client_id="C1", date="2024-05-01", description="first\nline", status="pending",
+             priority="high", sla_date="2024-05-10"),
+        Task(id=2, client_id="C1", date="2024-05-02", description="second", status="completed",
+             priority="low", completion_date="2024-05-03", creation_timestamp="2024-05-02T10:00:00"),
+        Task(id=3, client_id="C2", date="2024-05-03", description="third", status="pending", priority="low"),
+    ])
+    db.add_all([
+        Comment(id="a1", task_id=1, text="hello, world", author="Ana", timestamp="2024-05-01T10:00:00"),
+        Comment(id="a2", task_id=1, text="again", author=None, timestamp="2024-05-01T11:00:00"),
+    ])
+    db.commit()
+
+
+def snapshot_of(db):
+    """Everything stored, in a comparable shape"""
+    return (
+        sorted((c.id, c.name, c.company, c.origin) for c in db.query(Client)),
+        sorted(
+            (t.id, t.client_id, t.date, t.description, t.status, t.priority, t.sla_date,
+             t.completion_date, t.creation_timestamp, t.completion_timestamp)
+            for t in db.query(Task)
+        ),
+        sorted((c.id, c.task_id, c.text, c.author, c.timestamp) for c in db.query(Comment)),
+    )
+
+
+def test_ndjson_export_nests_tasks_and_comments(client, seeded):
+    response = client.get("/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert "attachment" in response.headers["content-disposition"]
+
+    clients = [json.loads(line) for line in response.text.splitlines()]
+    assert [c["id"] for c in clients] == ["C1", "C2", "C3"]
+    assert [t["id"] for t in clients[0]["tasks"]] == [1, 2]
+    assert [c["id"] for c in clients[0]["tasks"][0]["comments"]] == ["a1", "a2"]
+    assert clients[2]["tasks"] == []
+
+
+@pytest.mark.parametrize("format", ["ndjson", "csv"])
+@pytest.mark.parametrize("compress", [False, True])
+def test_dump_restores_to_the_same_data(client, db, seeded, tmp_path, format, compress):
+    response = client.get("/export", params={"format": format, "gzip": compress})
+    assert response.status_code == 200
+    if compress:
+        assert gzip.decompress(response.content)
+    expected = snapshot_of(db)
+
+    path = tmp_path / "dump"
+    path.write_bytes(response.content)
+    for model in (Comment, Task, Client):
+        db.query(model).delete()
+    db.commit()
+
+    job = importer.import_file(str(path), importer.new_job("replace"))
+    assert job.status == "completed", job.error
+    db.expire_all()
+    assert snapshot_of(db) == expected
+
+
+def test_export_reads_one_snapshot(db, seeded):
+    with exporter.snapshot(database.engine) as conn:
+        clients = exporter.iter_clients(conn, page_size=1)
+        assert next(clients)["id"] == "C1"
+
+        # Writers are not blocked, and their changes stay invisible to the dump
+        db.add(Client(id="C0", name="Late", company="Late", origin="web"))
+        db.query(Comment).delete()
+        db.query(Task).filter(Task.client_id == "C2").delete()
+        db.commit()
+
+        rest = list(clients)
+
+    assert [c["id"] for c in rest] == ["C2", "C3"]
+    assert [t["id"] for t in rest[0]["tasks"]] == [3]
+
+
+def test_csv_layout(client, seeded):
+    rows = client.get("/export", params={"format": "csv"}).text
+    records = list(csv.DictReader(io.StringIO(rows)))
+    assert [r["type"] for r in records] == [
+        "client", "task", "comment", "comment", "task", "client", "task", "client",
+    ]
+    assert records[1]["description"] == "first\nline"
+    assert records[5]["name"] == 'Globex, "the" corp'
@@ -0,0 +1,104 @@
+from typing import List
+
+import pytest
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+import schemas
+import serialization
+from database import AsyncSessionLocal
+from models import Client, Comment, Task
+from profiler import capture
+from serialization import parse_fieldset
+
+
+@pytest.fixture
+def seeded(db):
+    for c in range(3):
+        db.add(Client(id=f"C{c}", name=f"name {c}", company="Co", origin="web"))
+        for t in range(4):
+            task_id = c * 10 + t + 1
+            db.add(Task(id=task_id, client_id=f"C{c}", date=f"2024-05-0{t + 1}", description="long text " * 20,
+                        status="pending" if t % 2 else "completed", priority="low",
+                        sla_date="2024-05-10" if t % 2 else None))
+            db.add(Comment(id=f"K{task_id}", task_id=task_id, text="comment body", timestamp="2024-05-02"))
+    db.commit()
+
+
+def statements_reading(profile, table):
+    return [item["statement"] for item in profile.statements if f"FROM {table}" in item["statement"]]
+
+
+def test_parse_fieldset():
+    clients, tasks, comments = parse_fieldset("clients")
+    assert (clients.resource, tasks.resource, comments.resource) == ("clients", "tasks", "comments")
+    assert clients.fields == clients.columns == serialization.CLIENT_FIELDS
+
+    (clients,) = parse_fieldset("clients", fields="name")
+    assert clients.fields == ("name", "id")
+
+    # Fields of a nested resource embed it; the join key is read but not returned
+    clients, tasks = parse_fieldset("clients", fields="name,tasks.status")
+    assert tasks.fields == ("status", "id") and tasks.columns == ("status", "id", "client_id")
+    assert len(parse_fieldset("clients", fields="tasks.comments.text")) == 3
+    assert len(parse_fieldset("clients", include="tasks")) == 2
+    assert len(parse_fieldset("clients", include="tasks.comments")) == 3
+    assert len(parse_fieldset("tasks", include="")) == 1
+
+    for fields, include in (("nope", None), ("tasks.nope", None), (None, "comments"), ("tasks.status", "")):
+        with pytest.raises(ValueError):
+            parse_fieldset("clients", fields, include)
+
+
+def test_default_task_listing_is_unchanged(client, seeded):
+    async def reference():
+        async with AsyncSessionLocal() as db:
+            query = select(Task).options(selectinload(Task.comments)).order_by(Task.date.desc(), Task.id.desc())
+            adapter = TypeAdapter(List[schemas.Task])
+            return adapter.dump_json(adapter.validate_python((await db.scalars(query)).all(), from_attributes=True))
+
+    assert client.get("/tasks/").content == client.portal.call(reference)
+
+
+def test_include_tasks_without_comments(client, seeded):
+    with capture() as profile:
+        clients = client.get("/clients/", params={"include": "tasks"}).json()
+    assert statements_reading(profile, "comments") == []
+    assert len(clients) == 3 and len(clients[0]["tasks"]) == 4
+    assert set(clients[0]["tasks"][0]) == set(serialization.TASK_FIELDS)
+
+
+def test_sparse_task_fields_are_not_read(client, seeded):
+    with capture() as profile:
+        response = client.get("/tasks/", params={"fields": "status,priority,sla_date", "include": "", "limit": 5})
+    tasks = response.json()
+    assert [list(task) for task in tasks] == [["status", "priority", "sla_date", "id"]] * 5
+    (statement,) = statements_reading(profile, "tasks")
+    assert "description" not in statement
+    assert statements_reading(profile, "comments") == []
+
+    # The cursor still pages on the sort column, which wasn't returned
+    rest = client.get("/tasks/", params={
+        "fields": "status", "include": "", "cursor": response.headers["X-Next-Cursor"],
+    }).json()
+    full = [task["id"] for task in client.get("/tasks/").json()]
+    assert [task["id"] for task in tasks + rest] == full
+
+
+def test_nested_sparse_fields(client, seeded):
+    response = client.get("/clients/C1", params={"fields": "name,tasks.status,tasks.comments.text"})
+    assert response.json()["tasks"][0] == {"status": "completed", "id": 11, "comments": [{"text": "comment body", "id": "K11"}]}
+    assert list(response.json()) == ["name", "id", "tasks"]
+
+    listing = client.get("/clients/all", params={"fields": "name", "include": ""}).json()
+    assert listing == [{"name": f"name {c}", "id": f"C{c}"} for c in range(3)]
+    # Cached per fieldset
+    assert "tasks" in client.get("/clients/all").json()[0]
+
+
+def test_invalid_fieldsets_are_rejected(client, seeded):
+    assert client.get("/clients/", params={"fields": "secret"}).status_code == 400
+    assert client.get("/tasks/", params={"include": "tasks"}).status_code == 400
+    assert client.get("/clients/C1", params={"fields": "tasks.status", "include": ""}).status_code == 400
+    assert client.get("/clients/nope", params={"include": ""}).status_code == 404
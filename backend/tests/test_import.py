@@ -0,0 +1,154 @@
+import io
+import json
+from datetime import date
+
+import pytest
+
+import importer
+import jobs
+from models import Client, Comment, Task
+
+
+def dump(clients, ndjson=False) -> bytes:
+    if ndjson:
+        return "\n".join(json.dumps(client) for client in clients).encode()
+    return json.dumps(clients, indent=2).encode()
+
+
+def client_record(id, name="Acme", tasks=()):
+    return {"id": id, "name": name, "company": f"{name} Inc", "origin": "web", "tasks": list(tasks)}
+
+
+def task_record(description, **fields):
+    return {"date": "2024-05-01", "description": description, "status": "pending", "priority": "low", **fields}
+
+
+def upload(client, data: bytes, **params):
+    response = client.post("/import/", files={"file": ("dump.json", data)}, params=params)
+    assert response.status_code == 202, response.text
+    jobs.runner.wait(response.json()["id"], timeout=30)
+    job = client.get(f"/import/{response.json()['id']}").json()
+    assert job["status"] == "completed", job
+    return job
+
+
+@pytest.mark.parametrize("text", [
+    '[]',
+    ' [ {"a": 1} , {"b": [1, 2, {"c": "]"}]}\n]',
+    '{"a": 1}\n\n{"b": [1, 2, {"c": "]"}]}\n',
+])
+def test_iter_records_parses_arrays_and_ndjson(text, monkeypatch):
+    monkeypatch.setattr(importer, "READ_SIZE", 3)  # force elements across reads
+    expected = json.loads(text) if text.lstrip().startswith("[") else [
+        json.loads(line) for line in text.splitlines() if line
+    ]
+    assert list(importer.iter_records(io.StringIO(text))) == expected
+
+
+@pytest.mark.parametrize("text", ['[{"a": 1}', '[{"a": 1} {"b": 2}]', '{"a": 1}\n{oops}\n'])
+def test_iter_records_rejects_malformed_input(text):
+    with pytest.raises(ValueError):
+        list(importer.iter_records(io.StringIO(text)))
+
+
+@pytest.mark.parametrize("text", [
+    '[{"a": "' + "x" * 100,
+    '[{"a": 1}, ' + " " * 100 + '"' + "x" * 100 + '"]',
+    '{"a": "' + "x" * 100 + '"}\n',
+    'type,id\nclient,' + "x" * 100,
+])
+def test_records_without_a_boundary_are_not_buffered_whole(text, monkeypatch):
+    monkeypatch.setattr(importer, "READ_SIZE", 8)
+    monkeypatch.setattr(importer, "MAX_RECORD_SIZE", 32)
+    with pytest.raises(ValueError, match="longer than 32 characters"):
+        list(importer.iter_records(io.StringIO(text)))
+
+
+@pytest.mark.parametrize("ndjson", [False, True])
+def test_import_inserts_clients_tasks_and_comments(client, db, ndjson):
+    data = dump([
+        client_record("C1", tasks=[task_record("a", comments=[{"text": "hi", "author": "Ana"}]), task_record("b")]),
+        client_record("C2", tasks=[task_record("c", id=42, sla_date="2024-05-10")]),
+    ], ndjson=ndjson)
+
+    job = upload(client, data, chunk_size=1)
+
+    assert job["clients_inserted"] == 2
+    assert job["tasks_inserted"] == 3
+    assert job["comments_imported"] == 1
+    assert job["bytes_read"] == job["total_bytes"] == len(data)
+    assert db.get(Task, 42).sla_date == date(2024, 5, 10)
+    comment = db.query(Comment).one()
+    assert comment.author == "Ana"
+    assert db.get(Task, comment.task_id).description == "a"
+
+
+def test_modes(client, db):
+    upload(client, dump([client_record("C1", tasks=[task_record("a", id=1), task_record("b", id=2)])]))
+    changed = dump([client_record("C1", name="Renamed", tasks=[task_record("a2", id=1), task_record("new")])])
+
+    job = upload(client, changed, mode="skip")
+    assert job["clients_skipped"] == 1 and job["tasks_inserted"] == 0
+    assert db.get(Client, "C1").name == "Acme"
+
+    job = upload(client, changed, mode="upsert")
+    assert (job["clients_updated"], job["tasks_updated"], job["tasks_inserted"]) == (1, 1, 1)
+    db.expire_all()
+    assert db.get(Client, "C1").name == "Renamed"
+    assert sorted(t.description for t in db.query(Task)) == ["a2", "b", "new"]
+
+    job = upload(client, changed, mode="replace")
+    db.expire_all()
+    assert sorted(t.description for t in db.query(Task)) == ["a2", "new"]
+
+
+def test_invalid_records_are_reported_and_skipped(client, db):
+    job = upload(client, dump([
+        client_record("C1"),
+        {"id": "C2", "name": "No company"},
+        client_record("C3", tasks=[{"description": "no date"}]),
+        "not an object",
+        client_record("C4", tasks=[task_record("bad", sla_date="next friday")]),
+    ]))
+
+    assert job["records_read"] == 5
+    assert job["records_failed"] == 4
+    assert len(job["errors"]) == 4
+    assert "Invalid date 'next friday'" in job["errors"][-1]
+    assert [c.id for c in db.query(Client)] == ["C1"]
+
+
+def test_repeated_client_in_one_chunk(client, db):
+    job = upload(client, dump([client_record("C1"), client_record("C1", name="Again")]), mode="upsert")
+    assert (job["clients_inserted"], job["clients_updated"]) == (1, 1)
+    assert db.get(Client, "C1").name == "Again"
+
+
+def test_malformed_upload_fails_the_job(client):
+    response = client.post("/import/", files={"file": ("dump.json", b'[{"id": ')})
+    jobs.runner.wait(response.json()["id"], timeout=30)
+    job = client.get(f"/import/{response.json()['id']}").json()
+    assert job["status"] == "failed"
+    assert job["error"]
+
+
+def test_unknown_job(client):
+    assert client.get("/import/nope").status_code == 404
+
+
+def test_import_data_file_skips_existing_clients(client, db):
+    assert client.post("/import-data/").status_code == 200
+    clients = db.query(Client).count()
+    tasks = db.query(Task).count()
+    assert clients and tasks
+
+    response = client.post("/import-data/")
+    assert response.status_code == 200
+    assert response.json()["job"]["clients_skipped"] == clients
+    assert db.query(Task).count() == tasks
+
+
+def test_import_invalidates_cached_listings(client):
+    assert client.get("/analytics/summary").json()["total_tasks"] == 0
+    upload(client, dump([client_record("C1", tasks=[task_record("a")])]))
+    assert client.get("/analytics/summary").json()["total_tasks"] == 1
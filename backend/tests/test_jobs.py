@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+
+import jobs
+from models import Client, Task
+
+release = threading.Event()
+started = threading.Semaphore(0)
+
+
+@jobs.job_type("test-blocking", concurrency=1)
+def blocking_job(run):
+    started.release()
+    while not release.wait(0.01):
+        run.checkpoint(waiting=True)
+    return {"released": True}
+
+
+@pytest.fixture(autouse=True)
+def reset_release():
+    release.clear()
+    yield
+    release.set()
+
+
+def submit(client, type, **params):
+    response = client.post("/jobs", json={"type": type, "params": params})
+    assert response.status_code == 202, response.text
+    return response.json()["id"]
+
+
+def finished(client, job_id):
+    jobs.runner.wait(job_id, timeout=30)
+    return client.get(f"/jobs/{job_id}").json()
+
+
+@pytest.fixture
+def seeded(db):
+    db.add(Client(id="C1", name="Acme", company="Acme Inc", origin="web"))
+    db.add_all(
+        Task(client_id="C1", date="2024-05-01", description=f"t{i}", status=status, priority="low")
+        for i, status in enumerate(("pending", "completed", "completed"))
+    )
+    db.commit()
+
+
+def test_export_job_writes_a_downloadable_dump(client, seeded):
+    job = finished(client, submit(client, "export", format="csv"))
+    assert job["status"] == "completed", job
+    assert job["result"]["bytes"] == job["progress"]["bytes_written"] > 0
+
+    download = client.get(job["result"]["download"])
+    assert download.status_code == 200
+    assert download.headers["content-type"].startswith("text/csv")
+    assert download.content == client.get("/export", params={"format": "csv"}).content
+
+
+def test_analytics_job_warms_the_summary(client, seeded, query_budget):
+    job = finished(client, submit(client, "analytics", start_date="2024-05-01"))
+    assert job["result"] == {"total_tasks": 3, "completed_tasks": 2}
+    with query_budget(0):
+        assert client.get("/analytics/summary", params={"start_date": "2024-05-01"}).json()["total_tasks"] == 3
+
+
+def test_running_job_stops_at_its_next_checkpoint(client):
+    job_id = submit(client, "test-blocking")
+    assert started.acquire(timeout=5)
+    assert client.get("/health").status_code == 200  # the API isn't held up meanwhile
+
+    response = client.post(f"/jobs/{job_id}/cancel")
+    assert response.status_code == 200 and response.json()["cancel_requested"]
+    job = finished(client, job_id)
+    assert job["status"] == "cancelled" and job["progress"] == {"waiting": True}
+    assert client.post(f"/jobs/{job_id}/cancel").status_code == 400
+
+
+def test_concurrency_is_bounded_per_type(client):
+    first = submit(client, "test-blocking")
+    second = submit(client, "test-blocking")
+    assert started.acquire(timeout=5)
+    assert client.get(f"/jobs/{second}").json()["status"] == "queued"
+
+    # Cancelling a queued job takes effect immediately: it never starts
+    assert client.post(f"/jobs/{second}/cancel").json()["status"] == "cancelled"
+    release.set()
+    assert finished(client, first)["result"] == {"released": True}
+    assert not started.acquire(timeout=0.2)
+    assert [job["id"] for job in client.get("/jobs", params={"type": "test-blocking"}).json()][:2] == [second, first]
+
+
+def test_stopping_a_runner_leaves_other_runners_jobs_alone(client):
+    job_id = submit(client, "test-blocking")
+    assert started.acquire(timeout=5)
+
+    # Another process sharing the backend shuts down
+    other = jobs.Runner()
+    other._backend = jobs.runner.backend
+    other.stop(timeout=0)
+    assert not jobs.runner.backend.cancel_requested(job_id)
+
+    release.set()
+    assert finished(client, job_id)["status"] == "completed"
+
+
+def test_invalid_jobs_are_rejected(client):
+    assert client.post("/jobs", json={"type": "nope"}).status_code == 400
+    # Imports take an upload through POST /import/
+    assert client.post("/jobs", json={"type": "import", "params": {"path": "/etc/passwd"}}).status_code == 400
+    assert client.post("/jobs", json={"type": "export", "params": {"format": "xml"}}).status_code == 400
+    assert client.get("/jobs/nope").status_code == 404
+    assert client.get("/jobs/nope/download").status_code == 404
@@ -0,0 +1,189 @@
+import json
+import math
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+import importer
+import leadtime
+from leadtime import Sketch
+from models import Client, LeadTimeStat
+
+NOW = datetime.now(timezone.utc)
+TODAY = NOW.date()
+
+
+def stored_stats(db) -> dict:
+    db.expire_all()
+    return {
+        (stat.dimension, stat.key): (stat.completed, stat.sla_met, stat.sla_missed, Sketch.loads(stat.sketch).buckets)
+        for stat in db.scalars(select(LeadTimeStat))
+    }
+
+
+def new_task(client, client_id="C1", priority="low", sla_date=None, hours_ago=2):
+    task = client.post("/tasks/", json={
+        "client_id": client_id, "date": "2024-05-01", "description": "t", "status": "pending",
+        "priority": priority, "sla_date": sla_date and sla_date.isoformat(),
+    }).json()
+    created = (NOW - timedelta(hours=hours_ago)).isoformat()
+    client.put(f"/tasks/{task['id']}", json={"creation_timestamp": created})
+    return task["id"]
+
+
+@pytest.fixture
+def clients(db):
+    db.add_all([
+        Client(id="C1", name="Acme", company="Acme Inc", origin="web"),
+        Client(id="C2", name="Globex", company="Globex Corp", origin="email"),
+    ])
+    db.commit()
+
+
+def test_sketch_quantiles_are_within_alpha():
+    rng = random.Random(7)
+    values = sorted(rng.lognormvariate(10, 1.5) for _ in range(5000))
+    halves = Sketch(), Sketch()
+    for index, value in enumerate(values):
+        halves[index % 2].add(value)
+    sketch = Sketch.loads(halves[0].dumps())
+    sketch.merge(halves[1])
+
+    assert sketch.count == len(values)
+    for q in (0.5, 0.9, 0.99):
+        exact = values[math.ceil(q * len(values)) - 1]
+        assert sketch.quantile(q) == pytest.approx(exact, rel=leadtime.ALPHA * 1.01)
+
+
+def test_removing_samples_restores_the_sketch():
+    sketch = Sketch()
+    for value in (0.2, 60, 3600, 86400):
+        sketch.add(value)
+    removal = Sketch()
+    removal.add(3600, -1)
+    removal.add(0.2, -1)
+    sketch.merge(removal)
+    sketch.discard_empty()
+
+    expected = Sketch()
+    expected.add(60)
+    expected.add(86400)
+    assert sketch.dumps() == expected.dumps()
+    assert Sketch().quantile(0.5) is None
+
+
+def test_completing_tasks_updates_the_stats(client, db, clients):
+    met = new_task(client, sla_date=TODAY + timedelta(days=1), hours_ago=2)
+    missed = new_task(client, "C2", priority="high", sla_date=TODAY - timedelta(days=1), hours_ago=10)
+    new_task(client)
+    assert client.get("/analytics/lead-time").json() == {"by": "all", "groups": []}
+
+    for task_id in (met, missed):
+        assert client.put(f"/tasks/{task_id}", json={"status": "completed"}).status_code == 200
+
+    overall = client.get("/analytics/lead-time").json()["groups"]
+    assert len(overall) == 1
+    assert overall[0]["completed_tasks"] == 2
+    assert (overall[0]["sla_met"], overall[0]["sla_missed"], overall[0]["sla_hit_rate"]) == (1, 1, 50.0)
+    assert overall[0]["median_seconds"] == pytest.approx(2 * 3600, rel=0.02)
+    assert overall[0]["p99_seconds"] == pytest.approx(10 * 3600, rel=0.02)
+
+    by_priority = client.get("/analytics/lead-time", params={"by": "priority"}).json()["groups"]
+    assert [(group["key"], group["completed_tasks"]) for group in by_priority] == [("low", 1), ("high", 1)]
+    c2 = client.get("/analytics/lead-time", params={"by": "client", "key": "C2"}).json()["groups"]
+    assert [(group["key"], group["sla_hit_rate"]) for group in c2] == [("C2", 0.0)]
+    by_month = client.get("/analytics/lead-time", params={"by": "month"}).json()["groups"]
+    assert [(group["key"], group["completed_tasks"]) for group in by_month] == [(TODAY.strftime("%Y-%m"), 2)]
+
+    # Reopening a task takes it back out, deleting its client takes out the rest
+    client.put(f"/tasks/{met}", json={"status": "pending"})
+    assert client.get("/analytics/lead-time").json()["groups"][0]["completed_tasks"] == 1
+    client.delete("/clients/C2")
+    assert client.get("/analytics/lead-time").json()["groups"] == []
+    assert stored_stats(db) == {}
+
+
+def test_incremental_stats_match_a_rebuild(client, db, clients):
+    ids = [new_task(client, f"C{i % 2 + 1}", ("low", "high")[i % 2], TODAY + timedelta(days=i - 3), hours_ago=i + 1)
+           for i in range(6)]
+    client.post("/tasks/", json={
+        "client_id": "C1", "date": "2024-05-01", "description": "done", "status": "completed", "priority": "medium",
+    })
+    for task_id in ids[:4]:
+        client.put(f"/tasks/{task_id}", json={"status": "completed"})
+    client.put(f"/tasks/{ids[0]}", json={"priority": "medium", "sla_date": "2020-01-01"})
+    client.delete(f"/tasks/{ids[1]}")
+    client.post("/tasks/batch", json={"operations": [
+        {"op": "update", "id": ids[2], "changes": {"status": "pending"}},
+        {"op": "update", "id": ids[4], "changes": {"status": "completed", "completion_date": "2024-04-30"}},
+        {"op": "delete", "id": ids[3]},
+        {"op": "create", "task": {"client_id": "C2", "date": "2024-05-01", "description": "b", "status": "completed",
+                                  "priority": "low"}},
+    ]})
+
+    incremental = stored_stats(db)
+    assert incremental[("all", "")][:3] == (4, 1, 1)
+    assert incremental[("priority", "medium")][:3] == (2, 0, 1)
+    leadtime.rebuild(db)
+    db.commit()
+    assert stored_stats(db) == incremental
+
+
+def test_a_group_created_concurrently_is_added_to(client, db, clients, monkeypatch):
+    client.put(f"/tasks/{new_task(client)}", json={"status": "completed"})
+    # Another writer creates the groups' rows between this one's read and its insert
+    locked = leadtime._locked
+    reads = []
+
+    def late_read(session, groups):
+        reads.append(groups)
+        return {} if len(reads) == 1 else locked(session, groups)
+
+    monkeypatch.setattr(leadtime, "_locked", late_read)
+    assert client.put(f"/tasks/{new_task(client)}", json={"status": "completed"}).status_code == 200
+    assert len(reads) == 2
+    assert stored_stats(db)[("all", "")][0] == 2
+
+
+def import_records(tmp_path, records, mode="skip"):
+    path = tmp_path / "clients.ndjson"
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    job = importer.import_file(str(path), importer.new_job(mode, chunk_size=2))
+    assert job.status == "completed", job.error
+    return job
+
+
+def completed_task(id, day, sla_date="2024-05-03", priority="low"):
+    return {"id": id, "date": "2024-05-01", "description": "t", "status": "completed", "priority": priority,
+            "sla_date": sla_date, "completion_date": f"2024-05-{day:02}",
+            "creation_timestamp": "2024-05-01T00:00:00Z", "completion_timestamp": f"2024-05-{day:02}T00:00:00Z"}
+
+
+def client_record(id, tasks):
+    return {"id": id, "name": "Acme", "company": "Acme Inc", "origin": "web", "tasks": tasks}
+
+
+def test_imports_update_the_stats(client, db, tmp_path):
+    import_records(tmp_path, [client_record("C9", [completed_task(1, 2), completed_task(2, 4)])])
+
+    body = client.get("/analytics/lead-time", params={"by": "month", "key": "2024-05"}).json()
+    assert body["groups"][0]["completed_tasks"] == 2
+    assert body["groups"][0]["sla_hit_rate"] == 50.0
+    assert body["groups"][0]["median_seconds"] == pytest.approx(86400, rel=0.02)
+
+    # An upsert moves the changed tasks' samples, a replace drops the client's old tasks
+    reopened = {**completed_task(2, 4), "status": "pending", "completion_date": None, "completion_timestamp": None}
+    import_records(tmp_path, [
+        client_record("C9", [completed_task(1, 2, priority="high"), reopened, completed_task(3, 3)]),
+        client_record("C8", [completed_task(4, 5)]),
+    ], mode="upsert")
+    import_records(tmp_path, [client_record("C8", [completed_task(5, 2)])], mode="replace")
+
+    incremental = stored_stats(db)
+    assert incremental[("all", "")][:3] == (3, 3, 0)
+    assert ("priority", "low") in incremental and incremental[("priority", "high")][:3] == (1, 1, 0)
+    leadtime.rebuild(db)
+    db.commit()
+    assert stored_stats(db) == incremental
@@ -0,0 +1,51 @@
+import logging
+
+import metrics
+from models import Client
+
+
+def sample(name, **labels):
+    return metrics.registry.get_sample_value(name, labels) or 0
+
+
+def test_requests_are_counted_and_timed_per_route(client, db):
+    db.add(Client(id="C1", name="Acme", company="Acme Inc", origin="web"))
+    db.commit()
+    route = {"method": "GET", "route": "/clients/{client_id}"}
+    before = sample("http_requests_total", status="200", **route)
+    queries_before = sample("db_queries_per_request_sum", route=route["route"])
+    checkouts_before = sample("db_pool_checkout_wait_seconds_count", engine="async")
+
+    assert client.get("/clients/C1").status_code == 200
+    assert client.get("/clients/missing").status_code == 404
+
+    assert sample("http_requests_total", status="200", **route) == before + 1
+    assert sample("http_requests_total", status="404", **route) >= 1
+    assert sample("http_request_duration_seconds_count", **route) >= 2
+    assert sample("http_requests_in_progress", **route) == 0
+    assert sample("db_queries_per_request_sum", route=route["route"]) >= queries_before + 2
+    assert sample("db_pool_checkout_wait_seconds_count", engine="async") > checkouts_before
+    assert sample("db_query_duration_seconds_count", operation="SELECT") > 0
+
+
+def test_unknown_paths_share_one_label(client):
+    client.get("/no/such/path/1")
+    client.get("/no/such/path/2")
+    assert sample("http_requests_total", method="GET", route="unmatched", status="404") >= 2
+
+
+def test_metrics_endpoint_exposes_the_registry(client):
+    client.get("/health")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_requests_total{method="GET",route="/health",status="200"}' in response.text
+    assert "db_pool_checkout_wait_seconds_bucket" in response.text
+
+
+def test_slow_queries_are_logged_with_their_route(client, monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "SLOW_QUERY_MS", 0)
+    with caplog.at_level(logging.WARNING, logger="metrics"):
+        client.get("/tasks/", params={"status": "pending"})
+    slow = [record.getMessage() for record in caplog.records if record.name == "metrics"]
+    assert any("on /tasks/:" in message and "SELECT" in message for message in slow)
@@ -0,0 +1,147 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import create_engine, inspect
+
+import migrations
+from migrations import MIGRATIONS, Context, pending_migrations, prepare, upgrade
+
+# The schema before any of the migrations, with dates stored as free-form text
+ORIGINAL_SCHEMA = [
+    "CREATE TABLE clients (id VARCHAR PRIMARY KEY, name VARCHAR NOT NULL, company VARCHAR NOT NULL, "
+    "origin VARCHAR NOT NULL)",
+    "CREATE TABLE tasks (id INTEGER PRIMARY KEY, client_id VARCHAR REFERENCES clients (id), "
+    "date VARCHAR NOT NULL, description VARCHAR NOT NULL, status VARCHAR NOT NULL, priority VARCHAR NOT NULL)",
+]
+
+TASKS = [
+    (1, "2024-05-01", "completed"),
+    (2, "2024-05-02T10:00:00", "pending"),
+    (3, "02/05/2024", "pending"),
+    (4, "2024-05-04", "completed"),
+    (5, "2024-05-05", "pending"),
+]
+
+
+@pytest.fixture
+def legacy(tmp_path):
+    bind = create_engine(f"sqlite:///{tmp_path}/legacy.db")
+    with bind.begin() as conn:
+        for statement in ORIGINAL_SCHEMA:
+            conn.exec_driver_sql(statement)
+        conn.exec_driver_sql("INSERT INTO clients VALUES ('C1', 'Acme', 'Acme Inc', 'web')")
+        for row in TASKS:
+            conn.exec_driver_sql("INSERT INTO tasks VALUES (?, 'C1', ?, 't', ?, 'low')", row)
+    yield bind
+    bind.dispose()
+
+
+def test_upgrade_from_the_original_schema(legacy, capsys):
+    applied = upgrade(legacy, batch_size=2, target=4)
+    assert [m.version for m in applied] == [1, 2, 3, 4]
+
+    # Rows written between versions, in the formats the old code stored
+    with legacy.begin() as conn:
+        conn.exec_driver_sql(
+            "UPDATE tasks SET sla_date = '2024-05-09T18:00:00', "
+            "creation_timestamp = '2024-05-01T06:00:00-03:00' WHERE id = 2"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO comments (id, task_id, text, timestamp, revision) "
+            "VALUES ('x', 1, 'hi', '2024-05-02T10:00:00+02:00', 1)"
+        )
+
+    applied = upgrade(legacy, batch_size=2)
+    assert [m.version for m in applied] == [5, 6, 7]
+    output = capsys.readouterr().out
+    assert "tasks.dates: 5/5 rows" in output
+    assert "lead_time_stats: 2 completed tasks" in output
+    assert "Unparseable tasks.date of 3: '02/05/2024'" in output
+
+    with legacy.connect() as conn:
+        tasks = conn.exec_driver_sql(
+            "SELECT date, sla_date, creation_timestamp, completion_timestamp IS NOT NULL, revision "
+            "FROM tasks ORDER BY id"
+        ).all()
+        comment = conn.exec_driver_sql("SELECT timestamp FROM comments").scalar()
+        sync_revision = conn.exec_driver_sql("SELECT revision FROM sync_state").scalar()
+    assert [task[0] for task in tasks] == ["2024-05-01", "2024-05-02", tasks[2][2][:10], "2024-05-04", "2024-05-05"]
+    assert tasks[1][1:3] == ("2024-05-09", "2024-05-01 09:00:00.000000")
+    assert [task[3] for task in tasks] == [True, False, False, True, False]
+    assert {task[4] for task in tasks} == {1}
+    assert comment == "2024-05-02 08:00:00.000000"
+    assert sync_revision == 1
+
+    indexes = {index["name"] for index in inspect(legacy).get_indexes("tasks")}
+    assert {"ix_tasks_status_sla_date", "ix_tasks_open_sla_date", "ix_tasks_revision"} <= indexes
+    assert pending_migrations(legacy) == []
+    assert upgrade(legacy) == []
+
+
+def test_interrupted_backfill_resumes(legacy, monkeypatch, capsys):
+    save = Context.save
+
+    def killed_after_two_batches(self, conn, progress):
+        save(self, conn, progress)
+        if progress.get("tasks.revision", 0) >= 4:
+            raise RuntimeError("killed")
+
+    monkeypatch.setattr(Context, "save", killed_after_two_batches)
+    with pytest.raises(RuntimeError):
+        upgrade(legacy, batch_size=2)
+    monkeypatch.undo()
+
+    # The failed batch rolled back, its checkpoint with it
+    with legacy.connect() as conn:
+        revisions = conn.exec_driver_sql("SELECT revision FROM tasks ORDER BY id").scalars().all()
+        applied_at, checkpoint = conn.exec_driver_sql(
+            "SELECT applied_at, checkpoint FROM schema_migrations WHERE version = 4"
+        ).one()
+    assert revisions == [1, 1, 0, 0, 0]
+    assert applied_at is None and '"tasks.revision": 2' in checkpoint
+    assert [m.version for m in pending_migrations(legacy)] == [4, 5, 6, 7]
+
+    capsys.readouterr()
+    upgrade(legacy, batch_size=2)
+    output = capsys.readouterr().out
+    assert "Resuming 0004 add_revisions" in output
+    assert "tasks.revision: 3/3 rows" in output
+
+    with legacy.connect() as conn:
+        assert conn.exec_driver_sql("SELECT revision FROM tasks").scalars().all() == [1] * 5
+    assert pending_migrations(legacy) == []
+
+
+def test_startup_builds_new_databases_and_refuses_stale_ones(legacy, tmp_path):
+    with pytest.raises(RuntimeError, match="pending migrations"):
+        prepare(legacy)
+
+    new = create_engine(f"sqlite:///{tmp_path}/new.db")
+    try:
+        prepare(new)
+        assert pending_migrations(new) == []
+        assert inspect(new).has_table("comments")
+    finally:
+        new.dispose()
+
+
+def test_workers_starting_together_build_the_database_once(tmp_path):
+    # What serve.py's workers do on a fresh database: each has its own engine
+    binds = [create_engine(f"sqlite:///{tmp_path}/shared.db") for _ in range(4)]
+    try:
+        with ThreadPoolExecutor(len(binds)) as pool:
+            list(pool.map(prepare, binds))
+        assert pending_migrations(binds[0]) == []
+        with binds[0].connect() as conn:
+            versions = conn.exec_driver_sql("SELECT version FROM schema_migrations").scalars().all()
+        assert sorted(versions) == [m.version for m in MIGRATIONS]
+    finally:
+        for bind in binds:
+            bind.dispose()
+
+
+def test_versions_are_ordered():
+    versions = [m.version for m in MIGRATIONS]
+    assert versions == sorted(set(versions))
+    with pytest.raises(ValueError):
+        migrations.migration(versions[0])(lambda ctx: None)
@@ -0,0 +1,108 @@
+import logging
+
+import pytest
+
+import profiler
+from models import Client, Comment, Task
+from profiler import Profile
+
+
+@pytest.fixture
+def seeded(db):
+    for i in range(12):
+        client_id = f"C{i:02d}"
+        db.add(Client(id=client_id, name=f"Client {i}", company="Co", origin="web"))
+        for j in range(3):
+            task = Task(client_id=client_id, date="2024-05-01", description=f"task {j}", status="pending",
+                        priority="low", sla_date="2024-05-03")
+            task.comments = [Comment(id=f"{client_id}-{j}", text="note", timestamp="2024-05-01T00:00:00")]
+            db.add(task)
+    db.commit()
+
+
+@pytest.fixture
+def profiling(monkeypatch):
+    monkeypatch.setattr(profiler, "MODE", "header")
+
+
+def test_profiling_is_off_by_default(client, seeded):
+    response = client.get("/clients/C01", headers={profiler.HEADER: "1"})
+    assert profiler.HEADER not in response.headers
+    assert client.get("/debug/sql-profiles").status_code == 404
+
+
+def test_profiled_request_reports_its_statements(client, seeded, profiling):
+    assert profiler.HEADER not in client.get("/clients/C01").headers  # not asked for
+
+    response = client.get("/clients/C01", headers={profiler.HEADER: "1"})
+    summary = dict(part.split("=") for part in response.headers[profiler.HEADER].split("; "))
+    assert int(summary["queries"]) >= 1 and summary["suspects"] == "0"
+
+    profile = client.get(f"/debug/sql-profiles/{summary['id']}").json()
+    assert profile["path"] == "/clients/C01"
+    assert len(profile["statements"]) == int(summary["queries"])
+    assert profile["statements"][0]["statement"].startswith("SELECT")
+    # Traced through the async session's greenlet back to the code that awaited it
+    assert profile["statements"][0]["origin"].startswith("serialization.py:")
+    assert client.get("/debug/sql-profiles").json()[0]["id"] == summary["id"]
+
+
+def test_repeated_statements_are_flagged(caplog):
+    profile = Profile("GET", "/clients/")
+    profile.record("SELECT * FROM clients", 0.001, "main.py:10 in get_clients")
+    for i in range(6):
+        profile.record("SELECT * FROM tasks WHERE tasks.client_id = ?", 0.002, f"main.py:{20 + i % 2} in load")
+
+    suspects = profile.suspects(threshold=5)
+    assert [(s["count"], s["origins"]) for s in suspects] == [(6, ["main.py:20 in load", "main.py:21 in load"])]
+    assert "N+1 suspect, 6x" in profile.report()
+    assert profile.suspects(threshold=7) == []
+
+
+def test_suspects_are_logged(client, db, profiling, monkeypatch, caplog):
+    db.add(Client(id="C1", name="Acme", company="Co", origin="web"))
+    db.commit()
+    monkeypatch.setattr(profiler, "REPEAT_THRESHOLD", 1)
+    with caplog.at_level(logging.WARNING, logger="profiler"):
+        response = client.get("/clients/C1", headers={profiler.HEADER: "1"})
+    assert "suspects=0" not in response.headers[profiler.HEADER]
+    assert any("Possible N+1 on GET /clients/C1" in record.getMessage() for record in caplog.records)
+
+
+@pytest.mark.parametrize("method, path, budget", [
+    ("GET", "/clients/?limit=100", 3),
+    ("GET", "/clients/all", 3),
+    ("GET", "/clients/C01", 3),
+    ("GET", "/tasks/?status=pending&limit=100", 2),
+    ("GET", "/tasks/1/comments/", 2),
+    ("GET", "/comments/search?q=note", 2),
+    ("GET", "/sla/summary?today=2024-05-02", 2),
+    ("GET", "/sla/tasks?bucket=overdue&today=2024-05-05", 2),
+    ("GET", "/analytics/summary", 4),
+    ("GET", "/changes?since=0", 9),
+    ("GET", "/export", 6),
+])
+def test_read_endpoints_stay_within_their_query_budget(client, seeded, query_budget, method, path, budget):
+    with query_budget(budget):
+        assert client.request(method, path).status_code == 200
+
+
+def test_write_endpoints_stay_within_their_query_budget(client, seeded, query_budget):
+    # The revision bump, an existence check where needed, one statement with RETURNING
+    with query_budget(3):
+        task = client.post("/tasks/", json={
+            "client_id": "C01", "date": "2024-05-01", "description": "new", "status": "pending", "priority": "low",
+        }).json()
+    # Completing it also reads the task before and moves its lead-time stats (read, then one write);
+    # the first task completed in a group also creates the group's rows, then locks them
+    with query_budget(8):
+        client.put(f"/tasks/{task['id']}", json={"status": "completed"})
+    with query_budget(3):
+        client.post(f"/tasks/{task['id']}/comments/", json={"task_id": task["id"], "text": "hi"})
+    with query_budget(4):
+        assert client.put("/clients/C01", json={"name": "Renamed"}).status_code == 200
+    # The task is completed: its lead-time stats go too
+    with query_budget(7):
+        assert client.delete(f"/tasks/{task['id']}").status_code == 200
+    with query_budget(8):
+        assert client.delete("/clients/C02").status_code == 200
@@ -0,0 +1,65 @@
+import pytest
+
+import serialization
+from database import AsyncSessionLocal
+from main import select_clients_with_tasks
+from models import Client, Comment, Task
+
+TRICKY = 'quote " backslash \\ newline \n tab \t nul \x00 \x1f del \x7f é ü 中文 😀 \u2028 \u2029 </script>'
+
+
+@pytest.fixture
+def seeded(db):
+    # More clients than one IN batch, some without tasks, tasks without comments
+    for c in range(serialization.IN_BATCH_SIZE + 20):
+        db.add(Client(id=f"C{c:04}", name=f"name {c}", company=TRICKY if c == 3 else "Co", origin="web"))
+    task_id = 0
+    for c in range(0, serialization.IN_BATCH_SIZE + 20, 3):
+        for _ in range(3):
+            task_id += 1
+            db.add(Task(
+                id=task_id, client_id=f"C{c:04}", date="2024-05-01", description=TRICKY,
+                status="pending", priority="low",
+                sla_date="2024-05-10T12:00:00" if task_id % 2 else None,
+                creation_timestamp="2024-05-01T09:00:00.123456+00:00",
+            ))
+            if task_id % 4:
+                db.add(Comment(id=f"x{task_id}", task_id=task_id, text=TRICKY, timestamp="2024-05-02"))
+                db.add(Comment(id=f"y{task_id}", task_id=task_id, text="second", timestamp="2024-05-01",
+                               author=None))
+    db.commit()
+
+
+async def both_paths(limit=None):
+    async with AsyncSessionLocal() as db:
+        orm_query = select_clients_with_tasks().order_by(Client.id)
+        row_query = serialization.select_client_rows().order_by(Client.id)
+        if limit:
+            orm_query, row_query = orm_query.limit(limit), row_query.limit(limit)
+        clients = (await db.execute(orm_query)).scalars().all()
+        reference = serialization.dumps_validated(clients)
+    async with AsyncSessionLocal() as db:
+        fast = serialization.dumps(await serialization.load_client_documents(db, row_query))
+    return reference, fast
+
+
+def test_fast_path_is_byte_identical_to_pydantic(client, seeded):
+    reference, fast = client.portal.call(both_paths)
+    assert fast == reference
+
+    reference, fast = client.portal.call(both_paths, 10)
+    assert fast == reference
+
+
+def test_listing_endpoints_serve_the_fast_path(client, seeded):
+    reference, _ = client.portal.call(both_paths)
+    assert client.get("/clients/all").content == reference
+
+    first = client.get("/clients/", params={"limit": 10})
+    reference, _ = client.portal.call(both_paths, 10)
+    assert first.content == reference
+    assert first.headers["X-Next-Cursor"] == "C0009"
+
+
+def test_empty_database(client):
+    assert client.get("/clients/all").content == b"[]"
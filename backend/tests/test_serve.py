@@ -0,0 +1,108 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+from sqlalchemy import text
+
+import database
+import writer
+from cache import cache
+
+BACKEND = Path(__file__).resolve().parents[1]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_up(base: str, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        assert process.poll() is None, process.stdout.read()
+        try:
+            if httpx.get(f"{base}/health").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise AssertionError("serve.py didn't start")
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="serve.py needs os.fork")
+def test_workers_share_one_writer(tmp_path):
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{tmp_path}/serve.db"}
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    process = subprocess.Popen(
+        [sys.executable, str(BACKEND / "serve.py"), "--host", "127.0.0.1", "--port", str(port),
+         "--workers", "2", "--grace", "5", "--log-level", "warning"],
+        cwd=tmp_path, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+    )
+    try:
+        _wait_until_up(base, process)
+        # New connections each time, so the requests spread over both readers
+        for _ in range(4):
+            assert httpx.get(f"{base}/clients/").json() == []
+
+        for number in range(5):
+            response = httpx.post(f"{base}/clients/", json={
+                "id": f"C{number}", "name": "Acme", "company": "Acme Inc", "origin": "web",
+            })
+            assert response.status_code == 200, response.text
+            # Read-your-writes through whichever worker answers, despite the cached listing
+            assert len(httpx.get(f"{base}/clients/").json()) == number + 1
+
+        metrics = httpx.get(f"{base}/metrics").text
+        assert 'http_requests_total{method="POST",route="/clients/",status="200"} 5.0' in metrics
+    finally:
+        process.send_signal(signal.SIGTERM)
+        output = process.communicate(timeout=30)[0]
+    assert process.returncode == 0, output
+
+
+def test_reader_answers_503_without_a_writer(client, tmp_path):
+    writer.configure(writer.READER, str(tmp_path / "missing.sock"))
+    try:
+        response = client.post("/clients/", json={"id": "C1", "name": "A", "company": "B", "origin": "web"})
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+        assert client.get("/clients/").status_code == 200
+    finally:
+        writer.configure(writer.SINGLE)
+
+
+def write_from_another_process(number: int) -> None:
+    """A commit the session events of this process don't see"""
+    with database.engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO clients (id, name, company, origin, revision) VALUES (:id, 'Acme', 'Acme Inc', 'web', :n)"
+        ), {"id": f"C{number}", "n": number})
+        conn.execute(text("INSERT OR REPLACE INTO sync_state (id, revision) VALUES (1, :n)"), {"n": number})
+
+
+@pytest.mark.parametrize("role,fresh", [(writer.SINGLE, False), (writer.PEER, True)])
+def test_peers_see_the_other_workers_commits(client, role, fresh):
+    write_from_another_process(1)
+    writer.configure(role)
+    try:
+        first = client.get("/clients/")
+        assert len(first.json()) == 1
+        write_from_another_process(2)
+
+        second = client.get("/clients/", headers={"If-None-Match": first.headers["etag"]})
+        if fresh:
+            assert second.status_code == 200 and len(second.json()) == 2
+        else:  # a single process only sees its own commits
+            assert second.status_code == 304
+    finally:
+        writer.configure(writer.SINGLE)
+        cache.revision = None  # back to the ETags of a process that does its own writing
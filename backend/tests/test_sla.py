@@ -0,0 +1,147 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import text
+
+import database
+from cache import cache
+from models import Client, Task
+from pagination import encode_cursor
+import sla
+from sla import bucket_of, select_bucket, sla_summary
+
+TODAY = "2024-05-10"
+
+
+@pytest.fixture
+def seeded(db):
+    db.add(Client(id="C1", name="Acme", company="Acme Inc", origin="web"))
+    rows = [
+        # id, status, sla_date
+        (1, "pending", "2024-05-01"),
+        (2, "in progress", "2024-05-09T18:00:00"),
+        (3, "pending", "2024-05-10"),
+        (4, "awaiting client", "2024-05-10T23:59:00"),
+        (5, "pending", "2024-05-11"),
+        (6, "pending", "2024-05-17"),
+        (7, "pending", "2024-05-18"),
+        (8, "completed", "2024-05-01"),
+        (9, "pending", None),
+        (10, "completed", None),
+    ]
+    db.add_all(
+        Task(id=id, client_id="C1", date="2024-05-01", description=f"t{id}", status=status,
+             priority="low", sla_date=sla)
+        for id, status, sla in rows
+    )
+    db.commit()
+
+
+def bucket_ids(client, bucket, **params):
+    response = client.get("/sla/tasks", params={"bucket": bucket, "today": TODAY, **params})
+    assert response.status_code == 200, response.text
+    return [task["id"] for task in response.json()]
+
+
+def test_summary_counts_open_tasks_per_bucket(client, seeded):
+    response = client.get("/sla/summary", params={"today": TODAY})
+    assert response.status_code == 200
+    assert response.json() == {
+        "today": TODAY,
+        "overdue": 2,
+        "due_today": 2,
+        "due_this_week": 2,
+        "on_track": 1,
+        "no_sla": 1,
+    }
+
+
+def test_bucket_of_agrees_with_the_listings(client, seeded, db):
+    today = date.fromisoformat(TODAY)
+    for bucket in ("overdue", "due_today", "due_this_week", "on_track"):
+        for task_id in bucket_ids(client, bucket):
+            task = db.get(Task, task_id)
+            assert bucket_of(task.sla_date, task.status, today) == bucket
+    assert bucket_of("2024-05-01", "completed", today) is None
+    assert bucket_of(None, "pending", today) is None
+
+
+def test_bucket_listings(client, seeded):
+    assert bucket_ids(client, "overdue") == [1, 2]
+    assert bucket_ids(client, "due_today") == [3, 4]
+    assert bucket_ids(client, "due_this_week") == [5, 6]
+    assert bucket_ids(client, "on_track") == [7]
+    assert client.get("/sla/tasks", params={"bucket": "late"}).status_code == 422
+    assert client.get("/sla/tasks", params={"bucket": "overdue", "cursor": "nope"}).status_code == 400
+    for key in (["notadate", 1], ["2024-05-01", "x"], [20240501, 1]):
+        params = {"bucket": "overdue", "cursor": encode_cursor(*key)}
+        assert client.get("/sla/tasks", params=params).status_code == 400
+
+
+def test_cursor_pages_cover_the_bucket(client, seeded, db):
+    db.add_all(
+        Task(client_id="C1", date="2024-05-01", description="old", status="pending",
+             priority="low", sla_date=f"2024-04-{day:02d}")
+        for day in range(1, 11)
+    )
+    db.commit()
+    expected = bucket_ids(client, "overdue")
+    assert len(expected) == 12
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 5}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/sla/tasks", params={"bucket": "overdue", "today": TODAY, **params})
+        seen.extend(task["id"] for task in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert seen == expected
+
+
+def test_cached_results_are_dropped_by_task_writes(client, seeded):
+    assert client.get("/sla/summary", params={"today": TODAY}).json()["overdue"] == 2
+    assert bucket_ids(client, "overdue") == [1, 2]
+
+    response = client.put("/tasks/1", json={"status": "completed"})
+    assert response.status_code == 200
+
+    assert client.get("/sla/summary", params={"today": TODAY}).json()["overdue"] == 1
+    assert bucket_ids(client, "overdue") == [2]
+
+
+def test_a_summary_raced_by_a_write_is_not_cached(client, seeded, monkeypatch):
+    computed = []
+
+    async def racy_summary(db, today):
+        computed.append(today)
+        # A task write commits while the summary is being computed
+        cache.invalidate("tasks")
+        return await sla_summary(db, today)
+
+    monkeypatch.setattr(sla, "sla_summary", racy_summary)
+    for _ in range(2):
+        assert client.get("/sla/summary", params={"today": TODAY}).status_code == 200
+    assert len(computed) == 2
+
+
+def test_buckets_move_with_the_day(client, seeded):
+    summary = client.get("/sla/summary", params={"today": "2024-05-11"}).json()
+    assert summary["overdue"] == 4
+    assert summary["due_today"] == 1
+
+
+def query_plan(statement) -> str:
+    sql = str(statement.compile(dialect=database.engine.dialect, compile_kwargs={"literal_binds": True}))
+    with database.engine.connect() as conn:
+        return " | ".join(row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql)))
+
+
+@pytest.mark.parametrize("bucket", ["overdue", "due_today", "due_this_week", "on_track"])
+def test_buckets_scan_the_open_sla_index(bucket):
+    plan = query_plan(select_bucket(bucket, date(2024, 5, 10)).limit(100))
+    assert "ix_tasks_open_sla_date" in plan
+    assert "TEMP B-TREE" not in plan
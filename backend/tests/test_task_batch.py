@@ -0,0 +1,79 @@
+from models import Client, Comment, Task
+
+
+def seed(db, count=3, status="pending"):
+    db.add(Client(id="C1", name="Acme", company="Acme Inc", origin="web"))
+    db.add_all(
+        Task(id=i, client_id="C1", date="2024-05-01", description=f"t{i}", status=status, priority="low")
+        for i in range(1, count + 1)
+    )
+    db.commit()
+
+
+def run_batch(client, operations):
+    response = client.post("/tasks/batch", json={"operations": operations})
+    assert response.status_code == 200, response.text
+    return response.json()["results"]
+
+
+def test_mixed_batch_returns_per_item_results(client, db):
+    seed(db)
+    db.add(Comment(id="x", task_id=3, text="bye", timestamp="2024-05-01"))
+    db.commit()
+
+    results = run_batch(client, [
+        {"op": "create", "task": {"client_id": "C1", "date": "2024-05-02", "description": "new",
+                                  "status": "completed", "priority": "high"}},
+        {"op": "create", "task": {"client_id": "NOPE", "date": "2024-05-02", "description": "orphan",
+                                  "status": "pending", "priority": "high"}},
+        {"op": "update", "id": 1, "changes": {"description": "renamed"}},
+        {"op": "delete", "id": 3},
+        {"op": "update", "id": 3, "changes": {"status": "pending"}},
+        {"op": "delete", "id": 999},
+    ])
+
+    assert [r["ok"] for r in results] == [True, False, True, True, False, False]
+    assert results[0]["task"]["completion_date"] is not None
+    assert results[0]["task"]["completion_timestamp"] == results[0]["task"]["creation_timestamp"]
+    assert results[1]["error"] == "Client not found"
+    assert results[2]["task"]["description"] == "renamed"
+    assert results[4]["error"] == "Task not found"
+
+    assert db.get(Task, 3) is None
+    assert db.query(Comment).count() == 0
+    assert db.query(Task).count() == 3
+
+
+def test_completion_rules_match_update_task(client, db):
+    seed(db, count=2)
+    results = run_batch(client, [{"op": "update", "id": 1, "changes": {"status": "completed"}}])
+    task = results[0]["task"]
+    assert task["completion_date"] and task["completion_timestamp"]
+
+    # Reopening clears the stamps unless a completion_date is supplied
+    results = run_batch(client, [
+        {"op": "update", "id": 1, "changes": {"status": "pending"}},
+        {"op": "update", "id": 2, "changes": {"status": "completed"}},
+        {"op": "update", "id": 2, "changes": {"status": "in progress", "completion_date": "2024-01-01"}},
+    ])
+    assert results[0]["task"]["completion_date"] is None
+    assert results[0]["task"]["completion_timestamp"] is None
+    assert results[2]["task"]["completion_date"] == "2024-01-01"
+
+
+def test_marking_many_tasks_completed_is_one_update(client, db, count_queries):
+    seed(db, count=500)
+    operations = [{"op": "update", "id": i, "changes": {"status": "completed"}} for i in range(1, 501)]
+
+    with count_queries() as statements:
+        results = run_batch(client, operations)
+
+    assert all(r["ok"] for r in results)
+    updates = [s for s in statements if s.lstrip().upper().startswith("UPDATE TASKS")]
+    assert len(updates) == 1
+    assert db.query(Task).filter(Task.status == "completed", Task.completion_timestamp.isnot(None)).count() == 500
+
+
+def test_batch_size_is_bounded(client):
+    operations = [{"op": "delete", "id": i} for i in range(5001)]
+    assert client.post("/tasks/batch", json={"operations": operations}).status_code == 422
@@ -0,0 +1,113 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import text
+
+import database
+from pagination import encode_cursor
+from models import Client, Task
+from tasks import select_tasks
+
+
+@pytest.fixture
+def seeded(db):
+    db.add_all([
+        Client(id="C1", name="Acme", company="Acme Inc", origin="web"),
+        Client(id="C2", name="Globex", company="Globex Corp", origin="email"),
+    ])
+    rows = [
+        # id, client, date, status, priority, sla_date
+        (1, "C1", "2024-05-01", "pending", "high", "2024-05-10"),
+        (2, "C1", "2024-05-02T09:30:00", "completed", "low", None),
+        (3, "C2", "2024-05-03", "pending", "low", "2024-05-05"),
+        (4, "C2", "2024-05-04", "in progress", "high", "2024-05-20"),
+        (5, "C1", "2024-05-05", "pending", "medium", None),
+    ]
+    db.add_all(
+        Task(id=id, client_id=client_id, date=day, description=f"t{id}", status=status,
+             priority=priority, sla_date=sla)
+        for id, client_id, day, status, priority, sla in rows
+    )
+    db.commit()
+
+
+def ids(client, **params):
+    response = client.get("/tasks/", params=params)
+    assert response.status_code == 200, response.text
+    return [task["id"] for task in response.json()]
+
+
+def test_filters(client, seeded):
+    assert ids(client, status=["pending", "in progress"], sort="id", order="asc") == [1, 3, 4, 5]
+    assert ids(client, priority="high", client_id="C2") == [4]
+    assert ids(client, date_from="2024-05-02", date_to="2024-05-03") == [3, 2]
+    assert ids(client, sla_to="2024-05-10", sort="sla_date", order="asc") == [3, 1]
+    assert ids(client, completed="true") == [2]
+    assert ids(client, completed="false", sort="id", order="asc") == [1, 3, 4, 5]
+
+
+def test_nulls_sort_first_ascending_and_last_descending(client, seeded):
+    assert ids(client, sort="sla_date", order="asc") == [2, 5, 3, 1, 4]
+    assert ids(client, sort="sla_date", order="desc") == [4, 1, 3, 5, 2]
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_cursor_pages_match_the_unpaged_order(client, seeded, order):
+    expected = ids(client, sort="sla_date", order=order)
+
+    seen, cursor = [], None
+    while True:
+        params = {"sort": "sla_date", "order": order, "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/tasks/", params=params)
+        seen.extend(task["id"] for task in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert seen == expected
+
+
+def test_invalid_input(client):
+    assert client.get("/tasks/", params={"cursor": "nope"}).status_code == 400
+    assert client.get("/tasks/", params={"date_from": "2024-05-02", "date_to": "2024-05-01"}).status_code == 400
+    assert client.get("/tasks/", params={"sort": "description"}).status_code == 422
+
+
+@pytest.mark.parametrize("sort,key", [
+    ("date", ["notadate", 1]),
+    ("date", ["2024-05-01", "1"]),
+    ("date", ["2024-05-01", None]),
+    ("creation_timestamp", [5, 1]),
+    ("id", ["1", 1]),
+    ("id", [True, 1]),
+])
+def test_cursor_keys_must_match_the_sort_column(client, seeded, sort, key):
+    response = client.get("/tasks/", params={"sort": sort, "cursor": encode_cursor(*key)})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def query_plan(**filters) -> str:
+    stmt = select_tasks(**filters).limit(100)
+    sql = str(stmt.compile(dialect=database.engine.dialect, compile_kwargs={"literal_binds": True}))
+    with database.engine.connect() as conn:
+        return " | ".join(row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql)))
+
+
+def test_status_and_sla_sort_use_the_composite_index():
+    plan = query_plan(status=["pending"], sort="sla_date", order="asc")
+    assert "ix_tasks_status_sla_date" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_client_and_status_use_the_composite_index():
+    plan = query_plan(client_id=["C1"], status=["pending"], sort="id")
+    assert "ix_tasks_client_id_status" in plan
+
+
+def test_date_range_sorted_by_date_uses_the_date_index():
+    plan = query_plan(date_from=date(2024, 5, 1), sort="date")
+    assert "ix_tasks_date" in plan
+    assert "TEMP B-TREE" not in plan
@@ -0,0 +1,197 @@
+import asyncio
+from datetime import date, datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event, select, update
+
+import database
+
+import profiler
+import tasks
+import writes
+from cache import cache
+from models import Client, Comment, SyncState, Task
+
+
+def seed(db, status="pending"):
+    db.add(Client(id="C1", name="Acme", company="Acme Inc", origin="web"))
+    db.add_all(
+        Task(id=i, client_id="C1", date="2024-05-01", description=f"t{i}", status=status, priority="low")
+        for i in range(1, 4)
+    )
+    db.commit()
+
+
+def revision(db):
+    db.expire_all()
+    return db.scalar(select(SyncState.revision))
+
+
+def rename(task_id, name):
+    async def write(db):
+        row = await writes.update_row(db, Task, task_id, {"description": name})
+        if row is None:
+            raise HTTPException(status_code=404, detail="Task not found")
+        return row.description
+    return write
+
+
+def test_concurrent_writes_share_one_commit(db):
+    seed(db)
+    before = revision(db)
+    committer = writes.GroupCommitter()
+
+    async def burst():
+        return await asyncio.gather(*(committer.run(rename(i, f"renamed {i}")) for i in (1, 2, 3)))
+
+    assert asyncio.run(burst()) == ["renamed 1", "renamed 2", "renamed 3"]
+    assert revision(db) == before + 1
+    assert {task.revision for task in db.scalars(select(Task))} == {before + 1}
+
+
+def test_each_write_counts_for_its_own_request(db):
+    seed(db)
+    committer = writes.GroupCommitter()
+
+    async def request(task_id):
+        # As ProfilerMiddleware does, in the request's own task
+        profile = profiler.Profile("PUT", f"/tasks/{task_id}")
+        profiler._current.set(profile)
+        await committer.run(rename(task_id, "renamed"))
+        return [statement["statement"].split()[0:2] for statement in profile.statements]
+
+    async def burst():
+        return await asyncio.gather(*(request(i) for i in (1, 2, 3)))
+
+    leader, *others = asyncio.run(burst())
+    # The first request also pays for the revision the group shares
+    assert leader.count(["UPDATE", "tasks"]) == 1 and ["UPDATE", "sync_state"] in leader
+    for statements in others:
+        assert statements.count(["UPDATE", "tasks"]) == 1 and ["UPDATE", "sync_state"] not in statements
+
+
+def test_a_failing_write_fails_alone(db):
+    seed(db)
+    cache.set("listing", "stale", tables=("tasks",))
+    committer = writes.GroupCommitter()
+
+    async def duplicate(session):
+        await writes.insert_row(session, Comment, {"id": "c1", "task_id": 1, "text": "again",
+                                                   "timestamp": datetime.now(timezone.utc)})
+
+    async def first_comment(session):
+        await writes.insert_row(session, Comment, {"id": "c1", "task_id": 1, "text": "first",
+                                                   "timestamp": datetime.now(timezone.utc)})
+
+    async def burst():
+        return await asyncio.gather(
+            committer.run(first_comment), committer.run(rename(2, "kept")), committer.run(rename(99, "missing")),
+            committer.run(duplicate), committer.run(rename(3, "kept too")),
+            return_exceptions=True,
+        )
+
+    first, kept, missing, duplicated, kept_too = asyncio.run(burst())
+    assert first is None and kept == "kept" and kept_too == "kept too"
+    assert isinstance(missing, HTTPException) and missing.status_code == 404
+    assert "UNIQUE" in str(duplicated)
+
+    db.expire_all()
+    assert [c.text for c in db.scalars(select(Comment))] == ["first"]
+    assert db.get(Task, 2).description == "kept"
+    # The successful writes still invalidate the cache
+    assert cache.get("listing") is None
+
+
+def test_endpoints_map_write_errors(client, db):
+    seed(db)
+    assert client.post("/clients-only/", json={"id": "C1", "name": "x", "company": "y", "origin": "z"}).json() == {
+        "detail": "Client with this ID already exists",
+    }
+    assert client.delete("/comments/nope").status_code == 404
+    assert client.put("/clients/nope", json={"name": "x"}).status_code == 404
+
+
+@pytest.mark.parametrize("stored", ["pending", "completed"])
+@pytest.mark.parametrize("sent", [
+    {"status": "completed"},
+    {"status": "pending"},
+    {"status": "pending", "completion_date": date(2024, 5, 9)},
+    {"status": "completed", "completion_date": date(2024, 5, 9)},
+    {"description": "no status"},
+])
+def test_completion_values_match_completion_changes(db, stored, sent):
+    db.add(Client(id="C1", name="Acme", company="Acme Inc", origin="web"))
+    db.add(Task(id=1, client_id="C1", date="2024-05-01", description="t", status=stored, priority="low",
+                completion_date=date(2024, 5, 2) if stored == "completed" else None,
+                completion_timestamp=datetime(2024, 5, 2, 9, tzinfo=timezone.utc) if stored == "completed" else None))
+    db.commit()
+    now = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+
+    expected = {"completion_date": db.get(Task, 1).completion_date,
+                "completion_timestamp": db.get(Task, 1).completion_timestamp}
+    expected.update({key: value for key, value in sent.items() if key in expected})
+    expected.update(tasks.completion_changes(stored, sent, now))
+
+    db.execute(update(Task).where(Task.id == 1).values({**sent, **tasks.completion_values(sent, now)}))
+    db.commit()
+    db.expire_all()
+    task = db.get(Task, 1)
+    assert task.completion_date == expected["completion_date"]
+    assert (task.completion_timestamp and task.completion_timestamp.replace(tzinfo=timezone.utc)) == (
+        expected["completion_timestamp"] and expected["completion_timestamp"].replace(tzinfo=timezone.utc)
+    )
+
+
+def test_waiting_writes_fail_if_the_flusher_stops():
+    def broken_sessions():
+        raise RuntimeError("no database")
+
+    committer = writes.GroupCommitter(session_factory=broken_sessions)
+
+    async def burst():
+        return await asyncio.gather(*(committer.run(rename(i, "x")) for i in (1, 2)), return_exceptions=True)
+
+    errors = asyncio.run(asyncio.wait_for(burst(), timeout=5))
+    assert [(type(error), error.status_code) for error in errors] == [(HTTPException, 503)] * 2
+
+
+@pytest.fixture
+def foreign_keys():
+    """Enforce foreign keys on the API's SQLite connections while checked out, as PostgreSQL does"""
+    def pragma(value):
+        def set_foreign_keys(dbapi_connection, *args):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"PRAGMA foreign_keys = {value}")
+            cursor.close()
+        return set_foreign_keys
+
+    engine = database.async_engine.sync_engine
+    hooks = {"checkout": pragma("ON"), "checkin": pragma("OFF")}
+    for name, hook in hooks.items():
+        event.listen(engine, name, hook)
+    yield
+    for name, hook in hooks.items():
+        event.remove(engine, name, hook)
+
+
+def test_deletes_respect_foreign_keys(client, foreign_keys):
+    client.post("/clients/", json={"id": "C1", "name": "Acme", "company": "Acme Inc", "origin": "web"})
+    task_ids = [
+        client.post("/tasks/", json={
+            "client_id": "C1", "date": "2024-05-01", "description": f"t{i}", "status": status, "priority": "low",
+        }).json()["id"]
+        for i, status in enumerate(("pending", "completed"))
+    ]
+    for task_id in task_ids:
+        assert client.post(f"/tasks/{task_id}/comments/", json={"task_id": task_id, "text": "hi"}).status_code == 200
+
+    response = client.delete(f"/tasks/{task_ids[0]}")
+    assert response.status_code == 200, response.text
+    assert len(response.json()["comments"]) == 1
+    assert client.delete(f"/tasks/{task_ids[0]}").status_code == 404
+
+    response = client.delete("/clients/C1")
+    assert response.status_code == 200, response.text
+    assert client.get("/tasks/", params={"client_id": "C1"}).json() == []
+    assert client.delete("/clients/C1").status_code == 404
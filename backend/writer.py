@@ -0,0 +1,196 @@
+"""
+Single-writer routing for multi-worker SQLite deployments.
+
+SQLite lets one connection write at a time.  With several worker processes
+all writing, each write waits on the file lock (busy_timeout) and under load
+they fail with "database is locked".  serve.py therefore starts one writer
+process, listening on a Unix socket, next to N reader processes listening on
+the public port.  In a reader, `WriterMiddleware` passes on to the writer:
+
+    POST / PUT / PATCH / DELETE     every write
+    /jobs, /import*                 job state lives in the process running them
+    /events                         the writer sees every commit it publishes
+
+and serves every other request itself.  Requests and responses are streamed
+both ways, so uploads, exports and event streams aren't buffered.  If the
+writer can't be reached the reader answers 503 with Retry-After.
+
+Readers don't see the writer's commits through session events, so before a
+local request they read the sync revision (see changes.py) and drop their
+query cache when it moved: a client reading after its own write, through any
+worker, never gets a stale cached response.
+
+On PostgreSQL every worker is a peer: it serves everything itself, writes
+included, and checks the sync revision before every request in the same
+way, since the other peers commit too.  Their jobs must then live in a
+shared backend (JOBS_BACKEND=redis), which serve.py requires.
+
+Outside serve.py (ROLE "single") the middleware does nothing.
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+
+import changes
+from cache import cache
+from database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+# httpx logs every forwarded request at INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+SINGLE, READER, WRITER, PEER = "single", "reader", "writer", "peer"
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+FORWARDED_PREFIXES = ("/jobs", "/import", "/events")
+# Hop-by-hop headers (RFC 7230 section 6.1) aren't forwarded in either direction
+HOP_BY_HOP = {
+    b"connection", b"keep-alive", b"proxy-authenticate", b"proxy-authorization",
+    b"te", b"trailer", b"transfer-encoding", b"upgrade",
+}
+CONNECT_TIMEOUT = 5.0
+RETRY_AFTER = 1
+
+ROLE = SINGLE
+SOCKET_PATH: Optional[str] = None
+_client: Optional[httpx.AsyncClient] = None
+
+
+def configure(role: str, socket_path: Optional[str] = None) -> None:
+    """Set this process's role; called by serve.py in each worker before it serves"""
+    global ROLE, SOCKET_PATH, _client
+    if role not in (SINGLE, READER, WRITER, PEER):
+        raise ValueError(f"Unknown worker role {role!r}")
+    if role == READER and not socket_path:
+        raise ValueError("A reader needs the writer's socket path")
+    ROLE, SOCKET_PATH, _client = role, socket_path, None
+
+
+def forwarded(scope) -> bool:
+    """Whether a reader passes this request on to the writer"""
+    return scope["method"] in WRITE_METHODS or scope["path"].startswith(FORWARDED_PREFIXES)
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(uds=SOCKET_PATH),
+            # Event streams and long exports stay open; only connecting is bounded
+            timeout=httpx.Timeout(None, connect=CONNECT_TIMEOUT),
+        )
+    return _client
+
+
+async def sync_cache() -> None:
+    """Drop cached results if another process committed since the last check"""
+    async with AsyncSessionLocal() as db:
+        cache.observe_revision(await changes.current_revision(db))
+
+
+def _request_headers(scope) -> list:
+    return [(key, value) for key, value in scope["headers"] if key not in HOP_BY_HOP]
+
+
+def _has_body(scope) -> bool:
+    return any(key in (b"content-length", b"transfer-encoding") for key, _ in scope["headers"])
+
+
+class WriterMiddleware:
+    """In a reader, forward writes (and the endpoints that must run in the writer) to the writer;
+    in a reader or a peer, drop the cache other processes' commits made stale"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if ROLE not in (READER, PEER) or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if ROLE == PEER or not forwarded(scope):
+            await sync_cache()
+            return await self.app(scope, receive, send)
+        await self._forward(scope, receive, send)
+
+    async def _forward(self, scope, receive, send):
+        async def request_body():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                yield message.get("body", b"")
+                if not message.get("more_body"):
+                    return
+
+        target = scope.get("raw_path") or scope["path"].encode()
+        if scope.get("query_string"):
+            target += b"?" + scope["query_string"]
+        client = _get_client()
+        request = client.build_request(
+            scope["method"],
+            httpx.URL(scheme="http", host="writer", raw_path=target),
+            headers=_request_headers(scope),
+            content=request_body() if _has_body(scope) else None,
+        )
+        try:
+            response = await client.send(request, stream=True)
+        except httpx.TransportError as e:
+            logger.warning("Writer unavailable for %s %s: %s", scope["method"], scope["path"], e)
+            return await _unavailable(send)
+
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [(key, value) for key, value in response.headers.raw if key.lower() not in HOP_BY_HOP],
+            })
+            # The request body has been read by now, so receive() only reports the client leaving
+            relay = asyncio.ensure_future(_relay_body(response, send))
+            disconnect = asyncio.ensure_future(_wait_for_disconnect(receive))
+            try:
+                done, _ = await asyncio.wait((relay, disconnect), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in (relay, disconnect):
+                    task.cancel()
+                await asyncio.gather(relay, disconnect, return_exceptions=True)
+            if relay in done:
+                relay.result()
+        finally:
+            await response.aclose()
+
+
+async def _relay_body(response: httpx.Response, send) -> None:
+    async for chunk in response.aiter_raw():
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _wait_for_disconnect(receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _unavailable(send) -> None:
+    body = b'{"detail":"Writer unavailable, retry later"}'
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(RETRY_AFTER).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    try:
+        yield
+    finally:
+        if _client is not None:
+            await _client.aclose()
@@ -0,0 +1,220 @@
+"""
+Group commit for the single-row write endpoints.
+
+An endpoint hands its write to `run()` as a coroutine function of a session.
+Writes that arrive while a group is being committed queue up and run
+together as the next group: one transaction, one revision (changes.py) and
+one commit for all of them, each in a SAVEPOINT of its own.  A write that
+fails (a 404, a duplicate id) is rolled back to its savepoint and its error
+is raised in its own request only; if the commit itself fails, the group's
+writes are retried one by one.  The writes of a process thus take turns on
+one connection instead of racing each other for SQLite's write lock, and a
+burst of N writes costs a few commits instead of N.
+
+A write that arrives while nothing is committing runs right away.
+GROUP_COMMIT_WINDOW_MS makes every group wait that long for company first,
+trading latency for larger groups; GROUP_COMMIT_MAX_SIZE bounds a group.
+
+The helpers below write one row with a single INSERT / UPDATE / DELETE ...
+RETURNING instead of loading it before and reloading it after, and report
+it to events.py, which would otherwise only see a bulk statement.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import copy
+import logging
+import os
+from collections import deque
+from typing import Any, Awaitable, Callable, List, Optional
+
+from fastapi import HTTPException
+from prometheus_client import Histogram
+from sqlalchemy import delete, insert, inspect, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+import changes
+import events
+import metrics
+from database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SECONDS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "0")) / 1000
+MAX_GROUP_SIZE = int(os.getenv("GROUP_COMMIT_MAX_SIZE", "64"))
+
+GROUP_SIZE = Histogram(
+    "db_group_commit_size", "Writes committed together", registry=metrics.registry,
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+
+Write = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class GroupCommitter:
+    """Queues writes and commits them in groups, one group at a time"""
+
+    def __init__(self, session_factory=AsyncSessionLocal, window: float = WINDOW_SECONDS,
+                 max_size: int = MAX_GROUP_SIZE):
+        self.session_factory = session_factory
+        self.window = window
+        self.max_size = max_size
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: deque = deque()
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def run(self, write: Write) -> Any:
+        """Run `write` in the next group; return its result once the group has committed"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # A new event loop (each TestClient starts one): nothing queued on the old one survived it
+            self._loop, self._queue, self._flusher = loop, deque(), None
+        future = loop.create_future()
+        # The write runs in its request's context, so its statements count for that
+        # request's metrics and SQL profile (metrics.py, profiler.py)
+        self._queue.append((write, future, contextvars.copy_context()))
+        if self._flusher is None:
+            # ...and the flusher in none, so it doesn't carry the first request's along
+            self._flusher = contextvars.Context().run(loop.create_task, self._flush())
+        return await future
+
+    async def _flush(self) -> None:
+        group = []
+        try:
+            # Writes issued in the same loop iteration join the first group either way
+            await asyncio.sleep(self.window)
+            while self._queue:
+                group = [self._queue.popleft() for _ in range(min(self.max_size, len(self._queue)))]
+                # Requests that went away before their turn
+                group = [item for item in group if not item[1].done()]
+                if group:
+                    await self._commit(group)
+                group = []
+        except BaseException as e:
+            # Nothing else would answer the writes still waiting
+            logger.error("Group commit stopped: %r", e)
+            for _, future, _ in (*group, *self._queue):
+                if not future.done():
+                    future.set_exception(HTTPException(status_code=503, detail="Write not committed, retry later"))
+            self._queue.clear()
+            if not isinstance(e, Exception):
+                raise  # cancelled
+        finally:
+            self._flusher = None
+
+    async def _commit(self, group: List[tuple]) -> None:
+        outcomes = []
+        # The statements the group shares are the first request's: it waits for the commit
+        leader = group[0][2]
+        async with self.session_factory() as db:
+            session = db.sync_session
+            try:
+                # Also opens the transaction: pysqlite doesn't begin one for a SAVEPOINT
+                await _in_context(leader, db.run_sync(changes.allocate_revision))
+                for write, future, context in group:
+                    # The session hooks of changes.py, cache.py and events.py ignore savepoints:
+                    # what a failed write left in session.info is dropped here
+                    saved = {key: copy.copy(value) for key, value in session.info.items()}
+                    try:
+                        # A write on its own is rolled back with the transaction
+                        async with db.begin_nested() if len(group) > 1 else contextlib.nullcontext():
+                            result = await _in_context(context, write(db))
+                    except Exception as e:
+                        session.info.clear()
+                        session.info.update(saved)
+                        outcomes.append((future, None, e))
+                    else:
+                        outcomes.append((future, result, None))
+                if any(error is None for _, _, error in outcomes):
+                    await _in_context(leader, db.commit())
+                else:
+                    await db.rollback()
+            except Exception as e:
+                await db.rollback()
+                if len(group) > 1:
+                    logger.warning("Group commit of %d writes failed (%s), retrying them one by one", len(group), e)
+                    for item in group:
+                        await self._commit([item])
+                    return
+                outcomes = [(future, None, e) for _, future, _ in group]
+
+        GROUP_SIZE.observe(len(group))
+        for future, result, error in outcomes:
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+def _in_context(context: contextvars.Context, coroutine) -> asyncio.Task:
+    """Run a coroutine as a task in (a copy of) `context`"""
+    return context.run(asyncio.get_running_loop().create_task, coroutine)
+
+
+committer = GroupCommitter()
+
+
+async def run(write: Write) -> Any:
+    """Run a write through the group committer; database errors become a 400, as elsewhere in the API"""
+    try:
+        return await committer.run(write)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# ======================================================================
+# SINGLE-STATEMENT WRITES
+# ======================================================================
+
+def _returning(statement, model, options):
+    return statement.returning(model).options(*options).execution_options(
+        synchronize_session=False, **{events.ROW_EVENTS: True},
+    )
+
+
+async def insert_row(db: AsyncSession, model, values: dict):
+    """INSERT ... RETURNING one row; its collections start out empty"""
+    row = (await db.execute(_returning(insert(model).values(**values), model, ()))).scalars().one()
+    for relationship in inspect(model).relationships:
+        if relationship.uselist:
+            set_committed_value(row, relationship.key, [])
+    events.collect_returned(db.sync_session, row, "created")
+    return row
+
+
+async def update_row(db: AsyncSession, model, row_id, values: dict, *options, previous=None):
+    """UPDATE ... RETURNING the row with this id, or None if there is none.
+
+    `previous` is the row as the caller already read it, if it did; it needs
+    the columns of events.previous_columns().
+    """
+    columns = events.previous_columns(model)
+    if previous is not None:
+        previous = {column: getattr(previous, column) for column in columns}
+    elif columns:
+        found = (await db.execute(
+            select(*(getattr(model, column) for column in columns)).where(model.id == row_id)
+        )).first()
+        if found is None:
+            return None
+        previous = found._asdict()
+
+    statement = _returning(update(model).where(model.id == row_id).values(**values), model, options)
+    row = (await db.execute(statement)).scalars().first()
+    if row is not None:
+        events.collect_returned(db.sync_session, row, "updated", previous)
+    return row
+
+
+async def delete_rows(db: AsyncSession, model, *where) -> list:
+    """DELETE ... RETURNING the rows matching `where`"""
+    rows = (await db.execute(_returning(delete(model).where(*where), model, ()))).scalars().all()
+    for row in rows:
+        events.collect_returned(db.sync_session, row, "deleted")
+    return rows
@@ -0,0 +1,43 @@
+import { useEffect, useRef } from 'react';
+import { API_BASE_URL } from '@/services/api';
+
+export interface ServerEvent {
+  type: string;
+  revision?: number;
+  data?: any;
+}
+
+const EVENT_TYPES = [
+  'client.created', 'client.updated', 'client.deleted',
+  'task.created', 'task.updated', 'task.deleted',
+  'comment.created', 'comment.updated', 'comment.deleted',
+  'sla.changed', 'sync', 'resync',
+];
+
+// Subscribes to the backend's /events stream. EventSource reconnects on its
+// own and sends Last-Event-ID, so a gap shows up as a 'resync' event.
+export const useEventStream = (onEvent: (event: ServerEvent) => void) => {
+  const handler = useRef(onEvent);
+  handler.current = onEvent;
+
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') {
+      return;
+    }
+
+    const source = new EventSource(`${API_BASE_URL}/events`);
+    const listener = (message: MessageEvent) => {
+      try {
+        handler.current(JSON.parse(message.data));
+      } catch (error) {
+        // Ignore malformed events
+      }
+    };
+    EVENT_TYPES.forEach(type => source.addEventListener(type, listener));
+
+    return () => {
+      EVENT_TYPES.forEach(type => source.removeEventListener(type, listener));
+      source.close();
+    };
+  }, []);
+};
@@ -1,18 +1,19 @@
 'use client'
 
 import type { ReactNode } from 'react';
-import { useState, useEffect, createContext, useContext } from 'react';
+import { useState, useEffect, useRef, createContext, useContext } from 'react';
 import { Geist, Geist_Mono } from "next/font/google";
 import Navbar from './components/Navbar';
 import { Client } from '@/types/types';
 import { api } from '@/services/api';
-import { NotificationProvider } from './contexts/NotificationContext';
+import { NotificationProvider, useNotifications } from './contexts/NotificationContext';
 import { ScrollProvider } from './contexts/ScrollContext';
 import { ThemeProvider, useTheme } from './contexts/ThemeContext';
 import { DragDropProvider } from './contexts/DragDropContext';
 import { TimezoneProvider } from './contexts/TimezoneContext';
 import { AuthProvider } from './contexts/AuthContext';
 import NotificationToast from './components/NotificationToast';
+import { useEventStream } from './hooks/useEventStream';
 import "./globals.css";
 
 const geistSans = Geist({
@@ -58,6 +59,22 @@ function ThemeSync({ children, darkMode, toggleDarkMode, clients, refreshClients
   isLoading: boolean;
 }) {
   const { isDarkMode, toggleDarkMode: toggleThemeMode } = useTheme();
+  const { addNotification } = useNotifications();
+  const refreshTimer = useRef<ReturnType<typeof setTimeout>>();
+
+  // Refresh when the server pushes a change instead of polling; a burst of
+  // events (e.g. an import) coalesces into one fetch
+  useEventStream(event => {
+    if (event.type === 'sla.changed' && event.data?.from && event.data?.to === 'overdue') {
+      addNotification({
+        type: 'error',
+        title: 'SLA overdue',
+        message: `Task #${event.data.task_id} is now overdue`,
+      });
+    }
+    clearTimeout(refreshTimer.current);
+    refreshTimer.current = setTimeout(refreshClients, 300);
+  });
 
   // Sync the old dark mode with the new theme system
   useEffect(() => {
@@ -19,7 +19,7 @@ const getCurrentUserInfo = () => {
   return null;
 };
 
-const API_BASE_URL = 'http://localhost:8000';
+export const API_BASE_URL = 'http://localhost:8000';
 
 interface CreateClientPayload {
   id: string;